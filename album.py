@@ -0,0 +1,89 @@
+"""
+Сборка альбомов (media group) из отдельных обновлений.
+
+Telegram присылает каждое фото альбома отдельным сообщением с общим
+media_group_id. AlbumCollector копит части, пока они продолжают приходить
+(пауза ALBUM_WAIT_MS), и отдаёт весь альбом первому вызову collect();
+остальные части получают None и больше ничего не делают. Так альбом
+превращается в одну вставку, один ответ и одно объявление в группе.
+
+Сколько фото из альбомов превращается в билеты, ограничено на пользователя:
+не больше ALBUM_MAX_PHOTOS за окно ALBUM_LIMIT_WINDOW секунд, сколько бы
+альбомов он ни прислал. Лишние фото пропускаются (take()).
+
+Части альбома и лимиты считаются в пределах процесса: при WORKERS > 1 альбом,
+разошедшийся по разным воркерам, обработается несколькими частями.
+"""
+
+import asyncio
+import os
+import time
+from typing import Dict, List, Optional, Tuple
+
+from aiogram.types import Message
+
+
+ALBUM_WAIT_MS = float(os.getenv("ALBUM_WAIT_MS", "500"))
+# Сколько фото из альбомов одного пользователя превращать в билеты за ALBUM_LIMIT_WINDOW секунд
+ALBUM_MAX_PHOTOS = int(os.getenv("ALBUM_MAX_PHOTOS", "10"))
+ALBUM_LIMIT_WINDOW = float(os.getenv("ALBUM_LIMIT_WINDOW", "600"))
+# Сверх стольких пользователей с открытым окном просроченные окна вычищаются
+ALBUM_LIMIT_MAX_USERS = 10000
+
+
+class AlbumCollector:
+    """Буфер частей альбомов по (chat_id, media_group_id) и лимит фото на пользователя."""
+
+    def __init__(
+        self,
+        wait: float = ALBUM_WAIT_MS / 1000,
+        max_photos: int = ALBUM_MAX_PHOTOS,
+        window: float = ALBUM_LIMIT_WINDOW,
+    ) -> None:
+        self._wait = wait
+        self.max_photos = max(1, max_photos)
+        self.window = window
+        self._albums: Dict[Tuple[int, str], List[Message]] = {}
+        # user_id -> (начало окна, сколько фото в нём уже принято)
+        self._taken: Dict[int, Tuple[float, int]] = {}
+
+    async def collect(self, message: Message) -> Optional[List[Message]]:
+        """Для первой части ждёт остальные и возвращает альбом по порядку; для остальных — None."""
+        key = (message.chat.id, message.media_group_id)
+        parts = self._albums.get(key)
+        if parts is not None:
+            parts.append(message)
+            return None
+        parts = self._albums[key] = [message]
+        try:
+            received = 0
+            while received != len(parts):
+                received = len(parts)
+                await asyncio.sleep(self._wait)
+        finally:
+            self._albums.pop(key, None)
+        parts.sort(key=lambda m: m.message_id)
+        return parts
+
+    def take(self, user_id: int, count: int, now: Optional[float] = None) -> int:
+        """Сколько из count фото очередного альбома пользователя принять; столько и списывается с лимита."""
+        if now is None:
+            now = time.monotonic()
+        started, taken = self._taken.get(user_id, (now, 0))
+        if now - started >= self.window:
+            started, taken = now, 0
+        accepted = max(0, min(count, self.max_photos - taken))
+        self._taken[user_id] = (started, taken + accepted)
+        if len(self._taken) > ALBUM_LIMIT_MAX_USERS:
+            self._prune(now)
+        return accepted
+
+    def _prune(self, now: float) -> None:
+        for user_id in [u for u, (started, _) in self._taken.items() if now - started >= self.window]:
+            del self._taken[user_id]
+
+    def __len__(self) -> int:
+        return len(self._albums)
+
+
+albums = AlbumCollector()
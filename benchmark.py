@@ -0,0 +1,428 @@
+"""
+Нагрузочный стенд бота.
+
+Прогоняет синтетические обновления (Message / CallbackQuery) через настоящий
+набор обработчиков из bot.build_dispatcher(). Bot API подменяется локальной
+заглушкой в отдельном процессе, чтобы её работа не влияла на замеры.
+
+Для каждого размера таблицы создаётся чистая временная база, заполняется
+билетами и по очереди проходят сценарии:
+- загрузка фото;
+- «Мои билеты»;
+- розыгрыш одного и нескольких победителей;
+- отклонение с перерозыгрышем;
+- архивация.
+
+Результат — JSON с p50/p95/p99, пропускной способностью и временем в БД по
+каждому обработчику. Его удобно сравнивать между релизами.
+
+Запуск:
+    python benchmark.py --sizes 10000,100000,1000000 --concurrency 32 --output bench.json
+
+Настройки БД и движков (DB_BATCH_ENABLED, DRAW_ENGINE, DB_READERS и т.д.)
+берутся из окружения, как у самого бота, и попадают в отчёт.
+"""
+
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import platform
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+
+ADMIN_ID = 1
+GROUP_CHAT_ID = -1000000000001
+USER_ID_BASE = 1_000_000
+# Свежая база открывает одну лотерею — № 1
+LOTTERY_ID = 1
+SEED_CHUNK = 50_000
+
+# Переменные окружения, влияющие на производительность, — сохраняются в отчёт
+REPORTED_ENV = (
+    "DB_READERS",
+    "DB_SYNCHRONOUS",
+    "DB_CACHE_SIZE",
+    "DB_MMAP_SIZE",
+    "DB_BATCH_ENABLED",
+    "DB_BATCH_MAX_LATENCY_MS",
+    "DB_BATCH_MAX_SIZE",
+    "DRAW_ENGINE",
+    "FSM_CACHE_SIZE",
+    "FSM_FLUSH_INTERVAL",
+    "USER_TICKETS_CACHE_BYTES",
+    "TICKETS_PAGE_SIZE",
+    "DIGEST_WINDOW",
+)
+
+Step = Tuple[str, float, bool]  # (обработчик, секунды, успешно)
+
+
+def _serve_fake_api(port_queue: "multiprocessing.Queue") -> None:
+    """Заглушка Bot API: на send*/edit* отвечает сообщением, на остальное — True."""
+    from aiohttp import web
+
+    counter = {"message_id": 0}
+
+    async def handle(request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        data = await request.post()
+        if method == "getMe":
+            result: Any = {"id": 42, "is_bot": True, "first_name": "bench", "username": "bench_bot"}
+        elif method.startswith(("send", "edit")):
+            counter["message_id"] += 1
+            try:
+                chat_id = int(data.get("chat_id") or 0)
+            except ValueError:
+                chat_id = 0
+            result = {
+                "message_id": counter["message_id"],
+                "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private"},
+            }
+        else:
+            result = True
+        return web.json_response({"ok": True, "result": result})
+
+    async def serve() -> None:
+        app = web.Application()
+        app.router.add_post("/bot{token}/{method}", handle)
+        runner = web.AppRunner(app, access_log=None)
+        await runner.setup()
+        site = web.TCPSite(runner, "127.0.0.1", 0)
+        await site.start()
+        port_queue.put(site._server.sockets[0].getsockname()[1])
+        await asyncio.Event().wait()
+
+    asyncio.run(serve())
+
+
+def _percentile(sorted_values: List[float], q: float) -> float:
+    """Перцентиль по ближайшему рангу; значения уже отсортированы."""
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, round(q * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def _summarize(samples: List[float], errors: int, elapsed: float) -> Dict[str, Any]:
+    values = sorted(s * 1000 for s in samples)
+    return {
+        "count": len(values),
+        "errors": errors,
+        "throughput_rps": len(values) / elapsed if elapsed else 0.0,
+        "mean_ms": sum(values) / len(values) if values else 0.0,
+        "p50_ms": _percentile(values, 0.50),
+        "p95_ms": _percentile(values, 0.95),
+        "p99_ms": _percentile(values, 0.99),
+        "max_ms": values[-1] if values else 0.0,
+    }
+
+
+class Bench:
+    """Состояние одного прогона: бот, диспетчер и генератор синтетических обновлений."""
+
+    def __init__(self, api_url: str, rng: random.Random, users: int) -> None:
+        import bot as app
+        from config import Settings
+
+        self.app = app
+        self.rng = rng
+        self.users = users
+        self.settings = Settings(
+            bot_token=os.environ["BOT_TOKEN"],
+            admin_ids=[ADMIN_ID],
+            group_chat_id=GROUP_CHAT_ID,
+            telegram_api_url=api_url,
+        )
+        app._settings = self.settings
+        self.bot = app.build_bot(self.settings)
+        self.dp = app.build_dispatcher()
+        self._update_id = 0
+        self._message_id = 0
+
+    def random_user(self) -> int:
+        # Квадрат равномерного — немного «тяжёлых» участников с большим числом билетов
+        return USER_ID_BASE + int(self.users * self.rng.random() ** 2)
+
+    def _user(self, user_id: int) -> Dict[str, Any]:
+        return {"id": user_id, "is_bot": False, "first_name": "bench", "username": f"user{user_id}"}
+
+    def _message(self, user_id: int, **fields: Any) -> Dict[str, Any]:
+        self._message_id += 1
+        return {
+            "message_id": self._message_id,
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private"},
+            "from": self._user(user_id),
+            **fields,
+        }
+
+    def text(self, user_id: int, text: str) -> Dict[str, Any]:
+        return {"message": self._message(user_id, text=text)}
+
+    def photo(self, user_id: int) -> Dict[str, Any]:
+        file_id = f"bench-{user_id}-{self._message_id}"
+        size = {"file_id": file_id, "file_unique_id": file_id, "width": 1280, "height": 960, "file_size": 200_000}
+        return {"message": self._message(user_id, photo=[size])}
+
+    def callback(self, user_id: int, data: str, reply_markup: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        message = self._message(user_id, text="bench")
+        message["from"] = {"id": 42, "is_bot": True, "first_name": "bench"}
+        if reply_markup is not None:
+            message["reply_markup"] = reply_markup
+        return {
+            "callback_query": {
+                "id": str(self._message_id),
+                "from": self._user(user_id),
+                "chat_instance": "bench",
+                "data": data,
+                "message": message,
+            }
+        }
+
+    async def feed(self, label: str, payload: Dict[str, Any]) -> Step:
+        from aiogram.types import Update
+
+        self._update_id += 1
+        update = Update.model_validate({"update_id": self._update_id, **payload}, context={"bot": self.bot})
+        started = time.perf_counter()
+        try:
+            await self.dp.feed_update(self.bot, update)
+            ok = True
+        except Exception:
+            ok = False
+        return label, time.perf_counter() - started, ok
+
+    async def close(self) -> None:
+        await self.dp.storage.close()
+        await self.bot.session.close()
+
+
+# Сценарии: один вызов — одна пользовательская операция из одного или нескольких обновлений
+
+async def scenario_upload(bench: Bench) -> List[Step]:
+    user_id = bench.random_user()
+    return [
+        await bench.feed("upload_start", bench.text(user_id, "📸 Загрузить новое фото")),
+        await bench.feed("upload_photo", bench.photo(user_id)),
+    ]
+
+
+async def scenario_my_tickets(bench: Bench) -> List[Step]:
+    user_id = bench.random_user()
+    return [
+        await bench.feed("my_tickets", bench.text(user_id, "🎟 Посмотреть мои лотерейные билетики")),
+        await bench.feed("my_tickets_next_page", bench.callback(user_id, f"tickets_page:{LOTTERY_ID}:next:0")),
+    ]
+
+
+async def scenario_draw(bench: Bench) -> List[Step]:
+    return [await bench.feed("draw", bench.text(ADMIN_ID, "🎲 Запустить розыгрыш"))]
+
+
+async def scenario_draw_many(bench: Bench) -> List[Step]:
+    return [await bench.feed("draw_many", bench.callback(ADMIN_ID, f"draw_many:{LOTTERY_ID}:10:user_weighted"))]
+
+
+async def scenario_reject_redraw(bench: Bench) -> List[Step]:
+    from db import get_random_active_ticket
+
+    ticket = await get_random_active_ticket(LOTTERY_ID)
+    if not ticket:
+        return []
+    number = ticket.ticket_number
+    markup = {"inline_keyboard": [[
+        {"text": "✅", "callback_data": f"confirm_win:{LOTTERY_ID}:{number}"},
+        {"text": "❌", "callback_data": f"reject_win:{LOTTERY_ID}:{number}"},
+    ]]}
+    return [
+        await bench.feed("reject_start", bench.callback(ADMIN_ID, f"reject_win:{LOTTERY_ID}:{number}", markup)),
+        await bench.feed("reject_reason_redraw", bench.text(ADMIN_ID, "benchmark")),
+    ]
+
+
+async def scenario_archive(bench: Bench) -> List[Step]:
+    return [await bench.feed("archive", bench.text(ADMIN_ID, "📦 Архивировать лотерею"))]
+
+
+async def run_phase(
+    bench: Bench,
+    scenario: Callable[[Bench], Awaitable[List[Step]]],
+    requests: int,
+    concurrency: int,
+) -> Dict[str, Any]:
+    """Выполняет requests операций в concurrency параллельных потоков и собирает статистику."""
+    from db import query_stats
+
+    samples: Dict[str, List[float]] = {}
+    errors: Dict[str, int] = {}
+    remaining = [requests]
+
+    async def worker() -> None:
+        while remaining[0] > 0:
+            remaining[0] -= 1
+            for label, elapsed, ok in await scenario(bench):
+                samples.setdefault(label, []).append(elapsed)
+                if not ok:
+                    errors[label] = errors.get(label, 0) + 1
+
+    query_stats.reset()
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(max(1, min(concurrency, requests)))))
+    elapsed = time.perf_counter() - started
+    queries = query_stats.snapshot()
+    db_total_ms = sum(q["total_ms"] for q in queries.values())
+    return {
+        "requests": requests,
+        "concurrency": concurrency,
+        "elapsed_s": elapsed,
+        "throughput_ops": requests / elapsed if elapsed else 0.0,
+        "handlers": {label: _summarize(values, errors.get(label, 0), elapsed) for label, values in samples.items()},
+        "db": {
+            "total_ms": db_total_ms,
+            "per_op_ms": db_total_ms / requests if requests else 0.0,
+            "queries": queries,
+        },
+    }
+
+
+async def seed_tickets(size: int, users: int, rng: random.Random) -> float:
+    """Заполняет пустую базу size активными билетами в одной транзакции."""
+    import db
+
+    started = time.perf_counter()
+    async with db.pool.write() as conn:
+        for first in range(1, size + 1, SEED_CHUNK):
+            rows = []
+            for number in range(first, min(size, first + SEED_CHUNK - 1) + 1):
+                user_id = USER_ID_BASE + int(users * rng.random() ** 2)
+                rows.append((number, user_id, f"user{user_id}", f"seed-{number}", f"seed-{number}", None, LOTTERY_ID))
+            await conn.executemany(db.INSERT_TICKET_SQL, rows)
+        await conn.execute(
+            "UPDATE ticket_sequence SET value = ? WHERE name = ?",
+            (size, db.ticket_sequence_name(LOTTERY_ID)),
+        )
+    return time.perf_counter() - started
+
+
+def _remove_db_files(path: str) -> None:
+    for suffix in ("", "-wal", "-shm"):
+        Path(path + suffix).unlink(missing_ok=True)
+
+
+async def run_size(size: int, args: argparse.Namespace, api_url: str) -> Dict[str, Any]:
+    import db
+    from digest import digest
+    from outbox import outbox
+
+    rng = random.Random(args.seed)
+    users = args.users or max(1, size // 10)
+    _remove_db_files(db.DB_PATH)
+    db.user_tickets.clear()
+
+    await db.init_db()
+    seed_s = await seed_tickets(size, users, rng)
+    # Переоткрываем базу, чтобы индекс розыгрыша в памяти собрался как при обычном старте
+    await db.close_db()
+    started = time.perf_counter()
+    await db.init_db()
+    startup_s = time.perf_counter() - started
+
+    bench = Bench(api_url, rng, users)
+    outbox.start(bench.bot)
+    draw_requests = min(args.requests, args.draw_requests)
+    phases: Dict[str, Any] = {}
+    try:
+        phases["upload"] = await run_phase(bench, scenario_upload, args.requests, args.concurrency)
+        phases["my_tickets"] = await run_phase(bench, scenario_my_tickets, args.requests, args.concurrency)
+        # Розыгрыши идут под общей блокировкой, а FSM админа одно, поэтому — последовательно
+        phases["draw"] = await run_phase(bench, scenario_draw, draw_requests, 1)
+        phases["draw_many"] = await run_phase(bench, scenario_draw_many, draw_requests, 1)
+        phases["reject_redraw"] = await run_phase(bench, scenario_reject_redraw, draw_requests, 1)
+        phases["archive"] = await run_phase(bench, scenario_archive, 1, 1)
+    finally:
+        await digest.stop()
+        await outbox.stop(timeout=1.0)
+        await bench.close()
+        await db.close_db()
+    return {
+        "tickets": size,
+        "users": users,
+        "seed_s": seed_s,
+        "startup_s": startup_s,
+        "phases": phases,
+    }
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Нагрузочный стенд лотерейного бота")
+    parser.add_argument("--sizes", default="10000,100000,1000000", help="размеры таблицы билетов через запятую")
+    parser.add_argument("--users", type=int, default=0, help="число участников (по умолчанию размер / 10)")
+    parser.add_argument("--requests", type=int, default=1000, help="операций в каждом сценарии")
+    parser.add_argument("--draw-requests", type=int, default=100, help="операций в сценариях розыгрыша")
+    parser.add_argument("--concurrency", type=int, default=32, help="параллельных пользователей")
+    parser.add_argument("--seed", type=int, default=1, help="зерно генератора синтетических данных")
+    parser.add_argument("--db", help="путь к временной базе (будет перезаписан)")
+    parser.add_argument("--output", help="куда записать JSON (по умолчанию stdout)")
+    return parser.parse_args(argv)
+
+
+async def run(args: argparse.Namespace, api_url: str) -> Dict[str, Any]:
+    results = []
+    for size in (int(s) for s in args.sizes.split(",") if s.strip()):
+        print(f"Билетов: {size}...", file=sys.stderr)
+        results.append(await run_size(size, args, api_url))
+    return {
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "sqlite": sqlite3.sqlite_version,
+        "platform": platform.platform(),
+        "args": vars(args),
+        "env": {name: os.environ[name] for name in REPORTED_ENV if name in os.environ},
+        "results": results,
+    }
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    args = parse_args(argv)
+    # Модули бота читают настройки при импорте, поэтому окружение готовим до импорта
+    db_path = args.db or os.path.join(tempfile.mkdtemp(prefix="lottery-bench-"), "bench.sqlite")
+    os.environ["DB_PATH"] = db_path
+    os.environ["WORKERS"] = "1"
+    os.environ.setdefault("BOT_TOKEN", "123456:BENCHMARK")
+    # Заглушка не ограничивает скорость, так что и очередь в группу не сдерживаем
+    os.environ.setdefault("OUTBOX_CHAT_RATE", "1000000")
+    os.environ.setdefault("OUTBOX_GLOBAL_RATE", "1000000")
+    # Стенд меряет обработчики, а не антифлуд: синтетические пользователи шлют запросы без пауз
+    for action in ("UPLOAD", "VIEW", "CALLBACK"):
+        os.environ.setdefault(f"THROTTLE_{action}_RATE", "0")
+
+    ctx = multiprocessing.get_context("spawn")
+    port_queue = ctx.Queue()
+    api = ctx.Process(target=_serve_fake_api, args=(port_queue,), daemon=True, name="fake-bot-api")
+    api.start()
+    try:
+        api_url = f"http://127.0.0.1:{port_queue.get(timeout=30)}"
+        report = asyncio.run(run(args, api_url))
+    finally:
+        api.terminate()
+        api.join()
+        _remove_db_files(db_path)
+
+    data = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        Path(args.output).write_text(data, encoding="utf-8")
+    else:
+        print(data)
+
+
+if __name__ == "__main__":
+    main()
@@ -4,29 +4,80 @@
 """
 
 import asyncio
-from typing import Optional
+import logging
+import multiprocessing
+import os
+import signal
+import time
+from typing import Any, Dict, List, Optional, Tuple
 
 from aiogram import Bot, Dispatcher, F
-from aiogram.filters import CommandStart
+from aiogram.filters import Command, CommandObject, CommandStart
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 from aiogram.types import CallbackQuery, Message, ContentType
 from aiogram.client.default import DefaultBotProperties
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.exceptions import TelegramAPIError, TelegramBadRequest
 
-from config import load_settings
+from config import Settings, load_settings
 from db import (
     init_db,
-    get_next_ticket_number,
+    close_db,
     add_ticket,
-    get_active_tickets_by_user,
+    add_tickets,
+    get_active_tickets_page,
     get_active_ticket_by_number,
     get_ticket_by_number_any_status,
-    set_ticket_status,
+    set_ticket_status_if_active,
     get_random_active_ticket,
+    draw_random_active_tickets,
     archive_lottery,
+    resume_archive,
+    user_owns_active_ticket,
+    get_unfinished_archives,
+    get_duplicate_report,
+    get_lottery,
+    create_lottery,
+    get_lottery_stats,
+    get_user_stats,
+    get_leaderboard,
+    count_selected_tickets,
+    set_selected_tickets_status,
+    DuplicatePhotoError,
+    LotteryClosedError,
+    EXPORT_TABLES,
+    Lottery,
 )
-from keyboards import admin_menu, user_menu, back_menu, lottery_inline_actions, user_tickets_inline_keyboard
-from utils import draw_lock, is_admin, parse_int_safe
+from keyboards import (
+    admin_menu,
+    user_menu,
+    back_menu,
+    lottery_inline_actions,
+    lottery_inline_actions_batch,
+    without_ticket_actions,
+    draw_many_mode_keyboard,
+    user_tickets_inline_keyboard,
+    lottery_select_keyboard,
+    moderation_confirm_keyboard,
+)
+import photo_hash
+from album import albums
+from digest import digest
+from metrics import METRICS_PORT, HandlerMetricsMiddleware, start_metrics_server
+from storage import SQLiteStorage
+from outbox import outbox, PRIORITY_MODERATION, PRIORITY_WINNER
+from webhook import run_webhook
+from menu import ACCESS_DENIED_TEXT, MenuRouter, RoleMiddleware
+from export import FORMATS as EXPORT_FORMATS, start_export, stop as stop_exports
+from lotteries import LotteryMiddleware, remember_lottery
+from moderation import SELECTION_HELP, format_moderation_notice, parse_selection
+from throttle import ThrottlingMiddleware
+from utils import DrawLock, LeaseLostError, draw_lock_for, forget_draw_lock, parse_int_safe
+
+
+logger = logging.getLogger(__name__)
 
 
 class AskTicketNumber(StatesGroup):
@@ -37,12 +88,35 @@ class AskTicketNumber(StatesGroup):
 class AskReason(StatesGroup):
     reject_reason = State()
     delete_reason = State()
+    # Причина указана, ждём кнопку подтверждения массовой модерации
+    moderation_confirm = State()
 
 
 class UploadPhoto(StatesGroup):
     waiting_for_photo = State()
 
 
+class AskWinnersCount(StatesGroup):
+    winners_count = State()
+
+
+LOTTERY_CLOSED_TEXT = (
+    "⚠️ Эта лотерея только что завершилась. Отправьте фото ещё раз — "
+    "оно попадёт в лотерею, открытую вместо неё."
+)
+
+DRAW_LOCK_LOST_TEXT = "⚠️ Розыгрыш прерван: блокировка перехвачена другим воркером. Повторите розыгрыш"
+
+# Как часто обновлять сообщение админу о прогрессе архивации, секунд
+ARCHIVE_PROGRESS_INTERVAL = 2.0
+
+# Сколько билетов показывать на одной странице «Мои билеты» (Telegram принимает до 100 кнопок)
+TICKETS_PAGE_SIZE = max(1, min(int(os.getenv("TICKETS_PAGE_SIZE", "20")), 98))
+
+# Ограничение на одну пачку: по две кнопки на билет, Telegram не принимает слишком большие клавиатуры
+MAX_WINNERS_PER_DRAW = 50
+
+
 # Глобальная переменная для settings
 _settings = None
 
@@ -51,9 +125,8 @@ def get_settings():
     return _settings
 
 
-async def start_menu(message: Message) -> None:
-    settings = get_settings()
-    if is_admin(message.from_user.id, settings.admin_ids):
+async def start_menu(message: Message, is_admin: bool) -> None:
+    if is_admin:
         await message.answer("Главное меню (админ)", reply_markup=admin_menu())
     else:
         await message.answer("Главное меню", reply_markup=user_menu())
@@ -62,10 +135,6 @@ async def start_menu(message: Message) -> None:
 async def check_settings(message: Message) -> None:
     """Команда для проверки настроек (только для админов)"""
     settings = get_settings()
-    if not is_admin(message.from_user.id, settings.admin_ids):
-        await message.answer("Недостаточно прав")
-        return
-    
     await message.answer(
         f"🔧 <b>Настройки бота:</b>\n\n"
         f"📱 <b>GROUP_CHAT_ID:</b> {settings.group_chat_id}\n"
@@ -75,13 +144,59 @@ async def check_settings(message: Message) -> None:
     )
 
 
-async def on_start(message: Message, state: FSMContext) -> None:
+async def on_start(message: Message, state: FSMContext, is_admin: bool) -> None:
+    await state.clear()
+    await start_menu(message, is_admin)
+
+
+def _announce_chat(lottery: Lottery) -> int:
+    """Куда публиковать объявления лотереи: её групповой чат или общий GROUP_CHAT_ID"""
+    return lottery.chat_id or get_settings().group_chat_id
+
+
+def _titled(lottery: Lottery, text: str) -> str:
+    # У лотереи по умолчанию нет названия — объявления выглядят как раньше
+    return f"{lottery.title}: {text}" if lottery.title else text
+
+
+def _callback_args(callback: CallbackQuery, count: int) -> Optional[List[str]]:
+    """Части callback_data после префикса; None — если их не count"""
+    parts = (callback.data or "").split(":")[1:]
+    return parts if len(parts) == count else None
+
+
+async def ask_lottery(message: Message, lottery: Optional[Lottery], lotteries: List[Lottery]) -> None:
+    """Выбор лотереи, с которой работает пользователь"""
+    if not lotteries:
+        await message.answer("Сейчас нет открытых лотерей")
+        return
+    await message.answer(
+        "🎯 Выберите лотерею",
+        reply_markup=lottery_select_keyboard(lotteries, lottery.id if lottery else None),
+    )
+
+
+async def lottery_selected_callback(callback: CallbackQuery, state: FSMContext, lotteries: List[Lottery]) -> None:
+    args = _callback_args(callback, 1)
+    lottery_id = parse_int_safe(args[0]) if args else None
+    lottery = next((item for item in lotteries if item.id == lottery_id), None)
+    if lottery is None:
+        await callback.answer("Эта лотерея уже завершена", show_alert=True)
+        return
+    await remember_lottery(state, lottery.id)
+    # Незаконченный ввод относился к прежней лотерее
     await state.clear()
-    await start_menu(message)
+    await callback.message.edit_text(f"🎯 Выбрана лотерея: {lottery.label}", parse_mode=None)
+    await callback.answer()
 
 
-async def start_photo_upload(message: Message, state: FSMContext) -> None:
+async def start_photo_upload(
+    message: Message, state: FSMContext, lottery: Optional[Lottery], lotteries: List[Lottery]
+) -> None:
     """Начало процесса загрузки фото"""
+    if lottery is None:
+        await ask_lottery(message, lottery, lotteries)
+        return
     await state.set_state(UploadPhoto.waiting_for_photo)
     await message.answer(
         "📸 <b>Загрузка фото для лотереи</b>\n\n"
@@ -97,10 +212,78 @@ async def start_photo_upload(message: Message, state: FSMContext) -> None:
     )
 
 
-async def handle_upload_photo(message: Message, state: FSMContext) -> None:
+async def _photo_fingerprint(message: Message, bot: Bot) -> Tuple[str, str, Optional[int]]:
+    """(file_id самого большого варианта, file_unique_id, перцептивный хэш или None)"""
+    largest_photo = max(message.photo, key=lambda p: p.file_size or 0)
+    phash = None
+    if photo_hash.is_available():
+        # Самый маленький вариант фото: для хэша 9x8 пикселей его хватает, а качать быстрее
+        smallest_photo = min(message.photo, key=lambda p: p.file_size or 0)
+        try:
+            phash = await photo_hash.compute_phash((await bot.download(smallest_photo.file_id)).getvalue())
+        except TelegramAPIError:
+            phash = None
+    return largest_photo.file_id, largest_photo.file_unique_id, phash
+
+
+async def handle_upload_album(album: List[Message], state: FSMContext, bot: Bot, lottery: Lottery) -> None:
+    """Альбом фото: все билеты одной транзакцией, один ответ и одно объявление в группе"""
+    message = album[0]
+    photos = [part for part in album if part.photo]
+    # Лимит общий на все альбомы пользователя за окно, а не на один альбом
+    accepted = albums.take(message.from_user.id, len(photos))
+    skipped = len(photos) - accepted
+    photos = photos[:accepted]
+    ticket_numbers: List[int] = []
+    duplicates: list = []
+    if photos:
+        fingerprints = await asyncio.gather(*(_photo_fingerprint(part, bot) for part in photos))
+        try:
+            ticket_numbers, duplicates = await add_tickets(
+                lottery.id, message.from_user.id, message.from_user.username, fingerprints
+            )
+        except LotteryClosedError:
+            await message.answer(LOTTERY_CLOSED_TEXT, reply_markup=back_menu())
+            return
+
+    notes = []
+    if duplicates:
+        notes.append(
+            f"♻️ Уже участвуют в лотерее, пропущено: {len(duplicates)} "
+            f"({', '.join(f'билет №{d.ticket_number}' for d in duplicates)})"
+        )
+    if skipped > 0:
+        notes.append(
+            f"✂️ Из альбомов принимается не больше {albums.max_photos} фото за "
+            f"{albums.window / 60:g} мин., лишние не учтены: {skipped}"
+        )
+    notes_text = "\n\n" + "\n".join(notes) if notes else ""
+
+    if not ticket_numbers:
+        # Остаёмся в ожидании фото: можно сразу отправить другие
+        await message.answer(
+            f"❌ Ни одно фото из альбома не принято.{notes_text}\n\n"
+            "Отправьте другие фото или нажмите '⬅️ В меню' для отмены.",
+            reply_markup=back_menu(),
+        )
+        return
+
+    await state.clear()
+    await message.answer(
+        f"✅ <b>Отлично!</b> Зарегистрировано билетов: {len(ticket_numbers)}\n\n"
+        f"🎟 <b>Номера: {', '.join(f'№{n}' for n in ticket_numbers)}</b>"
+        f"{notes_text}\n\n"
+        f"Теперь вы можете посмотреть свои билеты в главном меню.",
+        reply_markup=user_menu(),
+        parse_mode="HTML"
+    )
+    digest.add_many(_announce_chat(lottery), message.from_user.username or message.from_user.id, ticket_numbers)
+
+
+async def handle_upload_photo(
+    message: Message, state: FSMContext, bot: Bot, lottery: Optional[Lottery], lotteries: List[Lottery]
+) -> None:
     """Обработка загруженного фото"""
-    settings = get_settings()
-    
     # Проверяем, что мы в состоянии ожидания фото
     current_state = await state.get_state()
     if current_state != UploadPhoto.waiting_for_photo:
@@ -115,11 +298,38 @@ async def handle_upload_photo(message: Message, state: FSMContext) -> None:
         )
         return
     
+    if lottery is None:
+        await ask_lottery(message, lottery, lotteries)
+        return
+    
+    if message.media_group_id:
+        album = await albums.collect(message)
+        if album is not None:
+            await handle_upload_album(album, state, bot, lottery)
+        return
+
     # Обрабатываем фото
-    largest_photo = max(message.photo, key=lambda p: p.file_size or 0)
-    file_id = largest_photo.file_id
-    ticket_number = await get_next_ticket_number()
-    await add_ticket(ticket_number, message.from_user.id, message.from_user.username, file_id)
+    file_id, file_unique_id, phash = await _photo_fingerprint(message, bot)
+    try:
+        ticket_number = await add_ticket(
+            lottery.id,
+            message.from_user.id,
+            message.from_user.username,
+            file_id,
+            file_unique_id,
+            phash,
+        )
+    except DuplicatePhotoError as exc:
+        # Остаёмся в ожидании фото: можно сразу отправить другое
+        await message.answer(
+            f"❌ Это фото уже участвует в лотерее (билет №{exc.ticket_number}).\n\n"
+            "Отправьте другое фото или нажмите '⬅️ В меню' для отмены.",
+            reply_markup=back_menu(),
+        )
+        return
+    except LotteryClosedError:
+        await message.answer(LOTTERY_CLOSED_TEXT, reply_markup=back_menu())
+        return
     
     # Очищаем состояние
     await state.clear()
@@ -134,248 +344,639 @@ async def handle_upload_photo(message: Message, state: FSMContext) -> None:
     )
     
     # Уведомляем в группу
-    await message.bot.send_message(
-        chat_id=settings.group_chat_id,
-        text=f"🎟 Пользователь @{message.from_user.username or message.from_user.id} получил билет №{ticket_number}",
-    )
+    digest.add(_announce_chat(lottery), message.from_user.username or message.from_user.id, ticket_number)
 
 
-async def handle_my_tickets(message: Message) -> None:
-    rows = await get_active_tickets_by_user(message.from_user.id)
-    if not rows:
+def _tickets_page_text(total: int) -> str:
+    return f"🎟 Ваши активные билеты ({total} шт.):\n\nНажмите на номер билета, чтобы посмотреть фото:"
+
+
+async def handle_my_tickets(message: Message, lottery: Optional[Lottery], lotteries: List[Lottery]) -> None:
+    if lottery is None:
+        await ask_lottery(message, lottery, lotteries)
+        return
+    ticket_numbers, has_prev, has_next, total = await get_active_tickets_page(
+        lottery.id, message.from_user.id, limit=TICKETS_PAGE_SIZE
+    )
+    if not ticket_numbers:
         await message.answer("У вас нет активных билетов")
         return
     
-    # Извлекаем номера билетов из кортежей
-    ticket_numbers = [row[0] for row in rows]
+    # Создаем inline-клавиатуру с первой страницей билетов
+    keyboard = user_tickets_inline_keyboard(lottery.id, ticket_numbers, has_prev, has_next)
     
-    # Создаем inline-клавиатуру с номерами билетов
-    keyboard = user_tickets_inline_keyboard(ticket_numbers)
+    await message.answer(_tickets_page_text(total), reply_markup=keyboard)
+
+
+async def user_tickets_page_callback(callback: CallbackQuery) -> None:
+    """Листание списка билетов кнопками «Назад» / «Вперёд»"""
+    args = _callback_args(callback, 3)
+    lottery_id = parse_int_safe(args[0]) if args else None
+    edge_number = parse_int_safe(args[2]) if args else None
+    if lottery_id is None or edge_number is None or args[1] not in ("prev", "next"):
+        await callback.answer("Некорректный запрос", show_alert=True)
+        return
     
-    await message.answer(
-        f"🎟 Ваши активные билеты ({len(ticket_numbers)} шт.):\n\nНажмите на номер билета, чтобы посмотреть фото:",
-        reply_markup=keyboard
-    )
+    user_id = callback.from_user.id
+    if args[1] == "next":
+        page = await get_active_tickets_page(lottery_id, user_id, after=edge_number, limit=TICKETS_PAGE_SIZE)
+    else:
+        page = await get_active_tickets_page(lottery_id, user_id, before=edge_number, limit=TICKETS_PAGE_SIZE)
+    if not page[0]:
+        # Билеты этой страницы успели выбыть — показываем с начала
+        page = await get_active_tickets_page(lottery_id, user_id, limit=TICKETS_PAGE_SIZE)
+    ticket_numbers, has_prev, has_next, total = page
+    if not ticket_numbers:
+        await callback.message.edit_text("У вас нет активных билетов")
+        await callback.answer()
+        return
+    
+    try:
+        await callback.message.edit_text(
+            _tickets_page_text(total),
+            reply_markup=user_tickets_inline_keyboard(lottery_id, ticket_numbers, has_prev, has_next),
+        )
+    except TelegramBadRequest:
+        # Страница не изменилась (повторное нажатие) — редактировать нечего
+        pass
+    await callback.answer()
 
 
 
 
-async def admin_start_draw(message: Message) -> None:
-    settings = get_settings()
-    if not is_admin(message.from_user.id, settings.admin_ids):
-        await message.answer("Недостаточно прав")
+async def admin_start_draw(message: Message, lottery: Optional[Lottery], lotteries: List[Lottery]) -> None:
+    if lottery is None:
+        await ask_lottery(message, lottery, lotteries)
         return
-    if draw_lock.locked:
+    # Блокировка своя у каждой лотереи и общая для всех воркеров, работающих с этой базой
+    lock = draw_lock_for(lottery.id)
+    if not await lock.try_acquire():
         await message.answer("⏳ Розыгрыш уже идёт, дождитесь завершения")
         return
-    async with draw_lock:
-        ticket = await get_random_active_ticket()
+    try:
+        # Билеты, объявленные до розыгрыша, уходят в outbox сейчас; объявление победителя
+        # ставится after_queued и их не обгонит
+        digest.flush()
+        ticket = await get_random_active_ticket(lottery.id)
         if not ticket:
             await message.answer("⚠️ Нет активных билетов для розыгрыша")
             return
+        # Результат ещё нигде не записан: если блокировку перехватили, его можно просто отбросить
+        lock.ensure_held()
         # Отправляем фото с результатом розыгрыша админу для принятия решения
         await message.answer_photo(
-            ticket["file_id"],
-            caption=f"🎲 Выпал билет №{ticket['ticket_number']} (@{ticket['username']})",
-            reply_markup=lottery_inline_actions(ticket["ticket_number"]),
+            ticket.file_id,
+            caption=f"🎲 Выпал билет №{ticket.ticket_number} (@{ticket.username})",
+            reply_markup=lottery_inline_actions(lottery.id, ticket.ticket_number),
         )
+    except LeaseLostError:
+        await message.answer(DRAW_LOCK_LOST_TEXT)
+    finally:
+        await lock.release()
 
 
-async def admin_confirm_winner(callback: CallbackQuery) -> None:
-    settings = get_settings()
-    if not is_admin(callback.from_user.id, settings.admin_ids):
+async def admin_draw_many_ask(
+    message: Message, state: FSMContext, lottery: Optional[Lottery], lotteries: List[Lottery]
+) -> None:
+    if lottery is None:
+        await ask_lottery(message, lottery, lotteries)
+        return
+    await state.set_state(AskWinnersCount.winners_count)
+    await state.update_data(lottery_id=lottery.id)
+    await message.answer(
+        f"Сколько победителей разыграть? (от 1 до {MAX_WINNERS_PER_DRAW})",
+        reply_markup=back_menu(),
+    )
+
+
+async def admin_draw_many_count_input(message: Message, state: FSMContext) -> None:
+    count = parse_int_safe(message.text)
+    if count is None or not 1 <= count <= MAX_WINNERS_PER_DRAW:
+        await message.answer(f"Введите число от 1 до {MAX_WINNERS_PER_DRAW}")
+        return
+    data = await state.get_data()
+    await state.clear()
+    await message.answer("Выберите режим розыгрыша", reply_markup=draw_many_mode_keyboard(data["lottery_id"], count))
+
+
+async def admin_draw_many(callback: CallbackQuery, is_admin: bool) -> None:
+    if not is_admin:
         await callback.answer("Нет прав", show_alert=True)
         return
-    if not callback.data or not callback.data.startswith("confirm_win:"):
+    args = _callback_args(callback, 3)
+    lottery_id = parse_int_safe(args[0]) if args else None
+    count = parse_int_safe(args[1]) if args else None
+    mode = args[2] if args else None
+    if (
+        lottery_id is None
+        or count is None
+        or not 1 <= count <= MAX_WINNERS_PER_DRAW
+        or mode not in ("any", "user_weighted", "user_equal")
+    ):
+        await callback.answer("Некорректный запрос", show_alert=True)
         return
-    num = parse_int_safe(callback.data.split(":", 1)[1])
-    if num is None:
+    lock = draw_lock_for(lottery_id)
+    if not await lock.try_acquire():
+        await callback.answer("⏳ Розыгрыш уже идёт, дождитесь завершения", show_alert=True)
+        return
+    try:
+        digest.flush()
+        tickets = await draw_random_active_tickets(
+            lottery_id,
+            count,
+            one_per_user=mode != "any",
+            weight_by_tickets=mode == "user_weighted",
+        )
+        lock.ensure_held()
+    except LeaseLostError:
+        await callback.answer(DRAW_LOCK_LOST_TEXT, show_alert=True)
+        return
+    finally:
+        await lock.release()
+    await callback.message.edit_reply_markup(reply_markup=None)
+    if not tickets:
+        await callback.message.answer("⚠️ Нет активных билетов для розыгрыша")
+        await callback.answer()
+        return
+    lines = [f"{i}. билет №{t.ticket_number} (@{t.username})" for i, t in enumerate(tickets, start=1)]
+    note = f"\n\n⚠️ Активных билетов хватило только на {len(tickets)}" if len(tickets) < count else ""
+    await callback.message.answer(
+        f"🎲 Выпали билеты ({len(tickets)} шт.):\n" + "\n".join(lines) + note,
+        reply_markup=lottery_inline_actions_batch(lottery_id, [t.ticket_number for t in tickets]),
+    )
+    await callback.answer()
+
+
+async def admin_confirm_winner(callback: CallbackQuery, is_admin: bool) -> None:
+    if not is_admin:
+        await callback.answer("Нет прав", show_alert=True)
+        return
+    args = _callback_args(callback, 2)
+    lottery_id = parse_int_safe(args[0]) if args else None
+    num = parse_int_safe(args[1]) if args else None
+    lottery = await get_lottery(lottery_id) if lottery_id is not None else None
+    if lottery is None or num is None:
         await callback.answer("Некорректный номер", show_alert=True)
         return
-    ticket = await get_ticket_by_number_any_status(num)
-    if not ticket or ticket["status"] != "active":
+    ticket = await get_ticket_by_number_any_status(lottery.id, num)
+    # Условный UPDATE: повторное нажатие или второй админ/воркер не подтвердит победителя дважды
+    # (статус rejected — чтобы победитель больше не участвовал)
+    if not ticket or not await set_ticket_status_if_active(lottery.id, num, "rejected", None):
         await callback.answer("Билет недоступен", show_alert=True)
         return
-    await set_ticket_status(num, "rejected", None)  # чтобы победитель больше не участвовал
-    await callback.message.bot.send_message(
-        settings.group_chat_id,
-        f"🏆 Победитель: билет №{num} (@{ticket['username']})!",
+    outbox.enqueue(
+        _announce_chat(lottery),
+        _titled(lottery, f"🏆 Победитель: билет №{num} (@{ticket.username})!"),
+        PRIORITY_WINNER,
+        after_queued=True,
+    )
+    # В пачке победителей убираем только строку этого билета
+    await callback.message.edit_reply_markup(
+        reply_markup=without_ticket_actions(callback.message.reply_markup, lottery.id, num)
     )
-    await callback.message.edit_reply_markup(reply_markup=None)
     await callback.answer("Победитель опубликован")
 
 
-async def admin_reject_ticket_start(callback: CallbackQuery, state: FSMContext) -> None:
-    settings = get_settings()
-    if not is_admin(callback.from_user.id, settings.admin_ids):
+async def admin_reject_ticket_start(callback: CallbackQuery, state: FSMContext, is_admin: bool) -> None:
+    if not is_admin:
         await callback.answer("Нет прав", show_alert=True)
         return
-    if not callback.data or not callback.data.startswith("reject_win:"):
-        return
-    num = parse_int_safe(callback.data.split(":", 1)[1])
-    if num is None:
+    args = _callback_args(callback, 2)
+    lottery_id = parse_int_safe(args[0]) if args else None
+    num = parse_int_safe(args[1]) if args else None
+    if lottery_id is None or num is None:
         await callback.answer("Некорректный номер", show_alert=True)
         return
     await state.set_state(AskReason.reject_reason)
-    await state.update_data(ticket_number=num)
+    await state.update_data(lottery_id=lottery_id, ticket_number=num)
     await callback.message.answer("Укажите причину отклонения", reply_markup=back_menu())
     await callback.answer()
 
 
-async def admin_reject_reason_input(message: Message, state: FSMContext) -> None:
-    settings = get_settings()
-    if message.text == "⬅️ В меню":
-        await state.clear()
-        await start_menu(message)
-        return
+async def admin_reject_reason_input(
+    message: Message, state: FSMContext, is_admin: bool, lotteries: List[Lottery]
+) -> None:
     reason = message.text.strip()
     data = await state.get_data()
-    num = data.get("ticket_number")
-    await set_ticket_status(int(num), "rejected", reason)
-    await message.bot.send_message(
-        settings.group_chat_id,
-        f"🚫 Билет №{num} отклонён. Причина: {reason}",
-    )
+    num = int(data.get("ticket_number"))
+    lottery = await get_lottery(int(data.get("lottery_id")))
     await state.clear()
-    # Автозапуск нового розыгрыша
-    await admin_start_draw(message)
+    if lottery is None or not await set_ticket_status_if_active(lottery.id, num, "rejected", reason):
+        await message.answer(f"Билет №{num} уже обработан")
+        await start_menu(message, is_admin)
+        return
+    outbox.enqueue(
+        _announce_chat(lottery),
+        _titled(lottery, f"🚫 Билет №{num} отклонён. Причина: {reason}"),
+        PRIORITY_MODERATION,
+        after_queued=True,
+    )
+    # Автозапуск нового розыгрыша в той же лотерее
+    await admin_start_draw(message, lottery, lotteries)
 
 
-async def admin_show_by_number_ask(message: Message, state: FSMContext) -> None:
+async def admin_show_by_number_ask(
+    message: Message, state: FSMContext, lottery: Optional[Lottery], lotteries: List[Lottery]
+) -> None:
+    if lottery is None:
+        await ask_lottery(message, lottery, lotteries)
+        return
     await state.set_state(AskTicketNumber.admin_view)
+    await state.update_data(lottery_id=lottery.id)
     await message.answer("Введите номер билета", reply_markup=back_menu())
 
 
 async def admin_show_by_number_input(message: Message, state: FSMContext) -> None:
-    if message.text == "⬅️ В меню":
-        await state.clear()
-        await start_menu(message)
-        return
     num = parse_int_safe(message.text)
     if num is None:
         await message.answer("Введите число")
         return
-    ticket = await get_ticket_by_number_any_status(num)
+    data = await state.get_data()
+    ticket = await get_ticket_by_number_any_status(data["lottery_id"], num)
     if not ticket:
         await message.answer("❌ Билет не найден")
         return
-    await message.answer_photo(ticket["file_id"], caption=f"Билет №{ticket['ticket_number']} (@{ticket['username']}) | статус: {ticket['status']}")
+    await message.answer_photo(ticket.file_id, caption=f"Билет №{ticket.ticket_number} (@{ticket.username}) | статус: {ticket.status}")
     await state.clear()
 
 
-async def admin_delete_ask(message: Message, state: FSMContext) -> None:
+async def admin_delete_ask(
+    message: Message, state: FSMContext, lottery: Optional[Lottery], lotteries: List[Lottery]
+) -> None:
+    if lottery is None:
+        await ask_lottery(message, lottery, lotteries)
+        return
     await state.set_state(AskTicketNumber.admin_delete)
-    await message.answer("Введите номер билета для удаления", reply_markup=back_menu())
+    await state.update_data(lottery_id=lottery.id)
+    await message.answer(f"Какие билеты удалить или отклонить?\n\n{SELECTION_HELP}", reply_markup=back_menu())
 
 
 async def admin_delete_number_input(message: Message, state: FSMContext) -> None:
-    if message.text == "⬅️ В меню":
-        await state.clear()
+    """Разбирает выбор билетов и показывает, сколько активных билетов под него попадает (пробный прогон)"""
+    try:
+        selection = parse_selection(message.text)
+    except ValueError as exc:
+        await message.answer(f"❌ {exc}\n\n{SELECTION_HELP}", parse_mode=None)
         return
-    num = parse_int_safe(message.text)
-    if num is None:
-        await message.answer("Введите число")
+    data = await state.get_data()
+    tickets, users = await count_selected_tickets(data["lottery_id"], selection)
+    if not tickets:
+        await message.answer("❌ Активных билетов под этот выбор нет. Введите другие номера")
         return
-    await state.update_data(ticket_number=num)
+    await state.update_data(selection=message.text)
     await state.set_state(AskReason.delete_reason)
-    await message.answer("Укажите причину удаления", reply_markup=back_menu())
+    await message.answer(
+        f"Найдено активных билетов: {tickets} (участников: {users}) — {selection.describe()}.\n"
+        "Укажите причину — она будет одна на все билеты",
+        reply_markup=back_menu(),
+        parse_mode=None,
+    )
 
 
 async def admin_delete_reason_input(message: Message, state: FSMContext) -> None:
-    settings = get_settings()
-    if message.text == "⬅️ В меню":
-        await state.clear()
-        await start_menu(message)
-        return
     reason = message.text.strip()
     data = await state.get_data()
-    num = int(data.get("ticket_number"))
-    await set_ticket_status(num, "deleted", reason)
-    await message.bot.send_message(
-        settings.group_chat_id,
-        f"🗑 Билет №{num} удалён. Причина: {reason}",
+    selection = parse_selection(data["selection"])
+    # Пересчитываем: за время ввода причины билеты могли измениться
+    tickets, users = await count_selected_tickets(data["lottery_id"], selection)
+    await state.update_data(reason=reason)
+    await state.set_state(AskReason.moderation_confirm)
+    await message.answer(
+        f"{selection.describe()}: активных билетов {tickets} (участников: {users}).\n"
+        f"Причина: {reason}\n\nЧто сделать с билетами?",
+        reply_markup=moderation_confirm_keyboard(data["lottery_id"], tickets),
+        parse_mode=None,
     )
+
+
+async def admin_moderate_callback(callback: CallbackQuery, state: FSMContext, is_admin: bool) -> None:
+    """Применяет массовую модерацию одним UPDATE и отправляет в группу одно объявление"""
+    if not is_admin:
+        await callback.answer("Нет прав", show_alert=True)
+        return
+    args = _callback_args(callback, 2)
+    lottery_id = parse_int_safe(args[0]) if args else None
+    status = args[1] if args else None
+    data = await state.get_data()
+    if (
+        lottery_id is None
+        or status not in ("deleted", "rejected", "cancel")
+        or await state.get_state() != AskReason.moderation_confirm.state
+        or data.get("lottery_id") != lottery_id
+    ):
+        await callback.answer("Запрос устарел, начните заново", show_alert=True)
+        return
+    if status == "cancel":
+        await state.clear()
+        await callback.message.edit_reply_markup(reply_markup=None)
+        await callback.answer("Отменено")
+        return
+    lottery = await get_lottery(lottery_id)
+    if lottery is None or lottery.archived:
+        await state.clear()
+        await callback.answer("Лотерея уже архивирована", show_alert=True)
+        return
+    # Та же блокировка, что у розыгрыша и архивации: билеты не меняются у них под ногами
+    lock = draw_lock_for(lottery_id)
+    if not await lock.try_acquire():
+        await callback.answer("⏳ Идёт розыгрыш или архивация, попробуйте чуть позже", show_alert=True)
+        return
+    try:
+        numbers = await set_selected_tickets_status(
+            lottery_id, parse_selection(data["selection"]), status, data["reason"]
+        )
+    finally:
+        await lock.release()
     await state.clear()
+    await callback.message.edit_reply_markup(reply_markup=None)
+    verb = "Удалено" if status == "deleted" else "Отклонено"
+    await callback.message.answer(f"✅ {verb} билетов: {len(numbers)}")
+    await callback.answer()
+    if numbers:
+        # Объявления о новых билетах, ждущие в сводке, должны уйти раньше объявления об их удалении:
+        # сводка уходит в outbox, а объявление ставится после всего, что уже ждёт отправки в этот чат
+        digest.flush()
+        outbox.enqueue(
+            _announce_chat(lottery),
+            _titled(lottery, format_moderation_notice(status, numbers, data["reason"])),
+            PRIORITY_MODERATION,
+            after_queued=True,
+        )
 
 
 async def user_view_ticket_callback(callback: CallbackQuery) -> None:
     """Обработчик нажатия на кнопку с номером билета"""
-    if not callback.data or not callback.data.startswith("view_ticket:"):
-        await callback.answer("Некорректный запрос", show_alert=True)
+    # Извлекаем лотерею и номер билета из callback_data
+    args = _callback_args(callback, 2)
+    lottery_id = parse_int_safe(args[0]) if args else None
+    num = parse_int_safe(args[1]) if args else None
+    if lottery_id is None or num is None:
+        await callback.answer("Некорректный номер билета", show_alert=True)
         return
     
-    # Извлекаем номер билета из callback_data
-    num = parse_int_safe(callback.data.split(":", 1)[1])
-    if num is None:
-        await callback.answer("Некорректный номер билета", show_alert=True)
+    # Чужой или уже неактивный билет отсекаем по кэшу «Мои билеты», не трогая БД
+    if user_owns_active_ticket(lottery_id, callback.from_user.id, num) is False:
+        await callback.answer("❌ Билет не найден или у вас нет к нему доступа", show_alert=True)
         return
     
     # Получаем билет
-    ticket = await get_active_ticket_by_number(num)
+    ticket = await get_active_ticket_by_number(lottery_id, num)
     if not ticket:
         await callback.answer("❌ Билет не найден или архивирован", show_alert=True)
         return
     
     # Проверяем, что билет принадлежит пользователю
-    if ticket["user_id"] != callback.from_user.id:
+    if ticket.user_id != callback.from_user.id:
         await callback.answer("❌ У вас нет доступа к этому билету", show_alert=True)
         return
     
     # Отправляем фото
     await callback.message.answer_photo(
-        ticket["file_id"], 
-        caption=f"🎟 Ваш билет №{ticket['ticket_number']}"
+        ticket.file_id, 
+        caption=f"🎟 Ваш билет №{ticket.ticket_number}"
     )
     await callback.answer()
 
 
-async def admin_archive(message: Message) -> None:
-    settings = get_settings()
-    await archive_lottery()
-    await message.bot.send_message(
-        settings.group_chat_id,
-        "📦 Лотерея завершена, все записи архивированы",
+async def show_stats(
+    message: Message, is_admin: bool, lottery: Optional[Lottery], lotteries: List[Lottery]
+) -> None:
+    """Статистика лотереи из счётчиков и таблицы лидеров — без подсчёта по таблице билетов"""
+    if lottery is None:
+        await ask_lottery(message, lottery, lotteries)
+        return
+    user_id = message.from_user.id
+    leaders = await get_leaderboard(lottery.id)
+    tickets, active = await get_user_stats(lottery.id, user_id)
+    lines = [f"📊 {lottery.label}", ""]
+    if is_admin:
+        stats = await get_lottery_stats(lottery.id)
+        lines += [
+            f"👥 Участников: {stats.get('participants', 0)}",
+            f"🎟 Активных билетов: {stats.get('active', 0)}",
+            f"🚫 Отклонено (и выиграло): {stats.get('rejected', 0)}",
+            f"🗑 Удалено: {stats.get('deleted', 0)}",
+            "",
+        ]
+    lines.append("🏆 Больше всего активных билетов:")
+    lines += [
+        f"{place}. @{username or leader_id} — {count}"
+        for place, (leader_id, username, count) in enumerate(leaders, start=1)
+    ] or ["пока никого"]
+    lines += ["", f"Ваши билеты: активных {active} из {tickets}"]
+    place = next((place for place, leader in enumerate(leaders, start=1) if leader[0] == user_id), None)
+    if place:
+        lines.append(f"Вы на {place}-м месте")
+    await message.answer("\n".join(lines), parse_mode=None)
+
+
+async def admin_duplicates_report(message: Message) -> None:
+    """Отчёт о повторно загруженных фото (только для админов)"""
+    report = await get_duplicate_report()
+    if not report["total"]:
+        await message.answer("Повторных фото пока не было")
+        return
+    offenders = "\n".join(
+        f"• @{username or user_id} — {attempts}" for user_id, username, attempts in report["offenders"]
+    )
+    recent = "\n".join(
+        f"• @{username or user_id} → билет №{original} ({'тот же файл' if match == 'file' else 'похожее фото'}), {created_at}"
+        for user_id, username, original, _, match, created_at in report["recent"]
+    )
+    await message.answer(
+        f"🧬 Отклонено повторных фото: {report['total']}\n\n"
+        f"Чаще всего:\n{offenders}\n\n"
+        f"Последние:\n{recent}",
+        parse_mode=None,
     )
 
 
-async def main() -> None:
-    global _settings
-    _settings = load_settings()
-    await init_db()
+def _archive_progress(status: Message, lock: DrawLock):
+    """
+    Прогресс архивации в одном сообщении админу, не чаще раза в ARCHIVE_PROGRESS_INTERVAL секунд.
+    Между порциями проверяет блокировку: потеряв её, архивация останавливается (LeaseLostError).
+    """
+    last_update = 0.0
 
-    bot = Bot(
-        token=_settings.bot_token,
-        default=DefaultBotProperties(parse_mode="HTML")
+    async def report(moved: int, total: int) -> None:
+        nonlocal last_update
+        lock.ensure_held()
+        now = time.monotonic()
+        if now - last_update < ARCHIVE_PROGRESS_INTERVAL:
+            return
+        last_update = now
+        try:
+            await status.edit_text(f"📦 Архивация: {moved} из {total} ({moved * 100 // max(total, 1)}%)")
+        except TelegramAPIError:
+            pass
+
+    return report
+
+
+async def admin_archive(message: Message, lottery: Optional[Lottery], lotteries: List[Lottery]) -> None:
+    if lottery is None:
+        await ask_lottery(message, lottery, lotteries)
+        return
+    # Пока билеты закрытой лотереи переносятся, розыгрыш по ним и вторая архивация недопустимы;
+    # остальные лотереи при этом разыгрываются и архивируются независимо
+    lock = draw_lock_for(lottery.id)
+    if not await lock.try_acquire():
+        await message.answer("⏳ Идёт розыгрыш или архивация, дождитесь завершения")
+        return
+    try:
+        # Объявления о билетах архивируемой лотереи должны уйти до сообщения об архивации:
+        # сводка уходит в outbox сейчас, а само сообщение ставится after_queued
+        digest.flush()
+        status = await message.answer(f"📦 Архивация «{lottery.label}» началась…", parse_mode=None)
+        moved = await archive_lottery(lottery.id, _archive_progress(status, lock))
+    except LeaseLostError:
+        # Перенесённые порции уже закоммичены, остальное доделает resume_unfinished_archive
+        try:
+            await status.edit_text("⚠️ Архивация прервана: блокировка потеряна, она продолжится при следующем запуске бота")
+        except TelegramAPIError:
+            pass
+        return
+    finally:
+        await lock.release()
+    forget_draw_lock(lottery.id)
+    try:
+        await status.edit_text(f"📦 Архивация завершена, перенесено билетов: {moved}")
+    except TelegramAPIError:
+        pass
+    outbox.enqueue(
+        _announce_chat(lottery),
+        _titled(lottery, "📦 Лотерея завершена, все записи архивированы"),
+        PRIORITY_MODERATION,
+        after_queued=True,
     )
-    dp = Dispatcher()
+
+
+EXPORT_USAGE = (
+    "Формат: /export [tickets|archive] [csv|jsonl] [lottery=N] [status=S] [user=ID]\n"
+    "Например: /export archive jsonl lottery=3"
+)
+
+
+def _parse_export_args(args: Optional[str]) -> Optional[Dict[str, Any]]:
+    """Аргументы команды /export; None — если не разобрались"""
+    options: Dict[str, Any] = {"table": "tickets", "fmt": "csv"}
+    for token in (args or "").split():
+        key, _, value = token.partition("=")
+        if not value and key in EXPORT_TABLES:
+            options["table"] = key
+        elif not value and key in EXPORT_FORMATS:
+            options["fmt"] = key
+        elif key == "status" and value:
+            options["status"] = value
+        elif key in ("lottery", "user") and parse_int_safe(value) is not None:
+            options["lottery_id" if key == "lottery" else "user_id"] = parse_int_safe(value)
+        else:
+            return None
+    return options
+
+
+async def admin_export(message: Message, bot: Bot, is_admin: bool, command: CommandObject) -> None:
+    """Выгрузка билетов или архива файлом (только для админов)"""
+    if not is_admin:
+        await message.answer(ACCESS_DENIED_TEXT)
+        return
+    options = _parse_export_args(command.args)
+    if options is None:
+        await message.answer(EXPORT_USAGE, parse_mode=None)
+        return
+    start_export(bot, message.chat.id, **options)
+    await message.answer("⏳ Выгрузка началась, файл придёт сюда")
+
+
+async def admin_export_button(message: Message, bot: Bot) -> None:
+    start_export(bot, message.chat.id)
+    await message.answer(f"⏳ Выгружаю текущие билеты в CSV, файл придёт сюда.\n\n{EXPORT_USAGE}", parse_mode=None)
+
+
+NEW_LOTTERY_USAGE = (
+    "Формат: /new_lottery [chat_id] Название\n"
+    "В группе можно без chat_id — объявления пойдут в эту группу"
+)
+
+
+async def admin_new_lottery(message: Message, is_admin: bool, command: CommandObject) -> None:
+    """Открывает ещё одну лотерею со своей нумерацией (только для админов)"""
+    if not is_admin:
+        await message.answer(ACCESS_DENIED_TEXT)
+        return
+    first, _, rest = (command.args or "").strip().partition(" ")
+    chat_id = parse_int_safe(first)
+    if chat_id is None:
+        rest = f"{first} {rest}"
+        # Команда, отправленная в группе, открывает лотерею этой группы
+        chat_id = message.chat.id if message.chat.type in ("group", "supergroup") else None
+    title = rest.strip()
+    if not title:
+        await message.answer(NEW_LOTTERY_USAGE, parse_mode=None)
+        return
+    lottery = await create_lottery(title, chat_id)
+    await message.answer(f"🎯 Открыта лотерея «{lottery.label}» (№{lottery.id})", parse_mode=None)
+
+
+def build_dispatcher() -> Dispatcher:
+    """Создаёт диспетчер со всеми обработчиками бота"""
+    # Состояния FSM переживают перезапуск; хранилище закрывается (со сбросом на диск) при остановке диспетчера
+    dp = Dispatcher(storage=SQLiteStorage())
+    # Время, ошибки и параллельные вызовы по каждому обработчику (см. metrics.py)
+    dp.message.middleware(HandlerMetricsMiddleware())
+    dp.callback_query.middleware(HandlerMetricsMiddleware())
+
+    # Роль отправителя определяется один раз на обновление (ADMIN_IDS — frozenset)
+    dp.update.outer_middleware(RoleMiddleware(get_settings().admin_ids))
+    # Лимиты частоты действий; обновления сверх лимита не доходят до БД (см. throttle.py)
+    dp.update.outer_middleware(ThrottlingMiddleware())
+    # Лотерея, к которой относится обновление (см. lotteries.py)
+    dp.update.outer_middleware(LotteryMiddleware())
 
     # Команды и меню
     dp.message.register(on_start, CommandStart())
+    dp.message.register(admin_export, Command("export"))
+    dp.message.register(admin_new_lottery, Command("new_lottery"))
+    dp.message.register(show_stats, Command("stats"))
+
+    # Кнопки меню: один обработчик и поиск по словарю вместо цепочки фильтров F.text.
+    # Регистрируется раньше обработчиков состояний, поэтому кнопка работает в любом
+    # состоянии, а «⬅️ В меню» всегда сбрасывает его.
+    menu = MenuRouter()
+    menu.add("⬅️ В меню", on_start)
+    menu.add("📸 Загрузить новое фото", start_photo_upload)
+    menu.add("🎟 Посмотреть мои лотерейные билетики", handle_my_tickets)
+    menu.add("🎯 Выбрать лотерею", ask_lottery)
+    menu.add("📊 Статистика", show_stats)
+    menu.add("🎲 Запустить розыгрыш", admin_start_draw, admin_only=True)
+    menu.add("🏆 Разыграть несколько победителей", admin_draw_many_ask, admin_only=True)
+    menu.add("📷 Показать фото по номеру", admin_show_by_number_ask, admin_only=True)
+    menu.add("🗑 Удалить билеты", admin_delete_ask, admin_only=True)
+    menu.add("📦 Архивировать лотерею", admin_archive, admin_only=True)
+    menu.add("🔧 Проверить настройки", check_settings, admin_only=True)
+    menu.add("🧬 Повторные фото", admin_duplicates_report, admin_only=True)
+    menu.add("📤 Выгрузить билеты", admin_export_button, admin_only=True)
+    dp.message.register(menu.dispatch, menu)
 
     # Пользовательские действия
-    dp.message.register(start_photo_upload, F.text == "📸 Загрузить новое фото")
     dp.message.register(handle_upload_photo, F.photo, UploadPhoto.waiting_for_photo)
-    dp.message.register(handle_my_tickets, F.text == "🎟 Посмотреть мои лотерейные билетики")
 
     # Админские действия
-    dp.message.register(admin_start_draw, F.text == "🎲 Запустить розыгрыш")
-    dp.message.register(admin_show_by_number_ask, F.text == "📷 Показать фото по номеру")
+    dp.message.register(admin_draw_many_count_input, AskWinnersCount.winners_count)
     dp.message.register(admin_show_by_number_input, AskTicketNumber.admin_view)
 
     dp.callback_query.register(admin_confirm_winner, F.data.startswith("confirm_win:"))
     dp.callback_query.register(admin_reject_ticket_start, F.data.startswith("reject_win:"))
+    dp.callback_query.register(admin_draw_many, F.data.startswith("draw_many:"))
     dp.callback_query.register(user_view_ticket_callback, F.data.startswith("view_ticket:"))
+    dp.callback_query.register(user_tickets_page_callback, F.data.startswith("tickets_page:"))
+    dp.callback_query.register(lottery_selected_callback, F.data.startswith("select_lottery:"))
+    dp.callback_query.register(admin_moderate_callback, F.data.startswith("moderate:"))
     dp.message.register(admin_reject_reason_input, AskReason.reject_reason)
 
-    dp.message.register(admin_delete_ask, F.text == "🗑 Удалить билетик")
     dp.message.register(admin_delete_number_input, AskTicketNumber.admin_delete)
     dp.message.register(admin_delete_reason_input, AskReason.delete_reason)
 
-    dp.message.register(start_menu, F.text == "⬅️ В меню")
-    
-    # Обработка отмены загрузки фото
-    dp.message.register(start_menu, F.text == "⬅️ В меню", UploadPhoto.waiting_for_photo)
-    
     # Обработка неправильного типа файла во время ожидания фото
     async def handle_wrong_file_type(message: Message, state: FSMContext) -> None:
         await message.answer(
@@ -387,14 +988,109 @@ async def main() -> None:
     
     dp.message.register(handle_wrong_file_type, UploadPhoto.waiting_for_photo)
 
-    # Архивирование
-    dp.message.register(admin_archive, F.text == "📦 Архивировать лотерею")
-    
-    # Проверка настроек
-    dp.message.register(check_settings, F.text == "🔧 Проверить настройки")
+    return dp
+
+
+def build_bot(settings: Settings) -> Bot:
+    session = None
+    if settings.telegram_api_url:
+        session = AiohttpSession(api=TelegramAPIServer.from_base(settings.telegram_api_url))
+    return Bot(
+        token=settings.bot_token,
+        session=session,
+        default=DefaultBotProperties(parse_mode="HTML")
+    )
+
+
+async def resume_unfinished_archive() -> None:
+    """Доводит до конца архивации, прерванные остановкой или падением бота"""
+    for lottery_id in await get_unfinished_archives():
+        lock = draw_lock_for(lottery_id)
 
-    await dp.start_polling(bot, allowed_updates=dp.resolve_used_update_types())
+        async def check_lock(moved: int, total: int, lock: DrawLock = lock) -> None:
+            lock.ensure_held()
+
+        async with lock:
+            try:
+                await resume_archive(lottery_id, check_lock)
+            except LeaseLostError:
+                logger.error("Архивация лотереи %s прервана: блокировка потеряна", lottery_id)
+                continue
+        forget_draw_lock(lottery_id)
+
+
+async def main(worker_index: int = 0) -> None:
+    global _settings
+    _settings = load_settings()
+    await init_db()
+
+    bot = build_bot(_settings)
+    dp = build_dispatcher()
+
+    outbox.start(bot)
+    resume_task = asyncio.create_task(resume_unfinished_archive()) if worker_index == 0 else None
+    # У каждого воркера свой порт метрик: счётчики живут в памяти процесса
+    metrics_runner = await start_metrics_server(port=METRICS_PORT + worker_index if METRICS_PORT else 0)
+    try:
+        if _settings.bot_mode == "webhook":
+            await run_webhook(dp, bot, _settings, register=worker_index == 0)
+        else:
+            # Если раньше бот работал через webhook, getUpdates без его снятия не заработает
+            await bot.delete_webhook()
+            await dp.start_polling(bot, allowed_updates=dp.resolve_used_update_types())
+    finally:
+        if resume_task is not None:
+            resume_task.cancel()
+            await asyncio.gather(resume_task, return_exceptions=True)
+        if metrics_runner is not None:
+            await metrics_runner.cleanup()
+        await stop_exports()
+        await digest.stop()
+        await outbox.stop()
+        photo_hash.shutdown()
+        await close_db()
+
+
+def run_worker(worker_index: int = 0) -> None:
+    """Точка входа процесса бота: по SIGTERM/SIGINT корректно дообрабатывает и закрывает ресурсы"""
+    async def runner() -> None:
+        task = asyncio.create_task(main(worker_index))
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            loop.add_signal_handler(sig, task.cancel)
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+
+    asyncio.run(runner())
+
+
+def run_workers(count: int) -> None:
+    """Запускает count процессов над общей базой; все слушают один порт webhook"""
+    ctx = multiprocessing.get_context("spawn")
+    processes = [
+        ctx.Process(target=run_worker, args=(index,), name=f"bot-worker-{index}")
+        for index in range(count)
+    ]
+    for process in processes:
+        process.start()
+
+    def stop(signum, frame) -> None:
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    for process in processes:
+        process.join()
 
 
 if __name__ == "__main__":
-    asyncio.run(main())
\ No newline at end of file
+    # Проверяем настройки до запуска воркеров, чтобы ошибка была одна и понятная
+    workers = load_settings().workers
+    if workers > 1:
+        run_workers(workers)
+    else:
+        run_worker()
\ No newline at end of file
@@ -2,10 +2,11 @@
 Загрузка и валидация переменных окружения для бота.
 """
 
+import hashlib
 import os
 from pathlib import Path
 from dataclasses import dataclass
-from typing import List
+from typing import List, Optional
 
 from dotenv import load_dotenv, find_dotenv
 
@@ -15,6 +16,18 @@ class Settings:
     bot_token: str
     admin_ids: List[int]
     group_chat_id: int
+    # Режим получения обновлений: polling или webhook
+    bot_mode: str = "polling"
+    webhook_url: Optional[str] = None
+    webhook_path: str = "/webhook"
+    webhook_host: str = "127.0.0.1"
+    webhook_port: int = 8080
+    webhook_secret: str = ""
+    webhook_concurrency: int = 64
+    # Альтернативный адрес Bot API (локальный telegram-bot-api или тестовая заглушка)
+    telegram_api_url: Optional[str] = None
+    # Число процессов, обслуживающих одну базу (см. get_workers)
+    workers: int = 1
 
 
 def _parse_admin_ids(value: str) -> List[int]:
@@ -32,6 +45,17 @@ def _parse_admin_ids(value: str) -> List[int]:
     return result
 
 
+def get_workers() -> int:
+    """Число процессов-воркеров бота (WORKERS). Больше одного — только в режиме webhook."""
+    try:
+        workers = int(os.getenv("WORKERS", "1"))
+    except ValueError as exc:
+        raise RuntimeError("WORKERS должен быть числом") from exc
+    if workers < 1:
+        raise RuntimeError("WORKERS должен быть не меньше 1")
+    return workers
+
+
 def load_settings() -> Settings:
     # 1) Пытаемся найти .env, поднимаясь от текущей рабочей директории
     env_path = find_dotenv(usecwd=True)
@@ -64,10 +88,48 @@ def load_settings() -> Settings:
     if not admin_ids:
         raise RuntimeError("Список ADMIN_IDS пуст. Укажите хотя бы одного администратора")
 
+    bot_mode = os.getenv("BOT_MODE", "polling").strip().lower()
+    if bot_mode not in ("polling", "webhook"):
+        raise RuntimeError("BOT_MODE должен быть polling или webhook")
+
+    webhook_url = os.getenv("WEBHOOK_URL", "").strip() or None
+    if bot_mode == "webhook" and not webhook_url:
+        raise RuntimeError("Для BOT_MODE=webhook укажите WEBHOOK_URL (публичный адрес за прокси)")
+
+    webhook_path = os.getenv("WEBHOOK_PATH", "/webhook").strip() or "/webhook"
+    if not webhook_path.startswith("/"):
+        webhook_path = "/" + webhook_path
+
+    try:
+        webhook_port = int(os.getenv("WEBHOOK_PORT", "8080"))
+        webhook_concurrency = int(os.getenv("WEBHOOK_CONCURRENCY", "64"))
+    except ValueError as exc:
+        raise RuntimeError("WEBHOOK_PORT и WEBHOOK_CONCURRENCY должны быть числами") from exc
+    if webhook_concurrency < 1:
+        raise RuntimeError("WEBHOOK_CONCURRENCY должен быть не меньше 1")
+
+    workers = get_workers()
+    if workers > 1 and bot_mode != "webhook":
+        raise RuntimeError("Несколько воркеров (WORKERS > 1) поддерживаются только в режиме BOT_MODE=webhook")
+
+    # Без явного секрета выводим его из токена: одинаковый у всех процессов и перезапусков
+    webhook_secret = os.getenv("WEBHOOK_SECRET", "").strip()
+    if not webhook_secret:
+        webhook_secret = hashlib.sha256(f"webhook:{bot_token}".encode()).hexdigest()[:32]
+
     return Settings(
         bot_token=bot_token,
         admin_ids=admin_ids,
         group_chat_id=group_chat_id,
+        bot_mode=bot_mode,
+        webhook_url=webhook_url,
+        webhook_path=webhook_path,
+        webhook_host=os.getenv("WEBHOOK_HOST", "127.0.0.1").strip() or "127.0.0.1",
+        webhook_port=webhook_port,
+        webhook_secret=webhook_secret,
+        webhook_concurrency=webhook_concurrency,
+        telegram_api_url=os.getenv("TELEGRAM_API_URL", "").strip() or None,
+        workers=workers,
     )
 
 
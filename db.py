@@ -2,17 +2,35 @@
 Асинхронные функции работы с SQLite для лотереи.
 
 Содержит:
-- инициализацию схемы
-- CRUD для билетов
+- пул соединений (один писатель + N читателей) в режиме WAL
+- замеры времени выполнения запросов
+- инициализацию и версионные миграции схемы (PRAGMA user_version)
+- CRUD для билетов (строки билетов — Ticket)
 - архивацию лотереи
 """
 
 from __future__ import annotations
+import asyncio
+import logging
 import os
+import sqlite3
+import time
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
 from pathlib import Path
 
 import aiosqlite
-from typing import Any, Dict, List, Optional, Tuple
+import secrets
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Iterable, List, NamedTuple, Optional, Sequence, Tuple
+
+from config import get_workers
+from draw import ActiveTicketIndex, GroupPicker, ReservoirSampler
+from leaderboard import Entry as LeaderboardEntry, TopK
+from moderation import TicketSelection
+from ticket_cache import UserTicketCache, page_of
+
+
+logger = logging.getLogger(__name__)
 
 
 # Путь к базе: по умолчанию — файл рядом с проектом
@@ -24,6 +42,54 @@ db_dir = os.path.dirname(DB_PATH)
 if db_dir:
     os.makedirs(db_dir, exist_ok=True)
 
+# Параметры пула и PRAGMA (значения по умолчанию рассчитаны на небольшой VPS)
+DB_READERS = int(os.getenv("DB_READERS", "4"))
+DB_SYNCHRONOUS = os.getenv("DB_SYNCHRONOUS", "NORMAL").strip().upper()
+DB_CACHE_SIZE = int(os.getenv("DB_CACHE_SIZE", "-16000"))  # отрицательное значение — в КиБ
+DB_MMAP_SIZE = int(os.getenv("DB_MMAP_SIZE", str(128 * 1024 * 1024)))
+DB_BUSY_TIMEOUT = int(os.getenv("DB_BUSY_TIMEOUT", "5000"))  # мс
+
+_SYNCHRONOUS_MODES = ("OFF", "NORMAL", "FULL", "EXTRA")
+if DB_SYNCHRONOUS not in _SYNCHRONOUS_MODES:
+    raise RuntimeError(f"DB_SYNCHRONOUS должен быть одним из: {', '.join(_SYNCHRONOUS_MODES)}")
+if DB_READERS < 1:
+    raise RuntimeError("DB_READERS должен быть не меньше 1")
+
+# Нумерация билетов после архивации: continue — продолжаем счётчик, reset — начинаем с №1
+TICKET_NUMBERING = os.getenv("TICKET_NUMBERING", "continue").strip().lower()
+if TICKET_NUMBERING not in ("continue", "reset"):
+    raise RuntimeError("TICKET_NUMBERING должен быть continue или reset")
+
+# Движок розыгрыша: memory — массив активных номеров в памяти, sql — случайный rowid по индексу
+DRAW_ENGINE = os.getenv("DRAW_ENGINE", "memory").strip().lower()
+if DRAW_ENGINE not in ("memory", "sql"):
+    raise RuntimeError("DRAW_ENGINE должен быть memory или sql")
+# Несколько процессов над одной базой: индекс в памяти одного воркера не видит билеты других
+SHARED_DB = get_workers() > 1
+if SHARED_DB:
+    DRAW_ENGINE = "sql"
+# Сколько раз sql-движок пробует случайный rowid, прежде чем выбрать билет по случайному рангу
+SQL_DRAW_ATTEMPTS = 16
+
+# Где искать повторно загруженное фото: lottery — среди билетов той же лотереи,
+# global — ещё и в архиве, off — не проверять
+DUPLICATE_SCOPE = os.getenv("DUPLICATE_SCOPE", "lottery").strip().lower()
+if DUPLICATE_SCOPE not in ("lottery", "global", "off"):
+    raise RuntimeError("DUPLICATE_SCOPE должен быть lottery, global или off")
+
+# Бюджет памяти кэша «Мои билеты» (0 — выключить). Другие воркеры меняют билеты
+# в обход кэша, поэтому при WORKERS > 1 он выключен.
+USER_TICKETS_CACHE_BYTES = int(os.getenv("USER_TICKETS_CACHE_BYTES", str(16 * 1024 * 1024)))
+
+# Сколько участников показывать в таблице лидеров
+LEADERBOARD_SIZE = max(1, int(os.getenv("LEADERBOARD_SIZE", "10")))
+
+# Групповая фиксация записей: вставки и смены статуса копятся до DB_BATCH_MAX_LATENCY_MS
+# или DB_BATCH_MAX_SIZE строк и пишутся одной транзакцией
+DB_BATCH_ENABLED = os.getenv("DB_BATCH_ENABLED", "0").strip() == "1"
+DB_BATCH_MAX_LATENCY_MS = float(os.getenv("DB_BATCH_MAX_LATENCY_MS", "5"))
+DB_BATCH_MAX_SIZE = int(os.getenv("DB_BATCH_MAX_SIZE", "100"))
+
 
 CREATE_SCHEMA_SQL = """
 CREATE TABLE IF NOT EXISTS tickets (
@@ -52,127 +118,1844 @@ CREATE TABLE IF NOT EXISTS lotteries (
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     archived_at TIMESTAMP
 );
+
+CREATE TABLE IF NOT EXISTS ticket_sequence (
+    name TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+
+INSERT INTO lotteries (created_at)
+SELECT CURRENT_TIMESTAMP WHERE NOT EXISTS (SELECT 1 FROM lotteries);
 """
 
+CREATE_INDEXES_SQL = """
+CREATE INDEX IF NOT EXISTS ix_tickets_user_status_number ON tickets(user_id, status, ticket_number);
+CREATE INDEX IF NOT EXISTS ix_tickets_active ON tickets(id) WHERE status = 'active';
+CREATE INDEX IF NOT EXISTS ix_tickets_archive_ticket_number ON tickets_archive(ticket_number);
+CREATE INDEX IF NOT EXISTS ix_tickets_archive_user ON tickets_archive(user_id);
+"""
 
-async def init_db() -> None:
-    async with aiosqlite.connect(DB_PATH) as db:
-        await db.executescript(CREATE_SCHEMA_SQL)
-        # Создаём запись о лотерее, если таблица пуста
-        cursor = await db.execute("SELECT COUNT(1) FROM lotteries")
+CREATE_FSM_SQL = """
+CREATE TABLE IF NOT EXISTS fsm_states (
+    key TEXT PRIMARY KEY,
+    state TEXT,
+    data TEXT NOT NULL DEFAULT '{}',
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS ix_fsm_states_updated_at ON fsm_states(updated_at);
+"""
+
+CREATE_LOCKS_SQL = """
+CREATE TABLE IF NOT EXISTS locks (
+    name TEXT PRIMARY KEY,
+    owner TEXT NOT NULL,
+    expires_at REAL NOT NULL
+);
+"""
+
+CREATE_DUPLICATES_SQL = """
+ALTER TABLE tickets ADD COLUMN file_unique_id TEXT;
+ALTER TABLE tickets ADD COLUMN phash INTEGER;
+ALTER TABLE tickets_archive ADD COLUMN file_unique_id TEXT;
+ALTER TABLE tickets_archive ADD COLUMN phash INTEGER;
+CREATE INDEX IF NOT EXISTS ix_tickets_file_unique_id ON tickets(file_unique_id) WHERE file_unique_id IS NOT NULL;
+CREATE INDEX IF NOT EXISTS ix_tickets_phash ON tickets(phash) WHERE phash IS NOT NULL;
+CREATE INDEX IF NOT EXISTS ix_tickets_archive_file_unique_id ON tickets_archive(file_unique_id) WHERE file_unique_id IS NOT NULL;
+CREATE INDEX IF NOT EXISTS ix_tickets_archive_phash ON tickets_archive(phash) WHERE phash IS NOT NULL;
+CREATE TABLE IF NOT EXISTS photo_duplicates (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id INTEGER NOT NULL,
+    username TEXT,
+    file_unique_id TEXT,
+    original_ticket_number INTEGER NOT NULL,
+    original_user_id INTEGER NOT NULL,
+    match TEXT NOT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+CREATE INDEX IF NOT EXISTS ix_photo_duplicates_user ON photo_duplicates(user_id);
+"""
+
+CREATE_LOTTERY_IDS_SQL = """
+ALTER TABLE tickets ADD COLUMN lottery_id INTEGER;
+ALTER TABLE tickets_archive ADD COLUMN lottery_id INTEGER;
+UPDATE tickets SET lottery_id = (SELECT MAX(id) FROM lotteries);
+UPDATE tickets_archive SET lottery_id = (
+    SELECT MIN(l.id) FROM lotteries l WHERE l.archived_at >= tickets_archive.archived_at
+);
+DROP INDEX IF EXISTS ux_tickets_ticket_number;
+CREATE UNIQUE INDEX IF NOT EXISTS ux_tickets_lottery_number ON tickets(lottery_id, ticket_number);
+CREATE INDEX IF NOT EXISTS ix_tickets_archive_lottery_number ON tickets_archive(lottery_id, ticket_number);
+"""
+
+CREATE_MULTI_LOTTERY_SQL = """
+ALTER TABLE lotteries ADD COLUMN title TEXT;
+ALTER TABLE lotteries ADD COLUMN chat_id INTEGER;
+DROP INDEX IF EXISTS ix_tickets_user_status_number;
+DROP INDEX IF EXISTS ix_tickets_active;
+CREATE INDEX IF NOT EXISTS ix_tickets_user_lottery ON tickets(user_id, lottery_id, status, ticket_number);
+CREATE INDEX IF NOT EXISTS ix_tickets_lottery_active ON tickets(lottery_id, id) WHERE status = 'active';
+CREATE INDEX IF NOT EXISTS ix_tickets_lottery_draw ON tickets(lottery_id, user_id, ticket_number) WHERE status = 'active';
+"""
+
+# Счётчики статистики ведут триггеры на tickets — в той же транзакции, что и сама запись.
+# Перенос в архив (DELETE из tickets) счётчики не трогает: закрытая лотерея сохраняет итоги.
+# lottery_stats: name — статус билета или participants (число участников).
+CREATE_STATS_SQL = """
+CREATE TABLE IF NOT EXISTS lottery_stats (
+    lottery_id INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    value INTEGER NOT NULL,
+    PRIMARY KEY (lottery_id, name)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS user_stats (
+    lottery_id INTEGER NOT NULL,
+    user_id INTEGER NOT NULL,
+    username TEXT,
+    tickets INTEGER NOT NULL,
+    active INTEGER NOT NULL,
+    PRIMARY KEY (lottery_id, user_id)
+) WITHOUT ROWID;
+
+CREATE INDEX IF NOT EXISTS ix_user_stats_rank ON user_stats(lottery_id, active);
+
+INSERT INTO user_stats (lottery_id, user_id, username, tickets, active)
+SELECT lottery_id, user_id, MAX(username), COUNT(*), SUM(status = 'active') FROM (
+    SELECT lottery_id, user_id, username, status FROM tickets
+    UNION ALL
+    SELECT lottery_id, user_id, username, status FROM tickets_archive WHERE lottery_id IS NOT NULL
+) GROUP BY lottery_id, user_id;
+
+INSERT INTO lottery_stats (lottery_id, name, value)
+SELECT lottery_id, status, COUNT(*) FROM (
+    SELECT lottery_id, status FROM tickets
+    UNION ALL
+    SELECT lottery_id, status FROM tickets_archive WHERE lottery_id IS NOT NULL
+) WHERE status IS NOT NULL GROUP BY lottery_id, status;
+
+INSERT INTO lottery_stats (lottery_id, name, value)
+SELECT lottery_id, 'participants', COUNT(*) FROM user_stats GROUP BY lottery_id;
+
+CREATE TRIGGER IF NOT EXISTS tr_tickets_stats_insert AFTER INSERT ON tickets
+BEGIN
+    INSERT INTO lottery_stats (lottery_id, name, value)
+    SELECT NEW.lottery_id, 'participants', 1
+    WHERE NOT EXISTS (SELECT 1 FROM user_stats WHERE lottery_id = NEW.lottery_id AND user_id = NEW.user_id)
+    ON CONFLICT (lottery_id, name) DO UPDATE SET value = value + 1;
+    INSERT INTO lottery_stats (lottery_id, name, value) VALUES (NEW.lottery_id, NEW.status, 1)
+    ON CONFLICT (lottery_id, name) DO UPDATE SET value = value + 1;
+    INSERT INTO user_stats (lottery_id, user_id, username, tickets, active)
+    VALUES (NEW.lottery_id, NEW.user_id, NEW.username, 1, NEW.status = 'active')
+    ON CONFLICT (lottery_id, user_id) DO UPDATE SET
+        username = excluded.username, tickets = tickets + 1, active = active + excluded.active;
+END;
+
+CREATE TRIGGER IF NOT EXISTS tr_tickets_stats_status AFTER UPDATE OF status ON tickets
+WHEN OLD.status IS NOT NEW.status
+BEGIN
+    UPDATE lottery_stats SET value = value - 1 WHERE lottery_id = OLD.lottery_id AND name = OLD.status;
+    INSERT INTO lottery_stats (lottery_id, name, value) VALUES (NEW.lottery_id, NEW.status, 1)
+    ON CONFLICT (lottery_id, name) DO UPDATE SET value = value + 1;
+    UPDATE user_stats SET active = active + (NEW.status = 'active') - (OLD.status = 'active')
+    WHERE lottery_id = NEW.lottery_id AND user_id = NEW.user_id;
+END;
+"""
+
+# Старое имя единственного счётчика номеров (до нескольких лотерей)
+LEGACY_TICKET_SEQUENCE = "tickets"
+
+# Кэш списка лотерей живёт LOTTERY_CACHE_TTL секунд, если лотереи могут меняться
+# другими воркерами; в одном процессе он сбрасывается при каждом изменении
+LOTTERY_CACHE_TTL = 5.0
+
+# Сколько билетов переносить в архив одной транзакцией
+ARCHIVE_CHUNK_SIZE = int(os.getenv("ARCHIVE_CHUNK_SIZE", "5000"))
+
+
+# Границы корзин гистограмм времени (в секундах) — общие для запросов и обработчиков
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+# Запросы дольше порога пишутся в лог (0 — не писать)
+DB_SLOW_QUERY_MS = float(os.getenv("DB_SLOW_QUERY_MS", "0"))
+
+
+class QueryStats:
+    """Накопительная статистика запросов по их именам: время, гистограмма и число строк."""
+
+    def __init__(self) -> None:
+        self._stats: Dict[str, List[Any]] = {}
+
+    def record(self, name: str, elapsed: float, rows: int = 0, sql: Optional[str] = None) -> None:
+        item = self._stats.get(name)
+        if item is None:
+            # [количество, суммарное время, максимум, строк, счётчики корзин гистограммы]
+            item = self._stats[name] = [0, 0.0, 0.0, 0, [0] * len(LATENCY_BUCKETS)]
+        item[0] += 1
+        item[1] += elapsed
+        if elapsed > item[2]:
+            item[2] = elapsed
+        item[3] += rows
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if elapsed <= bound:
+                item[4][i] += 1
+                break
+        if DB_SLOW_QUERY_MS > 0 and elapsed * 1000 >= DB_SLOW_QUERY_MS:
+            statement = " ".join(sql.split())[:300] if sql else "-"
+            logger.warning("Медленный запрос %s: %.1f мс, строк %s: %s", name, elapsed * 1000, rows, statement)
+
+    def snapshot(self) -> Dict[str, Dict[str, float]]:
+        return {
+            name: {
+                "count": int(count),
+                "total_ms": total * 1000,
+                "avg_ms": total * 1000 / count,
+                "max_ms": max_ * 1000,
+                "rows": rows,
+            }
+            for name, (count, total, max_, rows, _) in self._stats.items()
+        }
+
+    def histograms(self) -> Dict[str, Tuple[int, float, int, List[int]]]:
+        """{имя: (количество, суммарное время, строк, счётчики корзин LATENCY_BUCKETS)}."""
+        return {
+            name: (count, total, rows, list(buckets))
+            for name, (count, total, _, rows, buckets) in self._stats.items()
+        }
+
+    def reset(self) -> None:
+        self._stats.clear()
+
+
+query_stats = QueryStats()
+
+
+def get_query_stats() -> Dict[str, Dict[str, float]]:
+    return query_stats.snapshot()
+
+
+class ConnectionPool:
+    """
+    Долгоживущие соединения с БД: один писатель и несколько читателей.
+
+    В режиме WAL читатели не блокируются писателем, поэтому чтения
+    не ждут окончания записи. Все записи сериализуются через одно
+    соединение-писатель и asyncio.Lock.
+    """
+
+    def __init__(self, path: str, readers: int) -> None:
+        self._path = path
+        self._readers_count = readers
+        self._writer: Optional[aiosqlite.Connection] = None
+        self._readers: List[aiosqlite.Connection] = []
+        self._idle: Optional[asyncio.Queue] = None
+        self._write_lock = asyncio.Lock()
+
+    @property
+    def is_open(self) -> bool:
+        return self._writer is not None
+
+    async def _connect(self) -> aiosqlite.Connection:
+        # isolation_level=None: транзакции открываем явно (BEGIN IMMEDIATE в write())
+        conn = await aiosqlite.connect(self._path, isolation_level=None)
+        for pragma in (
+            f"PRAGMA busy_timeout = {DB_BUSY_TIMEOUT}",
+            f"PRAGMA synchronous = {DB_SYNCHRONOUS}",
+            f"PRAGMA cache_size = {DB_CACHE_SIZE}",
+            f"PRAGMA mmap_size = {DB_MMAP_SIZE}",
+            "PRAGMA temp_store = MEMORY",
+        ):
+            # Курсор закрываем сразу: незавершённый PRAGMA держит блокировку чтения
+            async with conn.execute(pragma):
+                pass
+        return conn
+
+    async def open(self) -> None:
+        if self.is_open:
+            return
+        writer = await self._connect()
+        async with writer.execute("PRAGMA journal_mode = WAL"):
+            pass
+        self._writer = writer
+        # Блокировку и очередь создаём заново: после close_db пул можно открыть в другом цикле событий
+        self._write_lock = asyncio.Lock()
+        self._idle = asyncio.Queue()
+        for _ in range(self._readers_count):
+            conn = await self._connect()
+            self._readers.append(conn)
+            self._idle.put_nowait(conn)
+
+    async def close(self) -> None:
+        if not self.is_open:
+            return
+        async with self._write_lock:
+            for conn in self._readers:
+                await conn.close()
+            self._readers.clear()
+            self._idle = None
+            await self._writer.close()
+            self._writer = None
+
+    def _ensure_open(self) -> None:
+        if not self.is_open:
+            raise RuntimeError("База данных не инициализирована: вызовите init_db()")
+
+    @asynccontextmanager
+    async def read(self) -> AsyncIterator[aiosqlite.Connection]:
+        self._ensure_open()
+        conn = await self._idle.get()
+        try:
+            yield conn
+        finally:
+            self._idle.put_nowait(conn)
+
+    @asynccontextmanager
+    async def write(self) -> AsyncIterator[aiosqlite.Connection]:
+        """Открывает транзакцию на соединении-писателе; commit при успехе, rollback при ошибке."""
+        self._ensure_open()
+        async with self._write_lock:
+            conn = self._writer
+            await conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield conn
+            except BaseException:
+                await conn.rollback()
+                raise
+            else:
+                await conn.commit()
+
+
+pool = ConnectionPool(DB_PATH, DB_READERS)
+# Индексы активных номеров для розыгрыша — у каждой открытой лотереи свой
+active_indexes: Dict[int, ActiveTicketIndex] = {}
+# Ключ кэша «Мои билеты» — (lottery_id, user_id)
+user_tickets = UserTicketCache(USER_TICKETS_CACHE_BYTES, enabled=not SHARED_DB)
+# Таблицы лидеров лотерей, которые уже запрашивали; при нескольких воркерах не кэшируются
+leaderboards: Dict[int, TopK] = {}
+
+
+def _active_index(lottery_id: int) -> ActiveTicketIndex:
+    index = active_indexes.get(lottery_id)
+    if index is None:
+        index = active_indexes[lottery_id] = ActiveTicketIndex(enabled=DRAW_ENGINE == "memory")
+    return index
+
+
+def _rowcount(cursor: aiosqlite.Cursor) -> int:
+    # Для SELECT sqlite3 возвращает -1
+    return max(cursor.rowcount, 0)
+
+
+async def _execute(conn: aiosqlite.Connection, name: str, sql: str, params: Iterable[Any] = ()) -> aiosqlite.Cursor:
+    started = time.perf_counter()
+    rows = 0
+    try:
+        cursor = await conn.execute(sql, params)
+        rows = _rowcount(cursor)
+        return cursor
+    finally:
+        query_stats.record(name, time.perf_counter() - started, rows, sql)
+
+
+async def _execute_many(conn: aiosqlite.Connection, name: str, sql: str, params: Iterable[Iterable[Any]]) -> None:
+    started = time.perf_counter()
+    rows = 0
+    try:
+        cursor = await conn.executemany(sql, params)
+        rows = _rowcount(cursor)
+        await cursor.close()
+    finally:
+        query_stats.record(name, time.perf_counter() - started, rows, sql)
+
+
+async def _fetchone(
+    conn: aiosqlite.Connection,
+    name: str,
+    sql: str,
+    params: Iterable[Any] = (),
+    row_factory: Optional[Callable[[sqlite3.Cursor, Tuple], Any]] = None,
+) -> Optional[Any]:
+    started = time.perf_counter()
+    row = None
+    try:
+        cursor = await conn.execute(sql, params)
+        cursor.row_factory = row_factory
         row = await cursor.fetchone()
-        if row and int(row[0]) == 0:
-            await db.execute("INSERT INTO lotteries DEFAULT VALUES")
-        await db.commit()
+        await cursor.close()
+        return row
+    finally:
+        query_stats.record(name, time.perf_counter() - started, int(row is not None), sql)
 
 
-async def get_next_ticket_number() -> int:
-    async with aiosqlite.connect(DB_PATH) as db:
-        cursor = await db.execute(
-            "SELECT COALESCE(MAX(ticket_number), 0) + 1 FROM tickets"
+async def _fetchall(
+    conn: aiosqlite.Connection,
+    name: str,
+    sql: str,
+    params: Iterable[Any] = (),
+    row_factory: Optional[Callable[[sqlite3.Cursor, Tuple], Any]] = None,
+) -> List[Any]:
+    started = time.perf_counter()
+    rows: List[Any] = []
+    try:
+        cursor = await conn.execute(sql, params)
+        cursor.row_factory = row_factory
+        rows = list(await cursor.fetchall())
+        await cursor.close()
+        return rows
+    finally:
+        query_stats.record(name, time.perf_counter() - started, len(rows), sql)
+
+
+async def _execute_script(db: aiosqlite.Connection, name: str, script: str) -> None:
+    """
+    Выполняет SQL-скрипт по одному выражению внутри текущей транзакции
+    (executescript сам делает COMMIT, поэтому в миграциях не подходит).
+    Точки с запятой внутри тела триггера выражение не разрывают.
+    """
+    statement = ""
+    for part in script.split(";"):
+        statement += part + ";"
+        if sqlite3.complete_statement(statement):
+            if statement.strip(" \n;"):
+                await _execute(db, name, statement)
+            statement = ""
+
+
+async def _migration_base_schema(db: aiosqlite.Connection) -> None:
+    await _execute_script(db, "migration_base_schema", CREATE_SCHEMA_SQL)
+
+
+async def _migration_ticket_sequence(db: aiosqlite.Connection) -> None:
+    """
+    Заводит счётчик номеров и уникальный индекс по номеру. Билетам-дубликатам,
+    оставшимся от старого MAX()+1, выдаются новые номера.
+    """
+    await _execute(
+        db,
+        "seed_ticket_sequence",
+        "INSERT OR IGNORE INTO ticket_sequence (name, value) VALUES (?, 0)",
+        (LEGACY_TICKET_SEQUENCE,),
+    )
+    sources = ["SELECT COALESCE(MAX(ticket_number), 0) FROM tickets"]
+    if TICKET_NUMBERING == "continue":
+        sources.append("SELECT COALESCE(MAX(ticket_number), 0) FROM tickets_archive")
+    for source in sources:
+        await _execute(
+            db,
+            "sync_ticket_sequence",
+            f"UPDATE ticket_sequence SET value = MAX(value, ({source})) WHERE name = ?",
+            (LEGACY_TICKET_SEQUENCE,),
         )
-        row = await cursor.fetchone()
-        return int(row[0]) if row else 1
+    duplicates = await _fetchall(
+        db,
+        "duplicate_tickets",
+        """
+        SELECT id FROM tickets
+        WHERE id NOT IN (SELECT MIN(id) FROM tickets GROUP BY ticket_number)
+        ORDER BY id
+        """,
+    )
+    for (ticket_id,) in duplicates:
+        number = await _bump_sequence(db, LEGACY_TICKET_SEQUENCE, 1)
+        await _execute(
+            db,
+            "renumber_ticket",
+            "UPDATE tickets SET ticket_number = ? WHERE id = ?",
+            (number, ticket_id),
+        )
+    await _execute(
+        db,
+        "create_unique_ticket_index",
+        "CREATE UNIQUE INDEX IF NOT EXISTS ux_tickets_ticket_number ON tickets(ticket_number)",
+    )
+
 
+async def _migration_hot_path_indexes(db: aiosqlite.Connection) -> None:
+    await _execute_script(db, "migration_hot_path_indexes", CREATE_INDEXES_SQL)
 
-async def add_ticket(ticket_number: int, user_id: int, username: Optional[str], file_id: str) -> int:
-    async with aiosqlite.connect(DB_PATH) as db:
+
+async def _migration_fsm_states(db: aiosqlite.Connection) -> None:
+    await _execute_script(db, "migration_fsm_states", CREATE_FSM_SQL)
+
+
+async def _migration_locks(db: aiosqlite.Connection) -> None:
+    await _execute_script(db, "migration_locks", CREATE_LOCKS_SQL)
+
+
+async def _migration_photo_duplicates(db: aiosqlite.Connection) -> None:
+    await _execute_script(db, "migration_photo_duplicates", CREATE_DUPLICATES_SQL)
+
+
+async def _migration_lottery_ids(db: aiosqlite.Connection) -> None:
+    """
+    Билеты и архив получают lottery_id. Старые записи архива относятся к первой
+    лотерее, закрытой не раньше их архивации. Номер уникален в пределах лотереи:
+    при TICKET_NUMBERING=reset новая лотерея начинается, пока старая ещё переносится.
+    """
+    await _execute_script(db, "migration_lottery_ids", CREATE_LOTTERY_IDS_SQL)
+
+
+async def _migration_multi_lottery(db: aiosqlite.Connection) -> None:
+    """
+    Несколько открытых лотерей: у лотереи появляются название и групповой чат,
+    у каждой — свой счётчик номеров, индексы билетов начинаются с lottery_id.
+    """
+    await _execute_script(db, "migration_multi_lottery", CREATE_MULTI_LOTTERY_SQL)
+    await _execute(
+        db,
+        "rename_ticket_sequence",
+        "UPDATE ticket_sequence SET name = 'lottery:' || (SELECT MAX(id) FROM lotteries) WHERE name = ?",
+        (LEGACY_TICKET_SEQUENCE,),
+    )
+
+
+async def _migration_stats(db: aiosqlite.Connection) -> None:
+    """Счётчики статистики: заполняются по уже имеющимся билетам, дальше их ведут триггеры."""
+    await _execute_script(db, "migration_stats", CREATE_STATS_SQL)
+
+
+# Миграции схемы: элемент с индексом i переводит базу на user_version = i + 1.
+# Новые шаги добавляются только в конец списка.
+MIGRATIONS: List[Callable[[aiosqlite.Connection], Awaitable[None]]] = [
+    _migration_base_schema,
+    _migration_ticket_sequence,
+    _migration_hot_path_indexes,
+    _migration_fsm_states,
+    _migration_locks,
+    _migration_photo_duplicates,
+    _migration_lottery_ids,
+    _migration_multi_lottery,
+    _migration_stats,
+]
+SCHEMA_VERSION = len(MIGRATIONS)
+
+
+async def _get_schema_version(db: aiosqlite.Connection) -> int:
+    row = await _fetchone(db, "user_version", "PRAGMA user_version")
+    return int(row[0]) if row else 0
+
+
+async def migrate() -> int:
+    """Доводит схему до SCHEMA_VERSION, каждый шаг — в отдельной транзакции. Возвращает итоговую версию."""
+    async with pool.read() as db:
+        version = await _get_schema_version(db)
+    if version == SCHEMA_VERSION:
+        return version
+    if version > SCHEMA_VERSION:
+        raise RuntimeError(
+            f"Версия схемы БД ({version}) новее, чем поддерживает бот ({SCHEMA_VERSION})"
+        )
+    for step_version in range(version + 1, SCHEMA_VERSION + 1):
+        async with pool.write() as db:
+            # Перепроверяем под блокировкой писателя: миграцию мог выполнить другой процесс
+            if await _get_schema_version(db) >= step_version:
+                continue
+            await MIGRATIONS[step_version - 1](db)
+            await _execute(db, "set_user_version", f"PRAGMA user_version = {step_version}")
+    return SCHEMA_VERSION
+
+
+async def _load_active_index() -> None:
+    async with pool.read() as db:
+        started = time.perf_counter()
         cursor = await db.execute(
             """
-            INSERT INTO tickets (ticket_number, user_id, username, file_id, status)
-            VALUES (?, ?, ?, ?, 'active')
-            """,
-            (ticket_number, user_id, username, file_id),
+            SELECT t.lottery_id, t.ticket_number
+            FROM lotteries l JOIN tickets t ON t.lottery_id = l.id AND t.status = 'active'
+            WHERE l.archived_at IS NULL
+            """
         )
-        await db.commit()
-        return cursor.lastrowid
+        active_indexes.clear()
+        loaded = 0
+        async for lottery_id, ticket_number in cursor:
+            _active_index(lottery_id).add(ticket_number)
+            loaded += 1
+        await cursor.close()
+        query_stats.record("load_active_index", time.perf_counter() - started, loaded)
 
 
-async def get_active_tickets_by_user(user_id: int) -> List[Tuple[int]]:
-    async with aiosqlite.connect(DB_PATH) as db:
-        cursor = await db.execute(
-            "SELECT ticket_number FROM tickets WHERE user_id = ? AND status = 'active' ORDER BY ticket_number",
-            (user_id,),
+class WriteBatcher:
+    """
+    Групповая фиксация: вставки билетов и смены статусов от разных обработчиков
+    копятся до max_latency секунд или max_size строк и пишутся одной транзакцией
+    через executemany. Каждый вызывающий получает свой результат после COMMIT.
+    """
+
+    # Границы корзин гистограммы размеров пачек
+    SIZE_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+    def __init__(self, max_latency: float, max_size: int) -> None:
+        self.max_latency = max_latency
+        self.max_size = max(1, max_size)
+        self._inserts: List[Tuple[Tuple[Any, ...], asyncio.Future]] = []
+        self._updates: List[Tuple[Tuple[str, Optional[str], int, int, bool], asyncio.Future]] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._flushes: set = set()
+        self.batches = 0
+        self.rows = 0
+        self.max_batch = 0
+        self.size_histogram: Dict[str, int] = {}
+
+    def _pending(self) -> int:
+        return len(self._inserts) + len(self._updates)
+
+    def _schedule(self) -> None:
+        if self._pending() >= self.max_size:
+            self._flush_now()
+        elif self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(self.max_latency, self._flush_now)
+
+    def _flush_now(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if not self._pending():
+            return
+        inserts, self._inserts = self._inserts, []
+        updates, self._updates = self._updates, []
+        task = asyncio.create_task(self._flush(inserts, updates))
+        self._flushes.add(task)
+        task.add_done_callback(self._flushes.discard)
+
+    def _record_batch(self, size: int) -> None:
+        self.batches += 1
+        self.rows += size
+        self.max_batch = max(self.max_batch, size)
+        bucket = next((f"<={b}" for b in self.SIZE_BUCKETS if size <= b), f">{self.SIZE_BUCKETS[-1]}")
+        self.size_histogram[bucket] = self.size_histogram.get(bucket, 0) + 1
+
+    async def _flush(self, inserts: list, updates: list) -> None:
+        futures = [f for _, f in inserts] + [f for _, f in updates]
+        rejected: List[Tuple[asyncio.Future, Exception]] = []
+        try:
+            async with pool.write() as db:
+                numbers: List[int] = []
+                repeats: list = []
+                if inserts:
+                    closed = await _closed_lotteries(db, (params[5] for params, _ in inserts))
+                    rejected.extend((future, LotteryClosedError(params[5])) for params, future in inserts if params[5] in closed)
+                    inserts = [(params, future) for params, future in inserts if params[5] not in closed]
+                if inserts and DUPLICATE_SCOPE != "off":
+                    inserts, repeats = await _reject_duplicates(db, inserts, rejected)
+                if inserts:
+                    numbers = await _allocate_for_lotteries(db, [params[5] for params, _ in inserts])
+                    await _execute_many(
+                        db,
+                        "add_ticket_batch",
+                        INSERT_TICKET_SQL,
+                        [(n, *params) for n, (params, _) in zip(numbers, inserts)],
+                    )
+                for future, params, earlier, kind in repeats:
+                    match = DuplicatePhotoError(numbers[earlier], inserts[earlier][0][0], kind)
+                    await _record_duplicate(db, params[0], params[1], params[3], match)
+                    rejected.append((future, match))
+                # Построчно и по порядку: условная смена статуса должна знать, сработала ли она,
+                # а из двух смен одного билета в пачке условная видит результат предыдущей
+                owners: List[Optional[int]] = []
+                for params, _ in updates:
+                    row = await _fetchone(
+                        db,
+                        "set_ticket_status_batch",
+                        (UPDATE_STATUS_IF_ACTIVE_SQL if params[4] else UPDATE_STATUS_SQL) + " RETURNING user_id",
+                        params[:4],
+                    )
+                    owners.append(row[0] if row else None)
+                stats = await _read_user_stats(
+                    db,
+                    [(params[5], params[0]) for params, _ in inserts]
+                    + [(params[2], user_id) for (params, _), user_id in zip(updates, owners) if user_id is not None],
+                )
+        except Exception as exc:
+            for future in futures:
+                if not future.done():
+                    future.set_exception(exc)
+            return
+        for future, error in rejected:
+            if not future.done():
+                future.set_exception(error)
+        self._record_batch(len(futures))
+        _apply_user_stats(stats)
+        for number, (params, future) in zip(numbers, inserts):
+            _active_index(params[5]).add(number)
+            user_tickets.add((params[5], params[0]), number)
+            if not future.done():
+                future.set_result(number)
+        for ((status, _, lottery_id, ticket_number, _), future), user_id in zip(updates, owners):
+            if user_id is not None:
+                _apply_status_to_index(lottery_id, ticket_number, status, user_id)
+            if not future.done():
+                future.set_result(user_id is not None)
+
+    async def add_ticket(
+        self,
+        lottery_id: int,
+        user_id: int,
+        username: Optional[str],
+        file_id: str,
+        file_unique_id: Optional[str] = None,
+        phash: Optional[int] = None,
+    ) -> int:
+        future = asyncio.get_running_loop().create_future()
+        self._inserts.append(((user_id, username, file_id, file_unique_id, phash, lottery_id), future))
+        self._schedule()
+        return await future
+
+    async def set_ticket_status(
+        self, lottery_id: int, ticket_number: int, status: str, comment: Optional[str], only_active: bool = False
+    ) -> bool:
+        """True — статус изменён; при only_active билет должен быть ещё активен."""
+        future = asyncio.get_running_loop().create_future()
+        self._updates.append(((status, comment, lottery_id, ticket_number, only_active), future))
+        self._schedule()
+        return await future
+
+    async def close(self) -> None:
+        self._flush_now()
+        if self._flushes:
+            await asyncio.gather(*self._flushes, return_exceptions=True)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "batches": self.batches,
+            "rows": self.rows,
+            "avg_batch": self.rows / self.batches if self.batches else 0.0,
+            "max_batch": self.max_batch,
+            "size_histogram": dict(self.size_histogram),
+        }
+
+
+batcher: Optional[WriteBatcher] = None
+
+
+def get_batch_stats() -> Optional[Dict[str, Any]]:
+    return batcher.stats() if batcher else None
+
+
+async def init_db() -> None:
+    global batcher
+    await pool.open()
+    await migrate()
+    if DRAW_ENGINE == "memory":
+        await _load_active_index()
+    if DB_BATCH_ENABLED and batcher is None:
+        batcher = WriteBatcher(DB_BATCH_MAX_LATENCY_MS / 1000, DB_BATCH_MAX_SIZE)
+
+
+async def close_db() -> None:
+    global batcher
+    if batcher is not None:
+        await batcher.close()
+        batcher = None
+    await pool.close()
+
+
+def ticket_sequence_name(lottery_id: int) -> str:
+    """Имя счётчика номеров лотереи в ticket_sequence."""
+    return f"lottery:{lottery_id}"
+
+
+async def _bump_sequence(db: aiosqlite.Connection, name: str, count: int) -> int:
+    await _execute(
+        db,
+        "bump_ticket_sequence",
+        "UPDATE ticket_sequence SET value = value + ? WHERE name = ?",
+        (count, name),
+    )
+    row = await _fetchone(
+        db,
+        "read_ticket_sequence",
+        "SELECT value FROM ticket_sequence WHERE name = ?",
+        (name,),
+    )
+    return int(row[0]) - count + 1
+
+
+async def _allocate_ticket_numbers(db: aiosqlite.Connection, lottery_id: int, count: int) -> int:
+    """
+    Резервирует count номеров лотереи подряд и возвращает первый из них.
+    Вызывать внутри транзакции pool.write().
+    """
+    return await _bump_sequence(db, ticket_sequence_name(lottery_id), count)
+
+
+async def _allocate_for_lotteries(db: aiosqlite.Connection, lottery_ids: List[int]) -> List[int]:
+    """Номера для пачки вставок в разные лотереи: по одному обновлению счётчика на лотерею."""
+    counts: Dict[int, int] = {}
+    for lottery_id in lottery_ids:
+        counts[lottery_id] = counts.get(lottery_id, 0) + 1
+    next_number = {lottery_id: await _allocate_ticket_numbers(db, lottery_id, count) for lottery_id, count in counts.items()}
+    numbers = []
+    for lottery_id in lottery_ids:
+        numbers.append(next_number[lottery_id])
+        next_number[lottery_id] += 1
+    return numbers
+
+
+INSERT_TICKET_SQL = """
+INSERT INTO tickets (ticket_number, user_id, username, file_id, file_unique_id, phash, status, lottery_id)
+VALUES (?, ?, ?, ?, ?, ?, 'active', ?)
+"""
+
+
+class Ticket(NamedTuple):
+    """Билет, как его видят обработчики; порядок полей совпадает с SELECT_TICKET_SQL."""
+
+    id: int
+    ticket_number: int
+    user_id: int
+    username: Optional[str]
+    file_id: str
+    status: str
+    comment: Optional[str]
+
+
+def _ticket_row(cursor: sqlite3.Cursor, row: Tuple) -> Ticket:
+    """row_factory курсора: строка SELECT_TICKET_SQL сразу становится Ticket, без словаря на строку."""
+    return Ticket._make(row)
+
+
+SELECT_TICKET_SQL = "SELECT id, ticket_number, user_id, username, file_id, status, comment FROM tickets"
+TICKET_BY_NUMBER_SQL = SELECT_TICKET_SQL + " WHERE lottery_id = ? AND ticket_number = ?"
+ACTIVE_TICKET_BY_NUMBER_SQL = TICKET_BY_NUMBER_SQL + " AND status = 'active'"
+ACTIVE_TICKET_BY_ID_SQL = SELECT_TICKET_SQL + " WHERE id = ? AND lottery_id = ? AND status = 'active'"
+RANKED_ACTIVE_TICKET_SQL = SELECT_TICKET_SQL + " WHERE lottery_id = ? AND status = 'active' ORDER BY id LIMIT 1 OFFSET ?"
+
+# Сколько номеров подставлять в один IN (...): старые сборки SQLite принимают не больше 999 параметров
+TICKETS_IN_CHUNK = 500
+
+
+class LotteryClosedError(Exception):
+    """Лотерею закрыли (архивировали), пока в неё загружали билет."""
+
+    def __init__(self, lottery_id: int) -> None:
+        super().__init__(f"Лотерея №{lottery_id} уже закрыта")
+        self.lottery_id = lottery_id
+
+
+async def _closed_lotteries(db: aiosqlite.Connection, lottery_ids: Iterable[int]) -> set:
+    """Какие из лотерей уже закрыты; проверка в транзакции вставки, поиск по первичному ключу."""
+    ids = set(lottery_ids)
+    rows = await _fetchall(
+        db,
+        "open_lottery_check",
+        f"SELECT id FROM lotteries WHERE id IN ({','.join('?' * len(ids))}) AND archived_at IS NULL",
+        list(ids),
+    )
+    return ids - {row[0] for row in rows}
+
+
+class DuplicatePhotoError(Exception):
+    """Фото уже было загружено: ticket_number — билет, на который оно выдано (в том числе в той же пачке)."""
+
+    def __init__(self, ticket_number: int, user_id: int, match: str) -> None:
+        super().__init__(f"Фото уже использовано для билета №{ticket_number}")
+        self.ticket_number = ticket_number
+        self.user_id = user_id
+        # file — то же фото Telegram, phash — то же изображение, пересохранённое заново
+        self.match = match
+
+
+async def _find_duplicate(
+    db: aiosqlite.Connection,
+    lottery_id: int,
+    file_unique_id: Optional[str],
+    phash: Optional[int],
+) -> Optional[DuplicatePhotoError]:
+    """Ищет такое же фото по индексам file_unique_id и phash — O(log n) на каждую таблицу."""
+    if DUPLICATE_SCOPE == "global":
+        scopes = (("tickets", "", ()), ("tickets_archive", "", ()))
+    else:
+        # «+» не даёт планировщику взять индекс по lottery_id вместо индекса по фото
+        scopes = (("tickets", "+lottery_id = ? AND ", (lottery_id,)),)
+    for column, value, match in (("file_unique_id", file_unique_id, "file"), ("phash", phash, "phash")):
+        if value is None:
+            continue
+        for table, condition, params in scopes:
+            row = await _fetchone(
+                db,
+                f"duplicate_by_{column}_{table}",
+                f"SELECT ticket_number, user_id FROM {table} WHERE {condition}{column} = ? LIMIT 1",
+                (*params, value),
+            )
+            if row:
+                return DuplicatePhotoError(row[0], row[1], match)
+    return None
+
+
+async def _record_duplicate(
+    db: aiosqlite.Connection,
+    user_id: int,
+    username: Optional[str],
+    file_unique_id: Optional[str],
+    duplicate: DuplicatePhotoError,
+) -> None:
+    await _execute(
+        db,
+        "record_duplicate",
+        """
+        INSERT INTO photo_duplicates (user_id, username, file_unique_id, original_ticket_number, original_user_id, match)
+        VALUES (?, ?, ?, ?, ?, ?)
+        """,
+        (user_id, username, file_unique_id, duplicate.ticket_number, duplicate.user_id, duplicate.match),
+    )
+
+
+async def _reject_duplicates(db: aiosqlite.Connection, inserts: list, duplicates: list) -> Tuple[list, list]:
+    """
+    Отсеивает фото, уже сохранённые в базе, и повторы внутри самой пачки.
+
+    inserts — [(параметры вставки, метка)], метка возвращается как есть (future
+    в WriteBatcher). Найденные в базе повторы дописываются в duplicates как
+    (метка, DuplicatePhotoError). Возвращает (принятые вставки,
+    [(метка, параметры, индекс первого такого фото среди принятых, признак)]).
+    """
+    accepted = []
+    repeats = []
+    seen: Dict[Tuple[Optional[int], str, Any], int] = {}
+    for params, tag in inserts:
+        user_id, username, _, file_unique_id, phash, lottery_id = params
+        match = await _find_duplicate(db, lottery_id, file_unique_id, phash)
+        if match is not None:
+            await _record_duplicate(db, user_id, username, file_unique_id, match)
+            duplicates.append((tag, match))
+            continue
+        # Одно и то же фото в разные лотереи допустимо, если область проверки — лотерея
+        scope = lottery_id if DUPLICATE_SCOPE == "lottery" else None
+        for kind, value in (("file", file_unique_id), ("phash", phash)):
+            earlier = seen.get((scope, kind, value)) if value is not None else None
+            if earlier is not None:
+                repeats.append((tag, params, earlier, kind))
+                break
+        else:
+            if file_unique_id is not None:
+                seen[(scope, "file", file_unique_id)] = len(accepted)
+            if phash is not None:
+                seen[(scope, "phash", phash)] = len(accepted)
+            accepted.append((params, tag))
+    return accepted, repeats
+
+
+UPDATE_STATUS_SQL = "UPDATE tickets SET status = ?, comment = ? WHERE lottery_id = ? AND ticket_number = ?"
+UPDATE_STATUS_IF_ACTIVE_SQL = UPDATE_STATUS_SQL + " AND status = 'active'"
+
+
+async def _read_user_stats(db: aiosqlite.Connection, keys: Iterable[Tuple[int, int]]) -> List[Tuple[int, int, Optional[str], int]]:
+    """
+    Свежие счётчики участников [(lottery_id, user_id, username, active)] для
+    таблиц лидеров в памяти. Читаются в транзакции записи; для лотерей, чьих
+    лидеров никто не запрашивал, запроса нет.
+    """
+    keys = {key for key in keys if key[0] in leaderboards and key[1] is not None}
+    if not keys:
+        return []
+    placeholders = ",".join(["(?, ?)"] * len(keys))
+    return await _fetchall(
+        db,
+        "user_stats_for_leaderboard",
+        f"""
+        SELECT s.lottery_id, s.user_id, s.username, s.active
+        FROM (VALUES {placeholders}) AS k
+        JOIN user_stats s ON s.lottery_id = k.column1 AND s.user_id = k.column2
+        """,
+        [value for key in keys for value in key],
+    )
+
+
+def _apply_user_stats(rows: List[Tuple[int, int, Optional[str], int]]) -> None:
+    for lottery_id, user_id, username, active in rows:
+        board = leaderboards.get(lottery_id)
+        if board is not None:
+            board.update(user_id, username, active)
+
+
+def _apply_status_to_index(lottery_id: int, ticket_number: int, status: str, user_id: Optional[int] = None) -> None:
+    index = _active_index(lottery_id)
+    if status == "active":
+        index.add(ticket_number)
+        if user_id is not None:
+            user_tickets.add((lottery_id, user_id), ticket_number)
+    else:
+        index.discard(ticket_number)
+        if user_id is not None:
+            user_tickets.discard((lottery_id, user_id), ticket_number)
+
+
+async def add_ticket(
+    lottery_id: int,
+    user_id: int,
+    username: Optional[str],
+    file_id: str,
+    file_unique_id: Optional[str] = None,
+    phash: Optional[int] = None,
+) -> int:
+    """
+    Добавляет билет в лотерею и возвращает выданный ему номер (в той же транзакции).
+
+    Если такое фото уже есть (см. DUPLICATE_SCOPE), билет не создаётся: попытка
+    записывается в photo_duplicates и выбрасывается DuplicatePhotoError. Если
+    лотерею успели закрыть, выбрасывается LotteryClosedError.
+    """
+    if batcher is not None:
+        return await batcher.add_ticket(lottery_id, user_id, username, file_id, file_unique_id, phash)
+    duplicate: Optional[DuplicatePhotoError] = None
+    async with pool.write() as db:
+        if await _closed_lotteries(db, (lottery_id,)):
+            raise LotteryClosedError(lottery_id)
+        # Проверка и вставка в одной транзакции писателя: два одинаковых фото не проскочат параллельно
+        if DUPLICATE_SCOPE != "off":
+            duplicate = await _find_duplicate(db, lottery_id, file_unique_id, phash)
+        if duplicate is not None:
+            await _record_duplicate(db, user_id, username, file_unique_id, duplicate)
+        else:
+            ticket_number = await _allocate_ticket_numbers(db, lottery_id, 1)
+            await _execute(
+                db,
+                "add_ticket",
+                INSERT_TICKET_SQL,
+                (ticket_number, user_id, username, file_id, file_unique_id, phash, lottery_id),
+            )
+            stats = await _read_user_stats(db, [(lottery_id, user_id)])
+    if duplicate is not None:
+        raise duplicate
+    _apply_user_stats(stats)
+    _active_index(lottery_id).add(ticket_number)
+    user_tickets.add((lottery_id, user_id), ticket_number)
+    return ticket_number
+
+
+async def add_tickets(
+    lottery_id: int,
+    user_id: int,
+    username: Optional[str],
+    photos: List[Tuple[str, Optional[str], Optional[int]]],
+) -> Tuple[List[int], List[DuplicatePhotoError]]:
+    """
+    Добавляет билеты одного пользователя сразу на несколько фото (альбом).
+
+    photos — [(file_id, file_unique_id, phash)]. Номера выделяются одним
+    обновлением счётчика, вставка — один executemany, всё в одной транзакции.
+    Повторные фото не прерывают загрузку: возвращаются (номера принятых
+    билетов по порядку, DuplicatePhotoError по отклонённым).
+    """
+    inserts = [
+        ((user_id, username, file_id, file_unique_id, phash, lottery_id), None)
+        for file_id, file_unique_id, phash in photos
+    ]
+    duplicates: list = []
+    numbers: List[int] = []
+    stats: list = []
+    async with pool.write() as db:
+        if await _closed_lotteries(db, (lottery_id,)):
+            raise LotteryClosedError(lottery_id)
+        repeats: list = []
+        if DUPLICATE_SCOPE != "off":
+            inserts, repeats = await _reject_duplicates(db, inserts, duplicates)
+        if inserts:
+            first = await _allocate_ticket_numbers(db, lottery_id, len(inserts))
+            numbers = list(range(first, first + len(inserts)))
+            await _execute_many(
+                db,
+                "add_tickets",
+                INSERT_TICKET_SQL,
+                [(n, *params) for n, (params, _) in zip(numbers, inserts)],
+            )
+            stats = await _read_user_stats(db, [(lottery_id, user_id)])
+        for _, params, earlier, kind in repeats:
+            match = DuplicatePhotoError(numbers[earlier], user_id, kind)
+            await _record_duplicate(db, user_id, username, params[3], match)
+            duplicates.append((None, match))
+    _apply_user_stats(stats)
+    index = _active_index(lottery_id)
+    for number in numbers:
+        index.add(number)
+        user_tickets.add((lottery_id, user_id), number)
+    return numbers, [match for _, match in duplicates]
+
+
+async def _load_user_tickets(lottery_id: int, user_id: int) -> List[int]:
+    """Все активные номера пользователя по возрастанию (по индексу ix_tickets_lottery_draw); кладёт их в кэш."""
+    key = (lottery_id, user_id)
+    token = user_tickets.begin_load(key)
+    numbers: Optional[List[int]] = None
+    try:
+        async with pool.read() as db:
+            rows = await _fetchall(
+                db,
+                "active_tickets_by_user",
+                """
+                SELECT ticket_number FROM tickets
+                WHERE lottery_id = ? AND user_id = ? AND status = 'active'
+                ORDER BY ticket_number
+                """,
+                (lottery_id, user_id),
+            )
+        numbers = [row[0] for row in rows]
+        return numbers
+    finally:
+        user_tickets.finish_load(key, token, numbers)
+
+
+async def get_active_tickets_page(
+    lottery_id: int,
+    user_id: int,
+    after: int = 0,
+    before: Optional[int] = None,
+    limit: int = 20,
+) -> Tuple[List[int], bool, bool, int]:
+    """
+    Страница активных билетов пользователя в лотерее по ключу (keyset): limit
+    номеров больше after или, если задан before, limit номеров перед before.
+    Возвращает (номера, есть_раньше, есть_дальше, всего).
+
+    Страница режется из полного списка пользователя в кэше. При промахе
+    список читается целиком одним запросом и кладётся в кэш — так в нём
+    оказываются и те, у кого билетов на много страниц. Без кэша (WORKERS > 1)
+    страница читается из БД по ключу.
+    """
+    key = (lottery_id, user_id)
+    cached = user_tickets.page(key, after, before, limit)
+    if cached is not None:
+        return cached
+    if user_tickets.enabled:
+        return page_of(await _load_user_tickets(lottery_id, user_id), after, before, limit)
+    async with pool.read() as db:
+        if before is not None:
+            rows = await _fetchall(
+                db,
+                "active_tickets_page_prev",
+                """
+                SELECT ticket_number FROM tickets
+                WHERE user_id = ? AND lottery_id = ? AND status = 'active' AND ticket_number < ?
+                ORDER BY ticket_number DESC LIMIT ?
+                """,
+                (user_id, lottery_id, before, limit + 1),
+            )
+            has_prev = len(rows) > limit
+            numbers = [row[0] for row in reversed(rows[:limit])]
+            has_next = True
+            if numbers:
+                has_next = await _fetchone(
+                    db,
+                    "active_tickets_page_probe",
+                    """
+                    SELECT 1 FROM tickets
+                    WHERE user_id = ? AND lottery_id = ? AND status = 'active' AND ticket_number > ? LIMIT 1
+                    """,
+                    (user_id, lottery_id, numbers[-1]),
+                ) is not None
+        else:
+            rows = await _fetchall(
+                db,
+                "active_tickets_page_next",
+                """
+                SELECT ticket_number FROM tickets
+                WHERE user_id = ? AND lottery_id = ? AND status = 'active' AND ticket_number > ?
+                ORDER BY ticket_number LIMIT ?
+                """,
+                (user_id, lottery_id, after, limit + 1),
+            )
+            has_next = len(rows) > limit
+            numbers = [row[0] for row in rows[:limit]]
+            has_prev = after > 0 and await _fetchone(
+                db,
+                "active_tickets_page_probe",
+                """
+                SELECT 1 FROM tickets
+                WHERE user_id = ? AND lottery_id = ? AND status = 'active' AND ticket_number <= ? LIMIT 1
+                """,
+                (user_id, lottery_id, after),
+            ) is not None
+        if not has_prev and not has_next:
+            return numbers, False, False, len(numbers)
+        row = await _fetchone(
+            db,
+            "active_tickets_count",
+            "SELECT COUNT(*) FROM tickets WHERE user_id = ? AND lottery_id = ? AND status = 'active'",
+            (user_id, lottery_id),
         )
-        return await cursor.fetchall()
+    return numbers, has_prev, has_next, int(row[0])
+
+
+def user_owns_active_ticket(lottery_id: int, user_id: int, ticket_number: int) -> Optional[bool]:
+    """Проверка владения по кэшу без запроса к БД; None — пользователя нет в кэше."""
+    return user_tickets.owns((lottery_id, user_id), ticket_number)
+
+
+def get_user_tickets_cache_stats() -> Dict[str, float]:
+    return user_tickets.stats()
+
+
+async def get_active_ticket_by_number(lottery_id: int, ticket_number: int) -> Optional[Ticket]:
+    async with pool.read() as db:
+        return await _fetchone(
+            db, "active_ticket_by_number", ACTIVE_TICKET_BY_NUMBER_SQL, (lottery_id, ticket_number), _ticket_row
+        )
+
+
+async def get_ticket_by_number_any_status(lottery_id: int, ticket_number: int) -> Optional[Ticket]:
+    async with pool.read() as db:
+        return await _fetchone(db, "ticket_by_number", TICKET_BY_NUMBER_SQL, (lottery_id, ticket_number), _ticket_row)
+
+
+async def _tickets_by_numbers(
+    db: aiosqlite.Connection, name: str, lottery_id: int, numbers: Sequence[int], active_only: bool
+) -> Dict[int, Ticket]:
+    sql = SELECT_TICKET_SQL + " WHERE lottery_id = ?" + (" AND status = 'active'" if active_only else "")
+    found: Dict[int, Ticket] = {}
+    for start in range(0, len(numbers), TICKETS_IN_CHUNK):
+        chunk = numbers[start:start + TICKETS_IN_CHUNK]
+        placeholders = ",".join("?" * len(chunk))
+        rows = await _fetchall(
+            db, name, f"{sql} AND ticket_number IN ({placeholders})", (lottery_id, *chunk), _ticket_row
+        )
+        found.update((ticket.ticket_number, ticket) for ticket in rows)
+    return found
+
+
+async def get_tickets_by_numbers(lottery_id: int, numbers: Iterable[int], active_only: bool = False) -> List[Ticket]:
+    """
+    Билеты лотереи по списку номеров одним запросом IN (...) на каждые
+    TICKETS_IN_CHUNK номеров. Порядок — как в numbers; ненайденные пропускаются.
+    """
+    numbers = list(dict.fromkeys(numbers))
+    if not numbers:
+        return []
+    async with pool.read() as db:
+        found = await _tickets_by_numbers(db, "tickets_by_numbers", lottery_id, numbers, active_only)
+    return [found[n] for n in numbers if n in found]
 
 
-async def get_active_ticket_by_number(ticket_number: int) -> Optional[Dict[str, Any]]:
-    async with aiosqlite.connect(DB_PATH) as db:
+async def set_ticket_status(lottery_id: int, ticket_number: int, status: str, comment: Optional[str]) -> None:
+    if batcher is not None:
+        await batcher.set_ticket_status(lottery_id, ticket_number, status, comment)
+        return
+    async with pool.write() as db:
+        row = await _fetchone(
+            db,
+            "set_ticket_status",
+            UPDATE_STATUS_SQL + " RETURNING user_id",
+            (status, comment, lottery_id, ticket_number),
+        )
+        stats = await _read_user_stats(db, [(lottery_id, row[0])] if row else [])
+    _apply_user_stats(stats)
+    _apply_status_to_index(lottery_id, ticket_number, status, row[0] if row else None)
+
+
+async def set_ticket_status_if_active(
+    lottery_id: int,
+    ticket_number: int,
+    status: str,
+    comment: Optional[str],
+) -> bool:
+    """
+    Меняет статус, только если билет ещё активен. Возвращает False, если билет
+    уже обработан (например, другим админом или другим воркером).
+    """
+    if batcher is not None:
+        return await batcher.set_ticket_status(lottery_id, ticket_number, status, comment, only_active=True)
+    async with pool.write() as db:
+        row = await _fetchone(
+            db,
+            "set_ticket_status_if_active",
+            UPDATE_STATUS_IF_ACTIVE_SQL + " RETURNING user_id",
+            (status, comment, lottery_id, ticket_number),
+        )
+        stats = await _read_user_stats(db, [(lottery_id, row[0])] if row else [])
+    if row is None:
+        return False
+    _apply_user_stats(stats)
+    _apply_status_to_index(lottery_id, ticket_number, status, row[0])
+    return True
+
+
+def _selection_where(lottery_id: int, selection: TicketSelection) -> Tuple[str, List[Any]]:
+    """
+    Условие на активные билеты выбора. Диапазоны — OR из BETWEEN по уникальному
+    индексу (lottery_id, ticket_number), участник — по частичному индексу
+    (lottery_id, user_id, ...); ник ищется среди участников лотереи в user_stats.
+    """
+    where = "lottery_id = ? AND status = 'active' AND "
+    params: List[Any] = [lottery_id]
+    if selection.user_id is not None:
+        params.append(selection.user_id)
+        return where + "user_id = ?", params
+    if selection.username is not None:
+        params += [lottery_id, selection.username]
+        return where + (
+            "user_id IN (SELECT user_id FROM user_stats WHERE lottery_id = ? AND username = ? COLLATE NOCASE)"
+        ), params
+    for low, high in selection.ranges:
+        params += [low, high]
+    return where + "(" + " OR ".join(["ticket_number BETWEEN ? AND ?"] * len(selection.ranges)) + ")", params
+
+
+async def count_selected_tickets(lottery_id: int, selection: TicketSelection) -> Tuple[int, int]:
+    """Пробный прогон массовой модерации: (активных билетов, участников) под выбор, без изменений."""
+    where, params = _selection_where(lottery_id, selection)
+    async with pool.read() as db:
+        row = await _fetchone(
+            db, "count_selected_tickets", f"SELECT COUNT(*), COUNT(DISTINCT user_id) FROM tickets WHERE {where}", params
+        )
+    return int(row[0]), int(row[1])
+
+
+async def set_selected_tickets_status(
+    lottery_id: int, selection: TicketSelection, status: str, comment: Optional[str]
+) -> List[int]:
+    """
+    Меняет статус всех активных билетов выбора одним UPDATE в одной транзакции;
+    счётчики статистики ведут триггеры. Возвращает изменённые номера по возрастанию.
+    """
+    where, params = _selection_where(lottery_id, selection)
+    async with pool.write() as db:
+        rows = await _fetchall(
+            db,
+            "set_selected_tickets_status",
+            f"UPDATE tickets SET status = ?, comment = ? WHERE {where} RETURNING ticket_number, user_id",
+            [status, comment, *params],
+        )
+        users = {(lottery_id, user_id) for _, user_id in rows}
+        # Волна спама может задеть тысячи участников: таблицу лидеров тогда дешевле перечитать
+        stats = await _read_user_stats(db, users) if len(users) <= TICKETS_IN_CHUNK else None
+    if stats is None:
+        leaderboards.pop(lottery_id, None)
+    else:
+        _apply_user_stats(stats)
+    for ticket_number, user_id in rows:
+        _apply_status_to_index(lottery_id, ticket_number, status, user_id)
+    return sorted(ticket_number for ticket_number, _ in rows)
+
+
+async def _random_active_ticket_sql(lottery_id: int) -> Optional[Ticket]:
+    """
+    Выбор без индекса в памяти: случайный rowid из диапазона активных билетов
+    лотереи (частичный индекс ix_tickets_lottery_active). Попадание при таких
+    пробах равновероятно для всех активных билетов. Если id лотереи сильно
+    перемешаны с чужими и SQL_DRAW_ATTEMPTS проб подряд промахнулись, берём
+    билет по случайному рангу (OFFSET по тому же индексу) — тоже равновероятно.
+    """
+    async with pool.read() as db:
+        # Границы берём двумя поисками по индексу: MIN/MAX с WHERE сканирует индекс целиком
+        first = await _fetchone(
+            db,
+            "active_id_low",
+            "SELECT id FROM tickets WHERE lottery_id = ? AND status = 'active' ORDER BY id LIMIT 1",
+            (lottery_id,),
+        )
+        if not first:
+            return None
+        last = await _fetchone(
+            db,
+            "active_id_high",
+            "SELECT id FROM tickets WHERE lottery_id = ? AND status = 'active' ORDER BY id DESC LIMIT 1",
+            (lottery_id,),
+        )
+        low, high = int(first[0]), int(last[0])
+        for _ in range(SQL_DRAW_ATTEMPTS):
+            ticket = await _fetchone(
+                db,
+                "random_active_ticket_probe",
+                ACTIVE_TICKET_BY_ID_SQL,
+                (low + secrets.randbelow(high - low + 1), lottery_id),
+                _ticket_row,
+            )
+            if ticket:
+                return ticket
+        while True:
+            count = await _fetchone(
+                db,
+                "active_ticket_count",
+                "SELECT COUNT(*) FROM tickets WHERE lottery_id = ? AND status = 'active'",
+                (lottery_id,),
+            )
+            if not count[0]:
+                return None
+            ticket = await _fetchone(
+                db,
+                "random_active_ticket_by_rank",
+                RANKED_ACTIVE_TICKET_SQL,
+                (lottery_id, secrets.randbelow(count[0])),
+                _ticket_row,
+            )
+            # None — между запросами билеты изменились и ранг вышел за конец; считаем заново
+            if ticket:
+                return ticket
+
+
+async def get_random_active_ticket(lottery_id: int) -> Optional[Ticket]:
+    if DRAW_ENGINE == "sql":
+        return await _random_active_ticket_sql(lottery_id)
+    index = _active_index(lottery_id)
+    while True:
+        ticket_number = index.choice()
+        if ticket_number is None:
+            return None
+        ticket = await get_active_ticket_by_number(lottery_id, ticket_number)
+        if ticket:
+            return ticket
+        # Билет уже не активен (например, изменён вручную в БД) — убираем из индекса
+        index.discard(ticket_number)
+
+
+async def draw_random_active_tickets(
+    lottery_id: int,
+    count: int,
+    one_per_user: bool = False,
+    weight_by_tickets: bool = True,
+) -> List[Ticket]:
+    """
+    Выбирает до count различных активных билетов лотереи за один проход по индексу.
+
+    one_per_user — не больше одного выигрыша на участника; тогда при
+    weight_by_tickets шанс участника пропорционален числу его билетов,
+    иначе шансы участников равны. Без one_per_user все билеты равновероятны.
+    Память — O(count) вне зависимости от числа билетов.
+    """
+    sampler = ReservoirSampler(count)
+    scanned = 0
+    async with pool.read() as db:
+        started = time.perf_counter()
+        # Обход частичного индекса (lottery_id, user_id, ticket_number): билеты участника идут подряд, без сортировки
         cursor = await db.execute(
+            "SELECT user_id, ticket_number FROM tickets WHERE lottery_id = ? AND status = 'active' ORDER BY user_id",
+            (lottery_id,),
+        )
+        if one_per_user:
+            current_user: Optional[int] = None
+            picker = GroupPicker()
+            async for user_id, ticket_number in cursor:
+                scanned += 1
+                if user_id != current_user:
+                    if picker.count:
+                        sampler.offer(picker.item, picker.count if weight_by_tickets else 1)
+                    current_user, picker = user_id, GroupPicker()
+                picker.offer(ticket_number)
+            if picker.count:
+                sampler.offer(picker.item, picker.count if weight_by_tickets else 1)
+        else:
+            async for _, ticket_number in cursor:
+                scanned += 1
+                sampler.offer(ticket_number)
+        await cursor.close()
+        query_stats.record("draw_many_scan", time.perf_counter() - started, scanned)
+
+        numbers = sampler.result()
+        if not numbers:
+            return []
+        by_number = await _tickets_by_numbers(db, "draw_many_fetch", lottery_id, numbers, active_only=True)
+    # Сохраняем случайный порядок выборки
+    return [by_number[n] for n in numbers if n in by_number]
+
+
+@dataclass(frozen=True)
+class Lottery:
+    id: int
+    title: Optional[str]
+    # Групповой чат для объявлений; None — общий GROUP_CHAT_ID
+    chat_id: Optional[int]
+    archived: bool = False
+
+    @property
+    def label(self) -> str:
+        return self.title or f"Лотерея №{self.id}"
+
+
+_lotteries: Dict[int, Lottery] = {}
+_lotteries_loaded_at: Optional[float] = None
+
+
+def _invalidate_lotteries() -> None:
+    global _lotteries_loaded_at
+    _lotteries_loaded_at = None
+
+
+async def get_open_lotteries() -> List[Lottery]:
+    """
+    Открытые лотереи по возрастанию id. Список читается на каждом апдейте,
+    поэтому кэшируется: в одном процессе — до изменения, при нескольких
+    воркерах — на LOTTERY_CACHE_TTL секунд.
+    """
+    global _lotteries, _lotteries_loaded_at
+    now = time.monotonic()
+    if _lotteries_loaded_at is None or (SHARED_DB and now - _lotteries_loaded_at > LOTTERY_CACHE_TTL):
+        async with pool.read() as db:
+            rows = await _fetchall(
+                db,
+                "open_lotteries",
+                "SELECT id, title, chat_id FROM lotteries WHERE archived_at IS NULL ORDER BY id",
+            )
+        _lotteries = {row[0]: Lottery(*row) for row in rows}
+        _lotteries_loaded_at = now
+    return list(_lotteries.values())
+
+
+async def get_lottery(lottery_id: int) -> Optional[Lottery]:
+    """Лотерея по id, в том числе закрытая; None — такой нет."""
+    for lottery in await get_open_lotteries():
+        if lottery.id == lottery_id:
+            return lottery
+    async with pool.read() as db:
+        row = await _fetchone(
+            db,
+            "lottery_by_id",
+            "SELECT id, title, chat_id, archived_at IS NOT NULL FROM lotteries WHERE id = ?",
+            (lottery_id,),
+        )
+    return Lottery(row[0], row[1], row[2], bool(row[3])) if row else None
+
+
+async def get_successor_lottery(lottery_id: int) -> Optional[Lottery]:
+    """Открытая лотерея, которая продолжила закрытую (то же название и чат)."""
+    closed = await get_lottery(lottery_id)
+    if closed is None:
+        return None
+    for lottery in await get_open_lotteries():
+        if lottery.id > lottery_id and (lottery.title, lottery.chat_id) == (closed.title, closed.chat_id):
+            return lottery
+    return None
+
+
+async def create_lottery(title: Optional[str] = None, chat_id: Optional[int] = None) -> Lottery:
+    """Открывает ещё одну лотерею со своей нумерацией билетов (с №1)."""
+    async with pool.write() as db:
+        cursor = await _execute(
+            db,
+            "create_lottery",
+            "INSERT INTO lotteries (title, chat_id) VALUES (?, ?)",
+            (title, chat_id),
+        )
+        lottery_id = cursor.lastrowid
+        await _execute(
+            db,
+            "seed_ticket_sequence",
+            "INSERT INTO ticket_sequence (name, value) VALUES (?, 0)",
+            (ticket_sequence_name(lottery_id),),
+        )
+    _invalidate_lotteries()
+    return Lottery(lottery_id, title, chat_id)
+
+
+ArchiveProgress = Callable[[int, int], Awaitable[None]]
+
+
+async def _close_lottery(lottery_id: int) -> Optional[int]:
+    """
+    Короткая транзакция: закрывает лотерею и открывает на её месте новую с тем
+    же названием и чатом. Возвращает id новой лотереи или None, если лотерея
+    уже была закрыта. Билеты закрытой лотереи остаются в tickets до переноса в архив.
+    """
+    async with pool.write() as db:
+        row = await _fetchone(
+            db,
+            "close_lottery",
             """
-            SELECT id, ticket_number, user_id, username, file_id, status, comment
-            FROM tickets WHERE ticket_number = ? AND status = 'active'
+            UPDATE lotteries SET archived_at = CURRENT_TIMESTAMP
+            WHERE id = ? AND archived_at IS NULL RETURNING title, chat_id
             """,
-            (ticket_number,),
+            (lottery_id,),
         )
-        row = await cursor.fetchone()
-        if not row:
+        if row is None:
             return None
-        keys = [d[0] for d in cursor.description]
-        return dict(zip(keys, row))
+        cursor = await _execute(
+            db,
+            "open_lottery",
+            "INSERT INTO lotteries (title, chat_id) VALUES (?, ?)",
+            tuple(row),
+        )
+        successor = cursor.lastrowid
+        # continue — новая лотерея продолжает счётчик закрытой, reset — начинает с №1
+        await _execute(
+            db,
+            "seed_ticket_sequence",
+            """
+            INSERT INTO ticket_sequence (name, value)
+            VALUES (?, COALESCE((SELECT value FROM ticket_sequence WHERE name = ? AND ?), 0))
+            """,
+            (ticket_sequence_name(successor), ticket_sequence_name(lottery_id), TICKET_NUMBERING == "continue"),
+        )
+    active_indexes.pop(lottery_id, None)
+    leaderboards.pop(lottery_id, None)
+    user_tickets.clear()
+    _invalidate_lotteries()
+    return successor
 
 
-async def get_ticket_by_number_any_status(ticket_number: int) -> Optional[Dict[str, Any]]:
-    async with aiosqlite.connect(DB_PATH) as db:
-        cursor = await db.execute(
+async def _move_to_archive(lottery_id: int, progress: Optional[ArchiveProgress] = None) -> int:
+    """
+    Переносит билеты лотереи в архив порциями по ARCHIVE_CHUNK_SIZE.
+
+    Порции идут по возрастанию номера через уникальный индекс (lottery_id,
+    ticket_number): граница порции находится без сортировки. Каждая порция —
+    копирование и удаление в одной транзакции, поэтому после падения перенос
+    просто продолжается с оставшихся строк. Между порциями
+    блокировка писателя освобождается и загрузки не ждут весь архив.
+    """
+    async with pool.read() as db:
+        row = await _fetchone(db, "archive_pending", "SELECT COUNT(*) FROM tickets WHERE lottery_id = ?", (lottery_id,))
+    total = row[0]
+    moved = 0
+    while True:
+        async with pool.write() as db:
+            row = await _fetchone(
+                db,
+                "archive_chunk_bound",
+                """
+                SELECT MAX(ticket_number) FROM (
+                    SELECT ticket_number FROM tickets WHERE lottery_id = ? ORDER BY ticket_number LIMIT ?
+                )
+                """,
+                (lottery_id, ARCHIVE_CHUNK_SIZE),
+            )
+            if row[0] is None:
+                break
+            await _execute(
+                db,
+                "archive_copy",
+                """
+                INSERT INTO tickets_archive
+                    (ticket_number, user_id, username, file_id, file_unique_id, phash, status, comment, lottery_id)
+                SELECT ticket_number, user_id, username, file_id, file_unique_id, phash, status, comment, lottery_id
+                FROM tickets WHERE lottery_id = ? AND ticket_number <= ?
+                """,
+                (lottery_id, row[0]),
+            )
+            cursor = await _execute(
+                db,
+                "archive_clear",
+                "DELETE FROM tickets WHERE lottery_id = ? AND ticket_number <= ?",
+                (lottery_id, row[0]),
+            )
+            moved += _rowcount(cursor)
+        if progress is not None:
+            await progress(moved, max(total, moved))
+    logger.info("Лотерея %s перенесена в архив: %s билетов", lottery_id, moved)
+    return moved
+
+
+async def archive_lottery(lottery_id: int, progress: Optional[ArchiveProgress] = None) -> int:
+    """
+    Закрывает лотерею, открывает вместо неё новую (то же название и чат) и
+    переносит билеты закрытой в архив с пометкой lottery_id. progress(перенесено,
+    всего) вызывается после каждой порции. Возвращает число перенесённых билетов.
+    """
+    await _close_lottery(lottery_id)
+    try:
+        return await _move_to_archive(lottery_id, progress)
+    finally:
+        # Пока шёл перенос (даже прерванный), кэш мог загрузить билеты закрытой лотереи
+        user_tickets.clear()
+
+
+async def get_unfinished_archives() -> List[int]:
+    """Закрытые лотереи, чьи билеты ещё не перенесены в архив (архивация прервалась)."""
+    async with pool.read() as db:
+        rows = await _fetchall(
+            db,
+            "unfinished_archives",
             """
-            SELECT id, ticket_number, user_id, username, file_id, status, comment
-            FROM tickets WHERE ticket_number = ?
+            SELECT id FROM lotteries
+            WHERE archived_at IS NOT NULL
+              AND EXISTS (SELECT 1 FROM tickets WHERE tickets.lottery_id = lotteries.id)
+            ORDER BY id
             """,
-            (ticket_number,),
         )
-        row = await cursor.fetchone()
-        if not row:
-            return None
-        keys = [d[0] for d in cursor.description]
-        return dict(zip(keys, row))
+    return [lottery_id for (lottery_id,) in rows]
 
 
-async def set_ticket_status(ticket_number: int, status: str, comment: Optional[str]) -> None:
-    async with aiosqlite.connect(DB_PATH) as db:
-        await db.execute(
-            "UPDATE tickets SET status = ?, comment = ? WHERE ticket_number = ?",
-            (status, comment, ticket_number),
+async def resume_archive(lottery_id: int, progress: Optional[ArchiveProgress] = None) -> int:
+    """Доводит до конца прерванную архивацию лотереи. Возвращает число перенесённых билетов."""
+    moved = await _move_to_archive(lottery_id, progress)
+    if moved:
+        user_tickets.clear()
+    return moved
+
+
+async def get_lottery_stats(lottery_id: int) -> Dict[str, int]:
+    """Счётчики лотереи {статус или participants: значение} — чтение по первичному ключу."""
+    async with pool.read() as db:
+        rows = await _fetchall(
+            db,
+            "lottery_stats",
+            "SELECT name, value FROM lottery_stats WHERE lottery_id = ?",
+            (lottery_id,),
         )
-        await db.commit()
+    return dict(rows)
 
 
-async def get_random_active_ticket() -> Optional[Dict[str, Any]]:
-    async with aiosqlite.connect(DB_PATH) as db:
-        cursor = await db.execute(
-            """
-            SELECT id, ticket_number, user_id, username, file_id, status, comment
-            FROM tickets
-            WHERE status = 'active'
-            ORDER BY RANDOM()
-            LIMIT 1
-            """
+async def get_user_stats(lottery_id: int, user_id: int) -> Tuple[int, int]:
+    """(всего билетов, активных) участника в лотерее — O(1)."""
+    async with pool.read() as db:
+        row = await _fetchone(
+            db,
+            "user_stats",
+            "SELECT tickets, active FROM user_stats WHERE lottery_id = ? AND user_id = ?",
+            (lottery_id, user_id),
         )
-        row = await cursor.fetchone()
-        if not row:
-            return None
-        keys = [d[0] for d in cursor.description]
-        return dict(zip(keys, row))
+    return (row[0], row[1]) if row else (0, 0)
+
+
+async def get_leaderboard(lottery_id: int) -> List[LeaderboardEntry]:
+    """
+    LEADERBOARD_SIZE участников с наибольшим числом активных билетов.
+
+    Обычно ответ готов в памяти (O(K)). Пустой или устаревший топ читается
+    из индекса ix_user_stats_rank — первые K + 1 строк, тоже O(K).
+    """
+    board = leaderboards.get(lottery_id)
+    if board is not None and not board.stale:
+        return board.ranking()
+    sql = """
+        SELECT user_id, username, active FROM user_stats
+        WHERE lottery_id = ? ORDER BY active DESC LIMIT ?
+        """
+    if SHARED_DB:
+        async with pool.read() as db:
+            rows = await _fetchall(db, "leaderboard_load", sql, (lottery_id, LEADERBOARD_SIZE))
+        return [row for row in rows if row[2] > 0]
+    # Читаем под блокировкой писателя: все записи до чтения уже отражены в
+    # строках, а все последующие обновят уже установленный топ
+    async with pool.write() as db:
+        rows = await _fetchall(db, "leaderboard_load", sql, (lottery_id, LEADERBOARD_SIZE + 1))
+        leaderboards[lottery_id] = board = TopK(LEADERBOARD_SIZE, rows)
+    return board.ranking()
+
+
+# Столбцы выгрузки: одинаковые для tickets и tickets_archive (у архива ещё archived_at)
+EXPORT_COLUMNS = ("id", "lottery_id", "ticket_number", "user_id", "username", "file_id", "file_unique_id", "status", "comment")
+EXPORT_TABLES = {
+    "tickets": ("tickets", EXPORT_COLUMNS),
+    "archive": ("tickets_archive", EXPORT_COLUMNS + ("archived_at",)),
+}
+
 
+async def iter_export_pages(
+    table: str = "tickets",
+    lottery_id: Optional[int] = None,
+    status: Optional[str] = None,
+    user_id: Optional[int] = None,
+    page_size: int = 5000,
+) -> AsyncIterator[List[Tuple]]:
+    """
+    Отдаёт строки таблицы для выгрузки страницами по page_size в порядке id.
 
-async def archive_lottery() -> None:
-    async with aiosqlite.connect(DB_PATH) as db:
-        # Копируем текущие билеты в архив
-        await db.execute(
+    Каждая страница — отдельный запрос по ключу (id > последний), читатель
+    занят только на время страницы: долгая выгрузка не держит соединение
+    пула и не мешает контрольным точкам WAL.
+    """
+    name, columns = EXPORT_TABLES[table]
+    conditions = ["id > ?"]
+    params: List[Any] = []
+    for column, value in (("lottery_id", lottery_id), ("status", status), ("user_id", user_id)):
+        if value is not None:
+            conditions.append(f"{column} = ?")
+            params.append(value)
+    sql = f"SELECT {', '.join(columns)} FROM {name} WHERE {' AND '.join(conditions)} ORDER BY id LIMIT ?"
+    last_id = 0
+    while True:
+        async with pool.read() as db:
+            rows = await _fetchall(db, f"export_{table}", sql, (last_id, *params, page_size))
+        if not rows:
+            return
+        yield rows
+        if len(rows) < page_size:
+            return
+        last_id = rows[-1][0]
+
+
+async def get_duplicate_report(limit: int = 10) -> Dict[str, Any]:
+    """Сводка по отклонённым повторным фото: всего, главные нарушители и последние случаи."""
+    async with pool.read() as db:
+        total = await _fetchone(db, "duplicates_total", "SELECT COUNT(*) FROM photo_duplicates")
+        offenders = await _fetchall(
+            db,
+            "duplicates_by_user",
             """
-            INSERT INTO tickets_archive (ticket_number, user_id, username, file_id, status, comment)
-            SELECT ticket_number, user_id, username, file_id, status, comment FROM tickets
+            SELECT user_id, MAX(username), COUNT(*) AS attempts FROM photo_duplicates
+            GROUP BY user_id ORDER BY attempts DESC LIMIT ?
+            """,
+            (limit,),
+        )
+        recent = await _fetchall(
+            db,
+            "duplicates_recent",
             """
+            SELECT user_id, username, original_ticket_number, original_user_id, match, created_at
+            FROM photo_duplicates ORDER BY id DESC LIMIT ?
+            """,
+            (limit,),
+        )
+    return {"total": int(total[0]), "offenders": offenders, "recent": recent}
+
+
+async def load_fsm_record(key: str) -> Optional[Tuple[Optional[str], str, float]]:
+    """Возвращает (state, data_json, updated_at) для ключа FSM или None."""
+    async with pool.read() as db:
+        return await _fetchone(
+            db,
+            "fsm_load",
+            "SELECT state, data, updated_at FROM fsm_states WHERE key = ?",
+            (key,),
+        )
+
+
+async def save_fsm_records(
+    upserts: List[Tuple[str, Optional[str], str, float]],
+    deletes: List[str],
+) -> None:
+    """Пакетно сохраняет записи FSM (key, state, data_json, updated_at) и удаляет пустые — одной транзакцией."""
+    if not upserts and not deletes:
+        return
+    async with pool.write() as db:
+        if upserts:
+            await _execute_many(
+                db,
+                "fsm_upsert",
+                """
+                INSERT INTO fsm_states (key, state, data, updated_at) VALUES (?, ?, ?, ?)
+                ON CONFLICT(key) DO UPDATE SET
+                    state = excluded.state, data = excluded.data, updated_at = excluded.updated_at
+                """,
+                upserts,
+            )
+        if deletes:
+            await _execute_many(db, "fsm_delete", "DELETE FROM fsm_states WHERE key = ?", [(k,) for k in deletes])
+
+
+async def delete_expired_fsm_records(updated_before: float) -> int:
+    async with pool.write() as db:
+        cursor = await _execute(
+            db,
+            "fsm_expire",
+            "DELETE FROM fsm_states WHERE updated_at < ?",
+            (updated_before,),
         )
-        # Очищаем активные билеты
-        await db.execute("DELETE FROM tickets")
-        # Закрываем текущую лотерею
-        await db.execute(
-            "UPDATE lotteries SET archived_at = CURRENT_TIMESTAMP WHERE archived_at IS NULL"
+        return cursor.rowcount
+
+
+async def acquire_lease(name: str, owner: str, ttl: float) -> bool:
+    """
+    Захватывает (или продлевает, если владелец тот же) именованную блокировку
+    в БД на ttl секунд. Просроченную блокировку упавшего процесса можно перехватить.
+    """
+    now = time.time()
+    async with pool.write() as db:
+        cursor = await _execute(
+            db,
+            "acquire_lease",
+            """
+            INSERT INTO locks (name, owner, expires_at) VALUES (?, ?, ?)
+            ON CONFLICT(name) DO UPDATE SET owner = excluded.owner, expires_at = excluded.expires_at
+            WHERE locks.owner = excluded.owner OR locks.expires_at < ?
+            """,
+            (name, owner, now + ttl, now),
         )
-        # Открываем новую
-        await db.execute("INSERT INTO lotteries DEFAULT VALUES")
-        await db.commit()
+        return cursor.rowcount > 0
 
 
+async def release_lease(name: str, owner: str) -> None:
+    async with pool.write() as db:
+        await _execute(
+            db,
+            "release_lease",
+            "DELETE FROM locks WHERE name = ? AND owner = ?",
+            (name, owner),
+        )
@@ -0,0 +1,100 @@
+"""
+Сводные объявления о новых билетах для группового чата.
+
+При низкой нагрузке каждое объявление уходит сразу, как раньше. Если за
+окно DIGEST_WINDOW секунд приходят ещё билеты, они копятся и уходят одним
+сообщением по окончании окна или как только наберётся DIGEST_MAX_ITEMS.
+"""
+
+import asyncio
+import os
+from typing import Dict, List, Tuple
+
+from outbox import Outbox, PRIORITY_NOTICE, outbox
+
+
+DIGEST_WINDOW = float(os.getenv("DIGEST_WINDOW", "30"))  # 0 — отключить сводки
+DIGEST_MAX_ITEMS = int(os.getenv("DIGEST_MAX_ITEMS", "50"))
+
+
+def format_ticket_notice(user_label: str, ticket_number: int) -> str:
+    return f"🎟 Пользователь @{user_label} получил билет №{ticket_number}"
+
+
+def format_ticket_digest(items: List[Tuple[str, int]]) -> str:
+    by_user: Dict[str, List[int]] = {}
+    for user_label, ticket_number in items:
+        by_user.setdefault(user_label, []).append(ticket_number)
+    lines = [
+        f"@{user_label} — " + ", ".join(f"№{n}" for n in numbers)
+        for user_label, numbers in by_user.items()
+    ]
+    return f"🎟 Новые билеты ({len(items)} шт.):\n" + "\n".join(lines)
+
+
+def format_tickets(items: List[Tuple[str, int]]) -> str:
+    return format_ticket_notice(*items[0]) if len(items) == 1 else format_ticket_digest(items)
+
+
+class TicketDigest:
+    """Копит объявления о билетах по чатам и отправляет их сводками через outbox."""
+
+    def __init__(self, sink: Outbox, window: float = DIGEST_WINDOW, max_items: int = DIGEST_MAX_ITEMS) -> None:
+        self._sink = sink
+        self._window = window
+        self._max_items = max(1, max_items)
+        self._pending: Dict[int, List[Tuple[str, int]]] = {}
+        self._windows: Dict[int, asyncio.Task] = {}
+
+    def add(self, chat_id: int, user_label: str, ticket_number: int) -> None:
+        self.add_many(chat_id, user_label, [ticket_number])
+
+    def add_many(self, chat_id: int, user_label: str, ticket_numbers: List[int]) -> None:
+        """Несколько билетов одного пользователя (альбом) объявляются вместе, одним сообщением."""
+        items = [(user_label, n) for n in ticket_numbers]
+        if not items:
+            return
+        if self._window <= 0:
+            self._sink.enqueue(chat_id, format_tickets(items), PRIORITY_NOTICE)
+            return
+        if chat_id not in self._windows:
+            # Тишина в чате: объявляем сразу и открываем окно для следующих билетов
+            self._sink.enqueue(chat_id, format_tickets(items), PRIORITY_NOTICE)
+            self._windows[chat_id] = asyncio.create_task(self._run_window(chat_id))
+            return
+        pending = self._pending.setdefault(chat_id, [])
+        pending.extend(items)
+        if len(pending) >= self._max_items:
+            self._flush_chat(chat_id)
+
+    async def _run_window(self, chat_id: int) -> None:
+        try:
+            while True:
+                await asyncio.sleep(self._window)
+                if not self._pending.get(chat_id):
+                    break
+                self._flush_chat(chat_id)
+        finally:
+            self._windows.pop(chat_id, None)
+
+    def _flush_chat(self, chat_id: int) -> None:
+        items = self._pending.pop(chat_id, None)
+        if not items:
+            return
+        self._sink.enqueue(chat_id, format_tickets(items), PRIORITY_NOTICE)
+
+    def flush(self) -> None:
+        """Немедленно отправляет всё накопленное (перед розыгрышем, архивацией и остановкой)."""
+        for chat_id in list(self._pending):
+            self._flush_chat(chat_id)
+
+    async def stop(self) -> None:
+        self.flush()
+        tasks = list(self._windows.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._windows.clear()
+
+
+digest = TicketDigest(outbox)
@@ -0,0 +1,112 @@
+"""
+Движок случайного выбора билетов для розыгрыша.
+
+Держит в памяти компактный массив номеров активных билетов: выбор
+случайного билета — O(1), добавление и удаление (swap-remove) — O(1).
+Для розыгрыша нескольких победителей — потоковая выборка (reservoir
+sampling) с памятью O(k).
+"""
+
+import heapq
+import math
+import secrets
+from array import array
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+_rng = secrets.SystemRandom()
+
+
+class ActiveTicketIndex:
+    """
+    Множество номеров активных билетов с равновероятным выбором за O(1).
+
+    Выключенный индекс (enabled=False) ничего не хранит — используется,
+    когда розыгрыш идёт через SQL.
+    """
+
+    def __init__(self, enabled: bool = True) -> None:
+        self.enabled = enabled
+        self._numbers = array("q")
+        self._positions: Dict[int, int] = {}
+
+    def __len__(self) -> int:
+        return len(self._numbers)
+
+    def __contains__(self, ticket_number: int) -> bool:
+        return ticket_number in self._positions
+
+    def rebuild(self, ticket_numbers: Iterable[int]) -> None:
+        self.clear()
+        for ticket_number in ticket_numbers:
+            self.add(ticket_number)
+
+    def clear(self) -> None:
+        self._numbers = array("q")
+        self._positions.clear()
+
+    def add(self, ticket_number: int) -> None:
+        if not self.enabled or ticket_number in self._positions:
+            return
+        self._positions[ticket_number] = len(self._numbers)
+        self._numbers.append(ticket_number)
+
+    def discard(self, ticket_number: int) -> None:
+        position = self._positions.pop(ticket_number, None)
+        if position is None:
+            return
+        last = self._numbers.pop()
+        if position < len(self._numbers):
+            # Переносим последний элемент на место удалённого
+            self._numbers[position] = last
+            self._positions[last] = position
+
+    def choice(self) -> Optional[int]:
+        if not self._numbers:
+            return None
+        return self._numbers[secrets.randbelow(len(self._numbers))]
+
+
+class ReservoirSampler:
+    """
+    Выборка k различных элементов из потока за один проход (алгоритм A-ES).
+
+    Каждому элементу присваивается ключ log(u) / weight, в выборке остаются
+    k элементов с наибольшими ключами. При равных весах это равновероятная
+    выборка без повторений. Память — O(k) независимо от длины потока.
+    """
+
+    def __init__(self, k: int) -> None:
+        if k < 1:
+            raise ValueError("k должно быть положительным")
+        self._k = k
+        self._heap: List[Tuple[float, int, Any]] = []
+        self._seq = 0
+
+    def offer(self, item: Any, weight: float = 1.0) -> None:
+        if weight <= 0:
+            return
+        u = _rng.random()
+        while u == 0.0:
+            u = _rng.random()
+        key = math.log(u) / weight
+        self._seq += 1
+        if len(self._heap) < self._k:
+            heapq.heappush(self._heap, (key, self._seq, item))
+        elif key > self._heap[0][0]:
+            heapq.heapreplace(self._heap, (key, self._seq, item))
+
+    def result(self) -> List[Any]:
+        return [item for _, _, item in sorted(self._heap, reverse=True)]
+
+
+class GroupPicker:
+    """Равновероятный выбор одного элемента из группы, приходящей потоком (reservoir из одного элемента)."""
+
+    def __init__(self) -> None:
+        self.count = 0
+        self.item: Any = None
+
+    def offer(self, item: Any) -> None:
+        self.count += 1
+        if secrets.randbelow(self.count) == 0:
+            self.item = item
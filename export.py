@@ -0,0 +1,139 @@
+"""
+Выгрузка билетов и архива в сжатые файлы CSV или JSONL (gzip).
+
+Строки читаются из базы страницами (db.iter_export_pages), а сжатие и
+запись на диск идут в отдельном потоке, поэтому память не зависит от
+размера выгрузки и event loop не блокируется. Из бота выгрузка запускается
+фоновой задачей, а готовый файл приходит админу документом.
+
+Запуск из командной строки:
+    python export.py --table archive --lottery 3 --format jsonl --output archive.jsonl.gz
+"""
+
+import argparse
+import asyncio
+import csv
+import gzip
+import json
+import logging
+import os
+import tempfile
+import time
+from typing import Any, List, Optional, Set, Tuple
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramAPIError
+from aiogram.types import FSInputFile
+
+import db
+
+
+logger = logging.getLogger(__name__)
+
+FORMATS = ("csv", "jsonl")
+EXPORT_PAGE_SIZE = int(os.getenv("EXPORT_PAGE_SIZE", "5000"))
+# Бот не может отправить документ больше 50 МБ через облачный Bot API
+MAX_DOCUMENT_BYTES = 50 * 1024 * 1024
+
+_tasks: Set[asyncio.Task] = set()
+
+
+def _write_rows(stream: Any, fmt: str, columns: Tuple[str, ...], rows: List[Tuple]) -> None:
+    if fmt == "csv":
+        csv.writer(stream).writerows(rows)
+    else:
+        stream.writelines(json.dumps(dict(zip(columns, row)), ensure_ascii=False) + "\n" for row in rows)
+
+
+async def export_tickets(
+    path: str,
+    table: str = "tickets",
+    fmt: str = "csv",
+    lottery_id: Optional[int] = None,
+    status: Optional[str] = None,
+    user_id: Optional[int] = None,
+) -> int:
+    """Пишет выгрузку в path (gzip) и возвращает число строк."""
+    if fmt not in FORMATS:
+        raise ValueError(f"Неизвестный формат выгрузки: {fmt}")
+    if table not in db.EXPORT_TABLES:
+        raise ValueError(f"Неизвестная таблица выгрузки: {table}")
+    columns = db.EXPORT_TABLES[table][1]
+    count = 0
+    with gzip.open(path, "wt", encoding="utf-8", newline="") as stream:
+        if fmt == "csv":
+            await asyncio.to_thread(csv.writer(stream).writerow, columns)
+        async for rows in db.iter_export_pages(table, lottery_id, status, user_id, EXPORT_PAGE_SIZE):
+            await asyncio.to_thread(_write_rows, stream, fmt, columns, rows)
+            count += len(rows)
+    return count
+
+
+async def _run_export(bot: Bot, chat_id: int, table: str, fmt: str, **filters: Optional[Any]) -> None:
+    filename = f"{table}-{time.strftime('%Y%m%d-%H%M%S')}.{fmt}.gz"
+    fd, path = tempfile.mkstemp(suffix=f".{fmt}.gz")
+    os.close(fd)
+    try:
+        count = await export_tickets(path, table, fmt, **filters)
+        size = os.path.getsize(path)
+        if size > MAX_DOCUMENT_BYTES:
+            await bot.send_message(
+                chat_id,
+                f"⚠️ Выгрузка получилась слишком большой ({size // (1024 * 1024)} МБ). "
+                "Сузьте фильтр или выгрузите через python export.py",
+            )
+            return
+        await bot.send_document(
+            chat_id,
+            FSInputFile(path, filename=filename),
+            caption=f"📤 Выгрузка {table}: {count} строк",
+        )
+    except asyncio.CancelledError:
+        raise
+    except Exception as exc:
+        logger.exception("Выгрузка %s не удалась", table)
+        try:
+            await bot.send_message(chat_id, f"❌ Выгрузка не удалась: {exc}", parse_mode=None)
+        except TelegramAPIError:
+            pass
+    finally:
+        os.remove(path)
+
+
+def start_export(bot: Bot, chat_id: int, table: str = "tickets", fmt: str = "csv", **filters: Optional[Any]) -> None:
+    """Запускает выгрузку фоновой задачей; файл придёт в chat_id документом."""
+    task = asyncio.create_task(_run_export(bot, chat_id, table, fmt, **filters))
+    _tasks.add(task)
+    task.add_done_callback(_tasks.discard)
+
+
+async def stop() -> None:
+    """Отменяет незавершённые выгрузки (при остановке бота)."""
+    tasks = list(_tasks)
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+
+async def _cli(args: argparse.Namespace) -> None:
+    await db.init_db()
+    try:
+        count = await export_tickets(args.output, args.table, args.format, args.lottery, args.status, args.user)
+    finally:
+        await db.close_db()
+    print(f"{args.output}: {count} строк")
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Выгрузка билетов в gzip CSV/JSONL")
+    parser.add_argument("--table", choices=sorted(db.EXPORT_TABLES), default="tickets")
+    parser.add_argument("--format", choices=FORMATS, default="csv")
+    parser.add_argument("--lottery", type=int, default=None, help="только билеты этой лотереи (lotteries.id)")
+    parser.add_argument("--status", default=None, help="только билеты с этим статусом")
+    parser.add_argument("--user", type=int, default=None, help="только билеты этого пользователя")
+    parser.add_argument("--output", required=True, help="путь к файлу .gz")
+    asyncio.run(_cli(parser.parse_args(argv)))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,28 +1,43 @@
 """
 Клавиатуры для пользователей и админов.
+
+Статичные меню собираются один раз и переиспользуются (lru_cache), поэтому
+возвращаемые ими объекты нельзя изменять.
 """
 
+from functools import lru_cache
+from typing import List, Optional
+
 from aiogram.types import KeyboardButton, ReplyKeyboardMarkup, InlineKeyboardMarkup, InlineKeyboardButton
 
 
+@lru_cache(maxsize=None)
 def user_menu() -> ReplyKeyboardMarkup:
     return ReplyKeyboardMarkup(
         keyboard=[
             [KeyboardButton(text="📸 Загрузить новое фото")],
             [KeyboardButton(text="🎟 Посмотреть мои лотерейные билетики")],
+            [KeyboardButton(text="🎯 Выбрать лотерею")],
+            [KeyboardButton(text="📊 Статистика")],
             [KeyboardButton(text="⬅️ В меню")],
         ],
         resize_keyboard=True,
     )
 
 
+@lru_cache(maxsize=None)
 def admin_menu() -> ReplyKeyboardMarkup:
     return ReplyKeyboardMarkup(
         keyboard=[
             [KeyboardButton(text="🎲 Запустить розыгрыш")],
+            [KeyboardButton(text="🏆 Разыграть несколько победителей")],
             [KeyboardButton(text="📷 Показать фото по номеру")],
-            [KeyboardButton(text="🗑 Удалить билетик")],
+            [KeyboardButton(text="🗑 Удалить билеты")],
             [KeyboardButton(text="📦 Архивировать лотерею")],
+            [KeyboardButton(text="🧬 Повторные фото")],
+            [KeyboardButton(text="📤 Выгрузить билеты")],
+            [KeyboardButton(text="🎯 Выбрать лотерею")],
+            [KeyboardButton(text="📊 Статистика")],
             [KeyboardButton(text="🔧 Проверить настройки")],
             [KeyboardButton(text="⬅️ В меню")],
         ],
@@ -30,6 +45,7 @@ def admin_menu() -> ReplyKeyboardMarkup:
     )
 
 
+@lru_cache(maxsize=None)
 def back_menu() -> ReplyKeyboardMarkup:
     return ReplyKeyboardMarkup(
         keyboard=[[KeyboardButton(text="⬅️ В меню")]],
@@ -37,19 +53,89 @@ def back_menu() -> ReplyKeyboardMarkup:
     )
 
 
-def lottery_inline_actions(ticket_number: int) -> InlineKeyboardMarkup:
+def lottery_select_keyboard(lotteries: list, selected_id: Optional[int] = None) -> InlineKeyboardMarkup:
+    """Список открытых лотерей (db.Lottery); выбранная отмечена галочкой"""
+    return InlineKeyboardMarkup(
+        inline_keyboard=[
+            [InlineKeyboardButton(
+                text=f"✅ {lottery.label}" if lottery.id == selected_id else lottery.label,
+                callback_data=f"select_lottery:{lottery.id}",
+            )]
+            for lottery in lotteries
+        ]
+    )
+
+
+def lottery_inline_actions(lottery_id: int, ticket_number: int, with_number: bool = False) -> InlineKeyboardMarkup:
+    confirm_text = f"✅ Подтвердить №{ticket_number}" if with_number else "✅ Подтвердить победителя"
+    reject_text = f"❌ Отклонить №{ticket_number}" if with_number else "❌ Отклонить билет"
     return InlineKeyboardMarkup(
         inline_keyboard=[
             [
-                InlineKeyboardButton(text="✅ Подтвердить победителя", callback_data=f"confirm_win:{ticket_number}"),
-                InlineKeyboardButton(text="❌ Отклонить билет", callback_data=f"reject_win:{ticket_number}"),
+                InlineKeyboardButton(text=confirm_text, callback_data=f"confirm_win:{lottery_id}:{ticket_number}"),
+                InlineKeyboardButton(text=reject_text, callback_data=f"reject_win:{lottery_id}:{ticket_number}"),
             ]
         ]
     )
 
 
-def user_tickets_inline_keyboard(ticket_numbers: list) -> InlineKeyboardMarkup:
-    """Создает inline-клавиатуру с номерами билетов пользователя"""
+def lottery_inline_actions_batch(lottery_id: int, ticket_numbers: List[int]) -> InlineKeyboardMarkup:
+    """Клавиатура подтверждения/отклонения для нескольких билетов: по строке на билет"""
+    return InlineKeyboardMarkup(
+        inline_keyboard=[
+            lottery_inline_actions(lottery_id, num, with_number=True).inline_keyboard[0]
+            for num in ticket_numbers
+        ]
+    )
+
+
+def without_ticket_actions(
+    markup: Optional[InlineKeyboardMarkup], lottery_id: int, ticket_number: int
+) -> Optional[InlineKeyboardMarkup]:
+    """Убирает из клавиатуры строку с кнопками для указанного билета; None — если строк не осталось"""
+    if not markup:
+        return None
+    callbacks = (f"confirm_win:{lottery_id}:{ticket_number}", f"reject_win:{lottery_id}:{ticket_number}")
+    rows = [
+        row for row in markup.inline_keyboard
+        if not any(button.callback_data in callbacks for button in row)
+    ]
+    if not rows:
+        return None
+    return InlineKeyboardMarkup(inline_keyboard=rows)
+
+
+def draw_many_mode_keyboard(lottery_id: int, count: int) -> InlineKeyboardMarkup:
+    """Выбор режима розыгрыша нескольких победителей"""
+    return InlineKeyboardMarkup(
+        inline_keyboard=[
+            [InlineKeyboardButton(text="🎟 Все билеты равны", callback_data=f"draw_many:{lottery_id}:{count}:any")],
+            [InlineKeyboardButton(text="👤 Один выигрыш на участника (шанс по числу билетов)", callback_data=f"draw_many:{lottery_id}:{count}:user_weighted")],
+            [InlineKeyboardButton(text="👥 Один выигрыш на участника (равные шансы)", callback_data=f"draw_many:{lottery_id}:{count}:user_equal")],
+        ]
+    )
+
+
+def moderation_confirm_keyboard(lottery_id: int, count: int) -> InlineKeyboardMarkup:
+    """Подтверждение массовой модерации после пробного подсчёта"""
+    return InlineKeyboardMarkup(
+        inline_keyboard=[
+            [
+                InlineKeyboardButton(text=f"🗑 Удалить ({count})", callback_data=f"moderate:{lottery_id}:deleted"),
+                InlineKeyboardButton(text=f"🚫 Отклонить ({count})", callback_data=f"moderate:{lottery_id}:rejected"),
+            ],
+            [InlineKeyboardButton(text="✖️ Отмена", callback_data=f"moderate:{lottery_id}:cancel")],
+        ]
+    )
+
+
+def user_tickets_inline_keyboard(
+    lottery_id: int,
+    ticket_numbers: list,
+    has_prev: bool = False,
+    has_next: bool = False,
+) -> InlineKeyboardMarkup:
+    """Создает inline-клавиатуру с номерами билетов пользователя (одна страница)"""
     if not ticket_numbers:
         return InlineKeyboardMarkup(inline_keyboard=[])
     
@@ -62,8 +148,23 @@ def user_tickets_inline_keyboard(ticket_numbers: list) -> InlineKeyboardMarkup:
                 ticket_num = ticket_numbers[i + j]
                 row.append(InlineKeyboardButton(
                     text=f"🎟 №{ticket_num}", 
-                    callback_data=f"view_ticket:{ticket_num}"
+                    callback_data=f"view_ticket:{lottery_id}:{ticket_num}"
                 ))
         keyboard.append(row)
     
+    # Листаем по ключу: границы текущей страницы передаются в callback_data
+    navigation = []
+    if has_prev:
+        navigation.append(InlineKeyboardButton(
+            text="◀️ Назад",
+            callback_data=f"tickets_page:{lottery_id}:prev:{ticket_numbers[0]}",
+        ))
+    if has_next:
+        navigation.append(InlineKeyboardButton(
+            text="Вперёд ▶️",
+            callback_data=f"tickets_page:{lottery_id}:next:{ticket_numbers[-1]}",
+        ))
+    if navigation:
+        keyboard.append(navigation)
+    
     return InlineKeyboardMarkup(inline_keyboard=keyboard)
@@ -0,0 +1,61 @@
+"""
+Таблица лидеров лотереи: топ-K участников по числу активных билетов.
+
+Счётчики участников лежат в БД (user_stats, их ведут триггеры), а здесь в
+памяти держится только верхушка: K лидеров и верхняя граница счёта всех
+остальных. Ответ на запрос лидеров — O(K), обновление после записи — O(K)
+без обращения к БД. Если лидер опустился ниже этой границы, порядок за
+пределами топа неизвестен: топ помечается устаревшим и перечитывается из
+БД одним запросом по индексу, тоже за O(K).
+"""
+
+from typing import Dict, Iterable, List, Optional, Tuple
+
+# (user_id, username, активных билетов)
+Entry = Tuple[int, Optional[str], int]
+
+
+class TopK:
+    """Лидеры одной лотереи; rows — первые K + 1 строк user_stats по убыванию счёта."""
+
+    def __init__(self, k: int, rows: Iterable[Entry]) -> None:
+        self.k = k
+        rows = list(rows)
+        self._members: Dict[int, Tuple[Optional[str], int]] = {
+            user_id: (username, count) for user_id, username, count in rows[:k]
+        }
+        # Ни у кого вне топа нет больше _outside билетов
+        self._outside = rows[k][2] if len(rows) > k else 0
+        self.stale = False
+
+    def __len__(self) -> int:
+        return len(self._members)
+
+    def update(self, user_id: int, username: Optional[str], count: int) -> None:
+        """Новый счёт участника после записи в БД."""
+        if self.stale:
+            return
+        if user_id in self._members:
+            if count < self._outside:
+                # Кого-то снаружи, возможно, пора поднять в топ — а кого, не знаем
+                self.stale = True
+                return
+            self._members[user_id] = (username, count)
+            return
+        if len(self._members) < self.k:
+            # Топ неполон, только пока участников меньше K, — снаружи никого нет
+            self._members[user_id] = (username, count)
+            return
+        lowest = min(self._members, key=lambda member: self._members[member][1])
+        if count > self._members[lowest][1]:
+            self._outside = max(self._outside, self._members.pop(lowest)[1])
+            self._members[user_id] = (username, count)
+        else:
+            self._outside = max(self._outside, count)
+
+    def ranking(self) -> List[Entry]:
+        """Лидеры по убыванию счёта; участники без активных билетов не показываются."""
+        return sorted(
+            ((user_id, username, count) for user_id, (username, count) in self._members.items() if count > 0),
+            key=lambda entry: -entry[2],
+        )
@@ -0,0 +1,70 @@
+"""
+Выбор лотереи, с которой работает пользователь.
+
+Открытых лотерей может быть несколько (по группе или кампании). Выбор
+пользователя хранится в том же FSM-хранилище, что и состояния, но под
+отдельным destiny: state.clear() при возврате в меню его не сбрасывает.
+
+LotteryMiddleware кладёт в данные обработчика lottery — лотерею, к которой
+относится обновление, или None, если пользователь ещё не выбрал, — и
+lotteries — все открытые лотереи. Пока лотерея одна, выбирать не нужно и
+хранилище не читается.
+"""
+
+from dataclasses import replace
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from aiogram import BaseMiddleware
+from aiogram.fsm.context import FSMContext
+from aiogram.fsm.storage.base import StorageKey
+from aiogram.types import TelegramObject
+
+from db import Lottery, get_open_lotteries, get_successor_lottery
+
+LOTTERY_DESTINY = "lottery"
+
+
+def _selection_key(state: FSMContext) -> StorageKey:
+    return replace(state.key, destiny=LOTTERY_DESTINY)
+
+
+async def remember_lottery(state: FSMContext, lottery_id: int) -> None:
+    """Запоминает выбор пользователя."""
+    await state.storage.set_data(_selection_key(state), {"lottery_id": lottery_id})
+
+
+async def selected_lottery(state: FSMContext, lotteries: List[Lottery]) -> Optional[Lottery]:
+    """
+    Лотерея, выбранная пользователем, среди открытых. Если выбранную
+    заархивировали, выбор переходит на открытую вместо неё.
+    """
+    data = await state.storage.get_data(_selection_key(state))
+    lottery_id = data.get("lottery_id")
+    if lottery_id is None:
+        return None
+    for lottery in lotteries:
+        if lottery.id == lottery_id:
+            return lottery
+    successor = await get_successor_lottery(lottery_id)
+    if successor is not None:
+        await remember_lottery(state, successor.id)
+    return successor
+
+
+class LotteryMiddleware(BaseMiddleware):
+    """Внешняя middleware на dp.update: добавляет в данные lottery и lotteries."""
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        lotteries = await get_open_lotteries()
+        lottery = lotteries[0] if len(lotteries) == 1 else None
+        state: Optional[FSMContext] = data.get("state")
+        if lottery is None and state is not None:
+            lottery = await selected_lottery(state, lotteries)
+        data["lottery"] = lottery
+        data["lotteries"] = lotteries
+        return await handler(event, data)
@@ -0,0 +1,76 @@
+"""
+Роли и кнопки главного меню.
+
+RoleMiddleware один раз на обновление определяет, админ ли отправитель
+(ADMIN_IDS хранится как frozenset), и кладёт результат в данные обработчика
+под именем is_admin.
+
+MenuRouter сопоставляет текст кнопки с обработчиком поиском по словарю: на
+диспетчере регистрируется один обработчик вместо цепочки F.text == "...",
+и стоимость разбора не растёт с числом пунктов меню. Пункты только для
+админов проверяются здесь же, до вызова обработчика.
+"""
+
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Dict, Iterable, Union
+
+from aiogram import BaseMiddleware
+from aiogram.dispatcher.event.handler import CallableObject
+from aiogram.filters import Filter
+from aiogram.types import Message, TelegramObject, User
+
+ACCESS_DENIED_TEXT = "Недостаточно прав"
+
+
+class RoleMiddleware(BaseMiddleware):
+    """Внешняя middleware на dp.update: добавляет в данные is_admin для отправителя обновления."""
+
+    def __init__(self, admin_ids: Iterable[int]) -> None:
+        self.admin_ids = frozenset(int(x) for x in admin_ids)
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        user: Union[User, None] = data.get("event_from_user")
+        data["is_admin"] = user is not None and user.id in self.admin_ids
+        return await handler(event, data)
+
+
+@dataclass
+class MenuRoute:
+    text: str
+    handler: CallableObject
+    admin_only: bool = False
+    name: str = field(init=False)
+
+    def __post_init__(self) -> None:
+        self.name = self.handler.callback.__name__
+
+
+class MenuRouter(Filter):
+    """Таблица «текст кнопки → обработчик» с проверкой роли; сам же служит фильтром aiogram."""
+
+    def __init__(self) -> None:
+        self._routes: Dict[str, MenuRoute] = {}
+
+    def add(self, text: str, handler: Callable[..., Awaitable[Any]], admin_only: bool = False) -> None:
+        if text in self._routes:
+            raise ValueError(f"Кнопка меню «{text}» уже зарегистрирована")
+        self._routes[text] = MenuRoute(text, CallableObject(handler), admin_only)
+
+    async def __call__(self, message: Message) -> Union[bool, Dict[str, Any]]:
+        """Фильтр aiogram: подходит, если текст сообщения — кнопка меню; найденный пункт идёт в данные."""
+        route = self._routes.get(message.text) if message.text else None
+        if route is None:
+            return False
+        return {"menu_route": route}
+
+    async def dispatch(self, message: Message, menu_route: MenuRoute, is_admin: bool, **data: Any) -> Any:
+        """Общий обработчик всех кнопок: проверяет роль и вызывает обработчик пункта с нужными ему аргументами."""
+        if menu_route.admin_only and not is_admin:
+            await message.answer(ACCESS_DENIED_TEXT)
+            return None
+        return await menu_route.handler.call(message, is_admin=is_admin, **data)
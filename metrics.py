@@ -0,0 +1,196 @@
+"""
+Метрики бота в текстовом формате Prometheus.
+
+- Middleware диспетчера считает по каждому обработчику гистограмму времени,
+  ошибки и число выполняющихся сейчас вызовов.
+- Время и число строк по именованным запросам собирает db.query_stats.
+- Отдаются метрики локальным HTTP-сервером на METRICS_HOST:METRICS_PORT
+  (GET /metrics). При нескольких воркерах каждый слушает METRICS_PORT + номер.
+"""
+
+import logging
+import os
+import time
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional
+
+from aiohttp import web
+from aiogram import BaseMiddleware
+from aiogram.dispatcher.event.bases import SkipHandler
+from aiogram.types import TelegramObject
+
+from db import LATENCY_BUCKETS, get_batch_stats, get_user_tickets_cache_stats, query_stats
+from outbox import outbox
+from throttle import throttler
+
+
+logger = logging.getLogger(__name__)
+
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))  # 0 — сервер метрик не запускается
+
+PREFIX = "lottery"
+
+
+class Histogram:
+    """Гистограмма в духе Prometheus: счётчики по корзинам LATENCY_BUCKETS, сумма и количество."""
+
+    __slots__ = ("buckets", "total", "count")
+
+    def __init__(self) -> None:
+        self.buckets = [0] * len(LATENCY_BUCKETS)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.count += 1
+        self.total += value
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if value <= bound:
+                self.buckets[i] += 1
+                break
+
+
+class HandlerMetrics:
+    """Метрики обработчиков: время, ошибки и выполняющиеся вызовы по имени обработчика."""
+
+    def __init__(self) -> None:
+        self.latency: Dict[str, Histogram] = {}
+        self.errors: Dict[str, int] = {}
+        self.in_flight: Dict[str, int] = {}
+
+    def started(self, name: str) -> None:
+        self.in_flight[name] = self.in_flight.get(name, 0) + 1
+
+    def finished(self, name: str, elapsed: float, failed: bool) -> None:
+        self.in_flight[name] -= 1
+        histogram = self.latency.get(name)
+        if histogram is None:
+            histogram = self.latency[name] = Histogram()
+        histogram.observe(elapsed)
+        if failed:
+            self.errors[name] = self.errors.get(name, 0) + 1
+        else:
+            self.errors.setdefault(name, 0)
+
+
+handler_metrics = HandlerMetrics()
+
+
+class HandlerMetricsMiddleware(BaseMiddleware):
+    """Внутренняя middleware: вызывается уже для выбранного обработчика, поэтому знает его имя."""
+
+    def __init__(self, metrics: HandlerMetrics = handler_metrics) -> None:
+        self._metrics = metrics
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        # Кнопки меню идут через один общий обработчик — считаем по конкретному пункту
+        menu_route = data.get("menu_route")
+        if menu_route is not None:
+            name = menu_route.name
+        else:
+            name = getattr(getattr(data.get("handler"), "callback", None), "__name__", "unknown")
+        self._metrics.started(name)
+        started = time.perf_counter()
+        failed = False
+        try:
+            return await handler(event, data)
+        except SkipHandler:
+            raise
+        except Exception:
+            failed = True
+            raise
+        finally:
+            self._metrics.finished(name, time.perf_counter() - started, failed)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _histogram_lines(metric: str, label: str, name: str, buckets: List[int], total: float, count: int) -> Iterable[str]:
+    labels = f'{label}="{_escape(name)}"'
+    cumulative = 0
+    for bound, value in zip(LATENCY_BUCKETS, buckets):
+        cumulative += value
+        yield f'{metric}_bucket{{{labels},le="{bound}"}} {cumulative}'
+    yield f'{metric}_bucket{{{labels},le="+Inf"}} {count}'
+    yield f"{metric}_sum{{{labels}}} {total}"
+    yield f"{metric}_count{{{labels}}} {count}"
+
+
+def render_metrics(metrics: HandlerMetrics = handler_metrics) -> str:
+    """Все метрики процесса в текстовом формате Prometheus 0.0.4."""
+    lines: List[str] = []
+
+    metric = f"{PREFIX}_handler_duration_seconds"
+    lines += [f"# HELP {metric} Время выполнения обработчика.", f"# TYPE {metric} histogram"]
+    for name, histogram in sorted(metrics.latency.items()):
+        lines += _histogram_lines(metric, "handler", name, histogram.buckets, histogram.total, histogram.count)
+
+    metric = f"{PREFIX}_handler_errors_total"
+    lines += [f"# HELP {metric} Исключения в обработчике.", f"# TYPE {metric} counter"]
+    lines += [f'{metric}{{handler="{_escape(n)}"}} {v}' for n, v in sorted(metrics.errors.items())]
+
+    metric = f"{PREFIX}_handler_in_flight"
+    lines += [f"# HELP {metric} Вызовы обработчика, выполняющиеся сейчас.", f"# TYPE {metric} gauge"]
+    lines += [f'{metric}{{handler="{_escape(n)}"}} {v}' for n, v in sorted(metrics.in_flight.items())]
+
+    queries = query_stats.histograms()
+    metric = f"{PREFIX}_db_query_duration_seconds"
+    lines += [f"# HELP {metric} Время выполнения именованного запроса.", f"# TYPE {metric} histogram"]
+    for name, (count, total, _, buckets) in sorted(queries.items()):
+        lines += _histogram_lines(metric, "query", name, buckets, total, count)
+
+    metric = f"{PREFIX}_db_query_rows_total"
+    lines += [f"# HELP {metric} Строк прочитано или изменено запросом.", f"# TYPE {metric} counter"]
+    lines += [f'{metric}{{query="{_escape(n)}"}} {rows}' for n, (_, _, rows, _) in sorted(queries.items())]
+
+    gauges = {
+        "outbox_queue_size": ("Сообщений в очереди outbox.", "gauge", len(outbox)),
+        "outbox_sent_total": ("Отправлено сообщений через outbox.", "counter", outbox.sent),
+        "outbox_dropped_total": ("Отброшено сообщений outbox.", "counter", outbox.dropped),
+    }
+    cache = get_user_tickets_cache_stats()
+    gauges["user_tickets_cache_hits_total"] = ("Попадания в кэш «Мои билеты».", "counter", cache["hits"])
+    gauges["user_tickets_cache_misses_total"] = ("Промахи кэша «Мои билеты».", "counter", cache["misses"])
+    gauges["user_tickets_cache_bytes"] = ("Оценка памяти кэша «Мои билеты».", "gauge", cache["bytes"])
+    batch = get_batch_stats()
+    if batch is not None:
+        gauges["db_batches_total"] = ("Пачек групповой фиксации.", "counter", batch["batches"])
+        gauges["db_batch_rows_total"] = ("Строк в пачках групповой фиксации.", "counter", batch["rows"])
+    gauges["throttle_users"] = ("Пользователей в таблице лимитов частоты.", "gauge", len(throttler))
+    for name, (help_text, kind, value) in gauges.items():
+        metric = f"{PREFIX}_{name}"
+        lines += [f"# HELP {metric} {help_text}", f"# TYPE {metric} {kind}", f"{metric} {value}"]
+
+    throttle = throttler.stats()
+    metric = f"{PREFIX}_throttled_total"
+    lines += [f"# HELP {metric} Обновлений отброшено лимитом частоты.", f"# TYPE {metric} counter"]
+    lines += [f'{metric}{{action="{a}"}} {v}' for a, v in sorted(throttle["throttled"].items())]
+
+    return "\n".join(lines) + "\n"
+
+
+async def start_metrics_server(host: str = METRICS_HOST, port: int = METRICS_PORT) -> Optional[web.AppRunner]:
+    """Поднимает HTTP-сервер с GET /metrics; None, если порт не задан."""
+    if port <= 0:
+        return None
+
+    async def handle_metrics(request: web.Request) -> web.Response:
+        return web.Response(
+            body=render_metrics().encode("utf-8"),
+            headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"},
+        )
+
+    app = web.Application()
+    app.router.add_get("/metrics", handle_metrics)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logger.info("Метрики доступны на http://%s:%s/metrics", host, port)
+    return runner
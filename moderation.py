@@ -0,0 +1,110 @@
+"""
+Выбор билетов для массовой модерации.
+
+Админ одной строкой задаёт, какие билеты удалить или отклонить:
+- номера и диапазоны: «15, 20-340, 512» (разделители — запятые или пробелы);
+- все билеты участника: «user 12345», «user @name» или просто «@name».
+
+Номера сливаются в непересекающиеся диапазоны, и db применяет выбор
+одним UPDATE с условием по диапазонам, а не по запросу на билет.
+"""
+
+import re
+from dataclasses import dataclass
+from typing import Iterable, List, Optional, Tuple
+
+# Больше частей в одном запросе не принимаем: каждая — отдельное условие BETWEEN в UPDATE
+MAX_SELECTION_PARTS = 100
+# SQLite хранит целые в 64 битах: большее число не подставить в запрос
+MAX_SQL_INTEGER = 2 ** 63 - 1
+# Сколько диапазонов перечислять в объявлении, прежде чем написать «и ещё»
+ANNOUNCE_MAX_RANGES = 30
+
+SELECTION_HELP = (
+    "Номера билетов через запятую и диапазоны через дефис: 15, 20-340, 512\n"
+    "или все билеты участника: user 12345 или @username"
+)
+
+_RANGE_RE = re.compile(r"^(\d+)(?:\s*[-–—]\s*(\d+))?$")
+_USER_RE = re.compile(r"^(?:(?:user|пользователь)\s+@?|@)([A-Za-z0-9_]+)$", re.IGNORECASE)
+
+
+@dataclass(frozen=True)
+class TicketSelection:
+    """Диапазоны номеров (включительно, по возрастанию, без пересечений) или участник."""
+
+    ranges: Tuple[Tuple[int, int], ...] = ()
+    user_id: Optional[int] = None
+    username: Optional[str] = None
+
+    @property
+    def by_user(self) -> bool:
+        return self.user_id is not None or self.username is not None
+
+    def describe(self) -> str:
+        if self.user_id is not None:
+            return f"все билеты участника {self.user_id}"
+        if self.username is not None:
+            return f"все билеты @{self.username}"
+        return format_ranges(self.ranges)
+
+
+def merge_ranges(ranges: Iterable[Tuple[int, int]]) -> List[Tuple[int, int]]:
+    merged: List[Tuple[int, int]] = []
+    for low, high in sorted(ranges):
+        if merged and low <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], high))
+        else:
+            merged.append((low, high))
+    return merged
+
+
+def parse_selection(text: str) -> TicketSelection:
+    """Разбирает ввод админа; ValueError с понятным текстом, если разобрать не удалось."""
+    text = (text or "").strip()
+    user = _USER_RE.match(text)
+    if user:
+        value = user.group(1)
+        if value.isdigit():
+            if int(value) > MAX_SQL_INTEGER:
+                raise ValueError(f"Неверный ID участника «{value}»")
+            return TicketSelection(user_id=int(value))
+        return TicketSelection(username=value)
+
+    # Пробелы вокруг дефиса склеиваем, чтобы «20 - 340» не распалось на три части
+    parts = [p for p in re.split(r"[,;\s]+", re.sub(r"\s*([-–—])\s*", r"\1", text)) if p]
+    if not parts:
+        raise ValueError("Не указаны номера билетов")
+    if len(parts) > MAX_SELECTION_PARTS:
+        raise ValueError(f"Слишком много частей: не больше {MAX_SELECTION_PARTS} номеров и диапазонов за раз")
+    ranges = []
+    for part in parts:
+        match = _RANGE_RE.match(part)
+        if not match:
+            raise ValueError(f"Не понял «{part}»")
+        low = int(match.group(1))
+        high = int(match.group(2)) if match.group(2) else low
+        if low < 1 or high < low or high > MAX_SQL_INTEGER:
+            raise ValueError(f"Неверный диапазон «{part}»")
+        ranges.append((low, high))
+    return TicketSelection(ranges=tuple(merge_ranges(ranges)))
+
+
+def format_ranges(ranges: Iterable[Tuple[int, int]], limit: Optional[int] = None) -> str:
+    """«№15, №20–340, №512»; при limit остальные диапазоны сводятся в «и ещё N»."""
+    ranges = list(ranges)
+    shown = ranges if limit is None else ranges[:limit]
+    text = ", ".join(f"№{low}" if low == high else f"№{low}–{high}" for low, high in shown)
+    if len(shown) < len(ranges):
+        text += f" и ещё {len(ranges) - len(shown)} диапазонов"
+    return text
+
+
+def format_moderation_notice(status: str, numbers: List[int], reason: str) -> str:
+    """Одно объявление в группу на всю операцию; numbers — номера, действительно изменённые."""
+    if len(numbers) == 1:
+        verb = "удалён" if status == "deleted" else "отклонён"
+        return f"{'🗑' if status == 'deleted' else '🚫'} Билет №{numbers[0]} {verb}. Причина: {reason}"
+    verb = "Удалено" if status == "deleted" else "Отклонено"
+    ranges = format_ranges(merge_ranges((n, n) for n in numbers), ANNOUNCE_MAX_RANGES)
+    return f"{'🗑' if status == 'deleted' else '🚫'} {verb} билетов: {len(numbers)} ({ranges}). Причина: {reason}"
@@ -0,0 +1,277 @@
+"""
+Фоновая очередь исходящих сообщений в Telegram.
+
+Обработчики кладут сообщение в очередь и сразу возвращаются, а отправкой
+занимается отдельная задача: с приоритетами, ограничением скорости на каждый
+чат (token bucket), учётом TelegramRetryAfter и ограниченным объёмом памяти.
+"""
+
+import asyncio
+import heapq
+import logging
+import os
+import time
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Tuple
+
+from aiogram import Bot
+from aiogram.exceptions import (
+    TelegramAPIError,
+    TelegramNetworkError,
+    TelegramRetryAfter,
+    TelegramServerError,
+)
+
+from config import get_workers
+
+
+logger = logging.getLogger(__name__)
+
+# Приоритеты: меньше — важнее
+PRIORITY_WINNER = 0
+PRIORITY_MODERATION = 1
+PRIORITY_NOTICE = 2
+
+# Лимиты Telegram: ~20 сообщений в минуту в одну группу и ~30 сообщений в секунду всего.
+# Лимиты общие для бота, поэтому при нескольких воркерах каждый получает свою долю.
+_WORKERS = get_workers()
+OUTBOX_CHAT_RATE = float(os.getenv("OUTBOX_CHAT_RATE", "20")) / 60 / _WORKERS
+OUTBOX_CHAT_BURST = float(os.getenv("OUTBOX_CHAT_BURST", "3"))
+OUTBOX_GLOBAL_RATE = float(os.getenv("OUTBOX_GLOBAL_RATE", "25")) / _WORKERS
+OUTBOX_MAX_SIZE = int(os.getenv("OUTBOX_MAX_SIZE", "1000"))
+OUTBOX_MAX_ATTEMPTS = 5
+OUTBOX_MAX_BACKOFF = 30.0
+
+
+class TokenBucket:
+    """Классический token bucket с возможностью заблокировать отправку на время (retry_after)."""
+
+    def __init__(self, rate: float, capacity: float) -> None:
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, now: float) -> float:
+        """Сколько секунд ждать до появления токена (0 — можно отправлять)."""
+        self._refill(now)
+        if now < self.blocked_until:
+            return self.blocked_until - now
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def consume(self, now: float) -> None:
+        self._refill(now)
+        self.tokens -= 1
+
+    def block(self, seconds: float, now: float) -> None:
+        self.blocked_until = max(self.blocked_until, now + seconds)
+        self.tokens = 0.0
+
+    def is_idle(self, now: float) -> bool:
+        self._refill(now)
+        return now >= self.blocked_until and self.tokens >= self.capacity
+
+
+@dataclass(order=True)
+class OutgoingMessage:
+    priority: int
+    seq: int
+    chat_id: int = field(compare=False)
+    text: str = field(compare=False)
+    kwargs: Dict[str, Any] = field(compare=False, default_factory=dict)
+    attempts: int = field(compare=False, default=0)
+
+
+class Outbox:
+    """Очередь исходящих сообщений с отдельной кучей на каждый чат."""
+
+    def __init__(
+        self,
+        max_size: int = OUTBOX_MAX_SIZE,
+        chat_rate: float = OUTBOX_CHAT_RATE,
+        chat_burst: float = OUTBOX_CHAT_BURST,
+        global_rate: float = OUTBOX_GLOBAL_RATE,
+    ) -> None:
+        self._max_size = max_size
+        self._chat_rate = chat_rate
+        self._chat_burst = chat_burst
+        self._global = TokenBucket(global_rate, global_rate)
+        self._queues: Dict[int, List[OutgoingMessage]] = {}
+        self._buckets: Dict[int, TokenBucket] = {}
+        self._size = 0
+        self._seq = 0
+        self._bot: Optional[Bot] = None
+        self._task: Optional[asyncio.Task] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self.sent = 0
+        self.dropped = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    def start(self, bot: Bot) -> None:
+        if self._task is not None:
+            return
+        self._bot = bot
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._run(), name="outbox")
+
+    async def stop(self, timeout: float = 10.0) -> None:
+        """Пытается дослать очередь за timeout секунд, затем останавливает отправку."""
+        if self._task is None:
+            return
+        deadline = time.monotonic() + timeout
+        while self._size and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        if self._size:
+            logger.warning("Outbox остановлен, не отправлено сообщений: %s", self._size)
+
+    def enqueue(
+        self, chat_id: int, text: str, priority: int = PRIORITY_NOTICE, after_queued: bool = False, **kwargs: Any
+    ) -> bool:
+        """
+        Ставит сообщение в очередь. False — очередь переполнена и сообщение отброшено.
+
+        after_queued — сообщение уйдёт в чат после всех уже поставленных в очередь
+        этого чата, даже менее важных: они поднимаются до его приоритета, а при
+        равном приоритете порядок — очерёдность постановки. Так объявление о
+        розыгрыше, удалении или архивации не обгоняет объявления о самих билетах.
+        """
+        if self._size >= self._max_size and not self._evict_worse_than(priority):
+            self.dropped += 1
+            logger.warning("Outbox переполнен, сообщение в чат %s отброшено", chat_id)
+            return False
+        if after_queued:
+            self._promote(chat_id, priority)
+        self._seq += 1
+        self._push(OutgoingMessage(priority, self._seq, chat_id, text, kwargs))
+        return True
+
+    def _promote(self, chat_id: int, priority: int) -> None:
+        queue = self._queues.get(chat_id)
+        if not queue or all(item.priority <= priority for item in queue):
+            return
+        for item in queue:
+            item.priority = min(item.priority, priority)
+        heapq.heapify(queue)
+
+    def _push(self, item: OutgoingMessage) -> None:
+        heapq.heappush(self._queues.setdefault(item.chat_id, []), item)
+        self._size += 1
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    def _evict_worse_than(self, priority: int) -> bool:
+        """Выкидывает самое неважное (и самое новое) сообщение, если оно менее важно, чем новое."""
+        worst: Optional[Tuple[int, int]] = None
+        worst_chat: Optional[int] = None
+        for chat_id, queue in self._queues.items():
+            for item in queue:
+                key = (item.priority, item.seq)
+                if worst is None or key > worst:
+                    worst, worst_chat = key, chat_id
+        if worst is None or worst[0] <= priority:
+            return False
+        queue = self._queues[worst_chat]
+        queue[:] = [item for item in queue if (item.priority, item.seq) != worst]
+        heapq.heapify(queue)
+        if not queue:
+            del self._queues[worst_chat]
+        self._size -= 1
+        self.dropped += 1
+        return True
+
+    def _bucket(self, chat_id: int) -> TokenBucket:
+        bucket = self._buckets.get(chat_id)
+        if bucket is None:
+            bucket = self._buckets[chat_id] = TokenBucket(self._chat_rate, self._chat_burst)
+        return bucket
+
+    def _next_ready(self) -> Tuple[Optional[OutgoingMessage], Optional[float]]:
+        """Возвращает (сообщение, None) или (None, сколько ждать); (None, None) — очередь пуста."""
+        if not self._size:
+            return None, None
+        now = time.monotonic()
+        global_wait = self._global.wait_time(now)
+        if global_wait > 0:
+            return None, global_wait
+        best_chat: Optional[int] = None
+        min_wait: Optional[float] = None
+        for chat_id, queue in self._queues.items():
+            wait = self._bucket(chat_id).wait_time(now)
+            if wait > 0:
+                min_wait = wait if min_wait is None else min(min_wait, wait)
+            elif best_chat is None or queue[0] < self._queues[best_chat][0]:
+                best_chat = chat_id
+        if best_chat is None:
+            return None, min_wait
+        queue = self._queues[best_chat]
+        item = heapq.heappop(queue)
+        if not queue:
+            del self._queues[best_chat]
+        self._size -= 1
+        self._global.consume(now)
+        self._bucket(best_chat).consume(now)
+        return item, None
+
+    def _prune_buckets(self) -> None:
+        if len(self._buckets) <= max(self._max_size, 1000):
+            return
+        now = time.monotonic()
+        for chat_id in [c for c, b in self._buckets.items() if c not in self._queues and b.is_idle(now)]:
+            del self._buckets[chat_id]
+
+    async def _run(self) -> None:
+        while True:
+            item, wait = self._next_ready()
+            if item is None:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=wait)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            try:
+                await self._send(item)
+            except Exception:
+                # Что бы ни случилось с одним сообщением, отправка остальных не должна останавливаться
+                self.dropped += 1
+                logger.exception("Не удалось отправить сообщение в чат %s", item.chat_id)
+            self._prune_buckets()
+
+    async def _send(self, item: OutgoingMessage) -> None:
+        try:
+            await self._bot.send_message(item.chat_id, item.text, **item.kwargs)
+            self.sent += 1
+        except TelegramRetryAfter as exc:
+            # Telegram сам сказал, сколько ждать: блокируем чат и возвращаем сообщение в очередь
+            self._bucket(item.chat_id).block(exc.retry_after, time.monotonic())
+            self._push(item)
+        except (TelegramNetworkError, TelegramServerError) as exc:
+            item.attempts += 1
+            if item.attempts >= OUTBOX_MAX_ATTEMPTS:
+                self.dropped += 1
+                logger.error("Не удалось отправить сообщение в чат %s: %s", item.chat_id, exc)
+                return
+            backoff = min(OUTBOX_MAX_BACKOFF, 2.0 ** item.attempts)
+            self._bucket(item.chat_id).block(backoff, time.monotonic())
+            self._push(item)
+        except TelegramAPIError as exc:
+            self.dropped += 1
+            logger.error("Сообщение в чат %s отклонено Telegram: %s", item.chat_id, exc)
+
+
+outbox = Outbox()
@@ -0,0 +1,74 @@
+"""
+Перцептивный хэш фото для поиска повторных загрузок.
+
+Telegram выдаёт одинаковый file_unique_id только для того же самого файла.
+Пересохранённая или пересланная заново картинка получает новый идентификатор,
+но тот же dHash: 64 бита из сравнения яркости соседних пикселей уменьшенного
+изображения. Хэш считается в пуле потоков, чтобы декодирование не блокировало
+event loop.
+
+Нужен Pillow (pip install Pillow) и PHASH_ENABLED=1. Без Pillow проверка
+идёт только по file_unique_id.
+"""
+
+import asyncio
+import io
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+try:
+    from PIL import Image
+except ImportError:  # Pillow — необязательная зависимость
+    Image = None
+
+
+logger = logging.getLogger(__name__)
+
+PHASH_ENABLED = os.getenv("PHASH_ENABLED", "0").strip() == "1"
+PHASH_WORKERS = int(os.getenv("PHASH_WORKERS", "2"))
+HASH_SIZE = 8
+
+if PHASH_ENABLED and Image is None:
+    logger.warning("PHASH_ENABLED=1, но Pillow не установлен — перцептивный хэш отключён")
+
+_executor: Optional[ThreadPoolExecutor] = None
+
+
+def is_available() -> bool:
+    return PHASH_ENABLED and Image is not None
+
+
+def dhash(data: bytes) -> int:
+    """dHash изображения как знаковое 64-битное число (так его хранит SQLite INTEGER)."""
+    with Image.open(io.BytesIO(data)) as image:
+        small = image.convert("L").resize((HASH_SIZE + 1, HASH_SIZE), Image.LANCZOS)
+        pixels = list(small.getdata())
+    value = 0
+    for row in range(HASH_SIZE):
+        offset = row * (HASH_SIZE + 1)
+        for col in range(HASH_SIZE):
+            value = (value << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+    return value - (1 << 64) if value >= 1 << 63 else value
+
+
+async def compute_phash(data: bytes) -> Optional[int]:
+    """Считает хэш в пуле потоков; None — хэш выключен или картинку не удалось разобрать."""
+    global _executor
+    if not is_available():
+        return None
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=PHASH_WORKERS, thread_name_prefix="phash")
+    try:
+        return await asyncio.get_running_loop().run_in_executor(_executor, dhash, data)
+    except Exception:
+        logger.exception("Не удалось посчитать перцептивный хэш фото")
+        return None
+
+
+def shutdown() -> None:
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
@@ -0,0 +1,182 @@
+"""
+Хранилище состояний FSM в той же базе SQLite, что и билеты.
+
+Чтения идут из LRU-кэша в памяти, изменения сразу попадают в кэш и пачками
+сохраняются в таблицу fsm_states раз в FSM_FLUSH_INTERVAL секунд. Состояния,
+которые не трогали дольше FSM_TTL секунд, считаются брошенными и удаляются.
+"""
+
+import asyncio
+import copy
+import json
+import logging
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, DefaultKeyBuilder, KeyBuilder, StateType, StorageKey
+
+from config import get_workers
+from db import delete_expired_fsm_records, load_fsm_record, save_fsm_records
+
+
+logger = logging.getLogger(__name__)
+
+# Обновления одного пользователя могут попасть в разные воркеры, поэтому
+# при WORKERS > 1 по умолчанию кэш выключен и запись идёт сразу
+_SHARED = get_workers() > 1
+FSM_CACHE_SIZE = int(os.getenv("FSM_CACHE_SIZE", "0" if _SHARED else "10000"))
+FSM_TTL = float(os.getenv("FSM_TTL", str(24 * 3600)))  # 0 — без истечения
+FSM_FLUSH_INTERVAL = float(os.getenv("FSM_FLUSH_INTERVAL", "0" if _SHARED else "1"))  # 0 — писать сразу
+# Как часто чистить просроченные записи в БД
+FSM_PURGE_INTERVAL = 600.0
+
+
+class _Record:
+    __slots__ = ("state", "data", "touched")
+
+    def __init__(self, state: Optional[str], data: Dict[str, Any], touched: float) -> None:
+        self.state = state
+        self.data = data
+        self.touched = touched
+
+    @property
+    def is_empty(self) -> bool:
+        return self.state is None and not self.data
+
+
+class SQLiteStorage(BaseStorage):
+    """FSM-хранилище aiogram поверх SQLite с LRU-кэшем, TTL и пакетной записью."""
+
+    def __init__(
+        self,
+        key_builder: Optional[KeyBuilder] = None,
+        cache_size: int = FSM_CACHE_SIZE,
+        ttl: float = FSM_TTL,
+        flush_interval: float = FSM_FLUSH_INTERVAL,
+    ) -> None:
+        self._key_builder = key_builder or DefaultKeyBuilder(with_destiny=True)
+        self._cache_size = cache_size
+        self._ttl = ttl
+        self._flush_interval = flush_interval
+        self._cache: "OrderedDict[str, _Record]" = OrderedDict()
+        self._dirty: Dict[str, _Record] = {}
+        self._task: Optional[asyncio.Task] = None
+        self._last_purge = 0.0
+
+    def _expired(self, record: _Record, now: float) -> bool:
+        return self._ttl > 0 and now - record.touched > self._ttl
+
+    def _remember(self, key: str, record: _Record) -> None:
+        if self._cache_size <= 0:
+            return
+        self._cache[key] = record
+        self._cache.move_to_end(key)
+        while len(self._cache) > self._cache_size:
+            # Вытесненная запись, если ещё не сохранена, остаётся в _dirty до сброса
+            self._cache.popitem(last=False)
+
+    async def _load(self, key: str) -> _Record:
+        now = time.time()
+        record = self._cache.get(key)
+        if record is not None:
+            self._cache.move_to_end(key)
+        else:
+            record = self._dirty.get(key)
+            if record is None:
+                row = await load_fsm_record(key)
+                # Пока ждали БД, запись мог создать параллельный обработчик
+                cached = self._cache.get(key) or self._dirty.get(key)
+                if cached is not None:
+                    record = cached
+                elif row:
+                    record = _Record(row[0], json.loads(row[1]), row[2])
+                else:
+                    record = _Record(None, {}, now)
+            self._remember(key, record)
+        if self._expired(record, now):
+            record.state, record.data = None, {}
+            await self._commit(key, record)
+        return record
+
+    async def _commit(self, key: str, record: _Record) -> None:
+        record.touched = time.time()
+        self._dirty[key] = record
+        if self._flush_interval <= 0:
+            await self.flush()
+            # Фонового цикла нет: просроченные записи чистим здесь, не чаще раза в FSM_PURGE_INTERVAL
+            try:
+                await self._purge_expired()
+            except Exception:
+                logger.exception("Не удалось удалить просроченные состояния FSM")
+        elif self._task is None:
+            self._task = asyncio.create_task(self._run(), name="fsm-storage-flush")
+
+    async def flush(self) -> None:
+        """Сохраняет все изменённые записи одной транзакцией."""
+        if not self._dirty:
+            return
+        dirty, self._dirty = self._dirty, {}
+        upserts = [
+            (key, record.state, json.dumps(record.data, ensure_ascii=False), record.touched)
+            for key, record in dirty.items()
+            if not record.is_empty
+        ]
+        deletes = [key for key, record in dirty.items() if record.is_empty]
+        try:
+            await save_fsm_records(upserts, deletes)
+        except Exception:
+            # Возвращаем несохранённое, не затирая более свежие изменения
+            for key, record in dirty.items():
+                self._dirty.setdefault(key, record)
+            raise
+
+    async def _purge_expired(self) -> None:
+        now = time.time()
+        if self._ttl <= 0 or now - self._last_purge < min(self._ttl, FSM_PURGE_INTERVAL):
+            return
+        self._last_purge = now
+        await delete_expired_fsm_records(now - self._ttl)
+        for key in [k for k, r in self._cache.items() if self._expired(r, now) and k not in self._dirty]:
+            del self._cache[key]
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self._flush_interval)
+            try:
+                await self.flush()
+                await self._purge_expired()
+            except Exception:
+                logger.exception("Не удалось сохранить состояния FSM")
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        storage_key = self._key_builder.build(key)
+        record = await self._load(storage_key)
+        record.state = state.state if isinstance(state, State) else state
+        await self._commit(storage_key, record)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        record = await self._load(self._key_builder.build(key))
+        return record.state
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        storage_key = self._key_builder.build(key)
+        record = await self._load(storage_key)
+        record.data = copy.deepcopy(data)
+        await self._commit(storage_key, record)
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        record = await self._load(self._key_builder.build(key))
+        return copy.deepcopy(record.data)
+
+    async def close(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
@@ -0,0 +1,57 @@
+"""
+Общие настройки тестов.
+
+Модули бота читают окружение при импорте, поэтому база для тестов
+указывается здесь, до первого импорта db.
+"""
+
+import asyncio
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+import pytest
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+os.environ["DB_PATH"] = os.path.join(tempfile.mkdtemp(prefix="lottery-tests-"), "test.sqlite")
+os.environ.setdefault("BOT_TOKEN", "123456:TEST")
+os.environ["WORKERS"] = "1"
+
+
+def _remove_db_files(path: str) -> None:
+    for suffix in ("", "-wal", "-shm"):
+        try:
+            os.remove(path + suffix)
+        except FileNotFoundError:
+            pass
+
+
+@pytest.fixture
+def run_db():
+    """
+    Выполняет корутину на чистой базе: init_db до, close_db после.
+    prepare(path) может заранее создать файл базы, например в старой схеме.
+    """
+    import db
+
+    def run(coro_fn, prepare=None):
+        async def main():
+            _remove_db_files(db.DB_PATH)
+            if prepare is not None:
+                prepare(db.DB_PATH)
+            db.active_indexes.clear()
+            db.user_tickets.clear()
+            db.leaderboards.clear()
+            db._invalidate_lotteries()
+            await db.init_db()
+            try:
+                return await coro_fn()
+            finally:
+                await db.close_db()
+
+        return asyncio.run(main())
+
+    return run
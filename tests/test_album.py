@@ -0,0 +1,57 @@
+import asyncio
+from types import SimpleNamespace
+
+from album import AlbumCollector
+
+WAIT = 0.05
+
+
+def _part(message_id: int, group: str = "g1", chat_id: int = 1) -> SimpleNamespace:
+    return SimpleNamespace(message_id=message_id, media_group_id=group, chat=SimpleNamespace(id=chat_id))
+
+
+def test_collector_buffers_album_for_first_part():
+    async def scenario():
+        collector = AlbumCollector(wait=WAIT)
+
+        async def deliver(message, delay):
+            await asyncio.sleep(delay)
+            return await collector.collect(message)
+
+        # Части приходят вразнобой и с паузами меньше окна ожидания
+        results = await asyncio.gather(
+            deliver(_part(3), 0),
+            deliver(_part(1), WAIT / 2),
+            deliver(_part(2), WAIT),
+            deliver(_part(7, group="g2"), 0),
+        )
+        return results, len(collector)
+
+    (first, *others, other_album), pending = asyncio.run(scenario())
+    assert [m.message_id for m in first] == [1, 2, 3]
+    assert others == [None, None]
+    assert [m.message_id for m in other_album] == [7]
+    assert pending == 0
+
+
+def test_late_part_starts_new_album():
+    async def scenario():
+        collector = AlbumCollector(wait=WAIT)
+        first = await collector.collect(_part(1))
+        late = await collector.collect(_part(2))
+        return first, late
+
+    first, late = asyncio.run(scenario())
+    assert [m.message_id for m in first] == [1]
+    assert [m.message_id for m in late] == [2]
+
+
+def test_cap_is_shared_by_albums_of_one_user():
+    collector = AlbumCollector(max_photos=5, window=60)
+    assert collector.take(1, 3, now=0) == 3
+    # Второй альбом получает только остаток лимита, третий — ничего
+    assert collector.take(1, 3, now=10) == 2
+    assert collector.take(1, 1, now=20) == 0
+    assert collector.take(2, 4, now=20) == 4
+    # Новое окно — лимит снова полный
+    assert collector.take(1, 10, now=60) == 5
@@ -0,0 +1,86 @@
+import sqlite3
+
+import pytest
+
+import db
+
+TICKETS = 10
+
+
+class Crash(Exception):
+    pass
+
+
+def _archived(path: str) -> list:
+    conn = sqlite3.connect(path)
+    try:
+        return conn.execute(
+            "SELECT ticket_number, file_id, status FROM tickets_archive WHERE lottery_id = 1 ORDER BY ticket_number"
+        ).fetchall()
+    finally:
+        conn.close()
+
+
+def test_interrupted_archive_resumes_without_loss_or_duplicates(run_db, monkeypatch):
+    monkeypatch.setattr(db, "ARCHIVE_CHUNK_SIZE", 3)
+    execute = db._execute
+    clears = 0
+
+    async def crashing_execute(conn, name, *args, **kwargs):
+        nonlocal clears
+        if name == "archive_clear":
+            clears += 1
+            if clears == 2:
+                # Падение посреди второй порции: копия уже вставлена, удаление не выполнено
+                raise Crash()
+        return await execute(conn, name, *args, **kwargs)
+
+    async def scenario():
+        for i in range(TICKETS):
+            await db.add_ticket(1, 1 + i % 3, "u", f"f{i}")
+        await db.set_ticket_status_if_active(1, 5, "rejected", "выиграл")
+        monkeypatch.setattr(db, "_execute", crashing_execute)
+        reported = []
+
+        async def progress(moved, total):
+            reported.append((moved, total))
+
+        with pytest.raises(Crash):
+            await db.archive_lottery(1, progress)
+        monkeypatch.setattr(db, "_execute", execute)
+        interrupted = _archived(db.DB_PATH), await db.get_unfinished_archives()
+        moved = await db.resume_archive(1)
+        return reported, interrupted, moved, await db.get_unfinished_archives()
+
+    reported, (partial, unfinished), moved, left = run_db(scenario)
+    assert reported == [(3, TICKETS)]
+    # Откатилась только упавшая порция
+    assert [row[0] for row in partial] == [1, 2, 3]
+    assert unfinished == [1]
+    assert moved == TICKETS - 3
+    assert left == []
+    archived = _archived(db.DB_PATH)
+    assert [row[0] for row in archived] == list(range(1, TICKETS + 1))
+    assert [row[1] for row in archived] == [f"f{i}" for i in range(TICKETS)]
+    assert archived[4][2] == "rejected"
+
+
+def test_archive_is_reported_per_chunk(run_db, monkeypatch):
+    monkeypatch.setattr(db, "ARCHIVE_CHUNK_SIZE", 4)
+
+    async def scenario():
+        for i in range(TICKETS):
+            await db.add_ticket(1, 1, "u", f"f{i}")
+        reported = []
+
+        async def progress(moved, total):
+            reported.append((moved, total))
+
+        moved = await db.archive_lottery(1, progress)
+        # Повторная архивация закрытой лотереи ничего не переносит
+        again = await db.resume_archive(1)
+        return moved, again, reported
+
+    moved, again, reported = run_db(scenario)
+    assert (moved, again) == (TICKETS, 0)
+    assert reported == [(4, TICKETS), (8, TICKETS), (10, TICKETS)]
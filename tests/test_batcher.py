@@ -0,0 +1,48 @@
+import asyncio
+
+import pytest
+
+import db
+
+
+@pytest.fixture
+def batched(monkeypatch):
+    monkeypatch.setattr(db, "DB_BATCH_ENABLED", True)
+    monkeypatch.setattr(db, "DB_BATCH_MAX_LATENCY_MS", 20)
+
+
+def test_conditional_status_goes_through_batcher(run_db, batched):
+    async def scenario():
+        assert db.batcher is not None
+        numbers = await asyncio.gather(*(db.add_ticket(1, 7, "player", f"p{i}", f"p{i}") for i in range(3)))
+        batches = db.batcher.batches
+        # Два админа отклоняют один билет одновременно: срабатывает только первый
+        first, second, other = await asyncio.gather(
+            db.set_ticket_status_if_active(1, numbers[0], "rejected", "a"),
+            db.set_ticket_status_if_active(1, numbers[0], "rejected", "b"),
+            db.set_ticket_status_if_active(1, numbers[1], "deleted", None),
+        )
+        ticket = await db.get_ticket_by_number_any_status(1, numbers[0])
+        return db.batcher.batches - batches, (first, second, other), ticket, await db.get_user_stats(1, 7)
+
+    batches, results, ticket, stats = run_db(scenario)
+    assert batches == 1
+    assert results == (True, False, True)
+    assert (ticket.status, ticket.comment) == ("rejected", "a")
+    assert stats == (3, 1)
+
+
+def test_batched_status_updates_draw_index(run_db, batched, monkeypatch):
+    monkeypatch.setattr(db, "DRAW_ENGINE", "memory")
+
+    async def scenario():
+        for i in range(3):
+            await db.add_ticket(1, 7, "player", f"p{i}", f"p{i}")
+        await asyncio.gather(
+            db.set_ticket_status(1, 1, "deleted", None),
+            db.set_ticket_status_if_active(1, 3, "rejected", None),
+            db.set_ticket_status_if_active(1, 3, "deleted", None),
+        )
+        return {(await db.get_random_active_ticket(1)).ticket_number for _ in range(50)}
+
+    assert run_db(scenario) == {2}
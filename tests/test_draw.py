@@ -0,0 +1,91 @@
+from collections import Counter
+
+import pytest
+
+import db
+from draw import ActiveTicketIndex, ReservoirSampler
+
+DRAWS = 3000
+
+
+def test_reservoir_sampler_returns_k_distinct_items():
+    sampler = ReservoirSampler(3)
+    for item in range(100):
+        sampler.offer(item)
+    result = sampler.result()
+    assert len(result) == 3
+    assert len(set(result)) == 3
+
+
+def test_reservoir_sampler_skips_zero_weight():
+    sampler = ReservoirSampler(5)
+    for item in range(10):
+        sampler.offer(item, weight=1.0 if item < 2 else 0)
+    assert sorted(sampler.result()) == [0, 1]
+
+
+def test_reservoir_sampler_is_uniform():
+    counts = Counter()
+    for _ in range(DRAWS):
+        sampler = ReservoirSampler(1)
+        for item in range(5):
+            sampler.offer(item)
+        counts.update(sampler.result())
+    expected = DRAWS / 5
+    assert all(abs(counts[item] - expected) < expected * 0.25 for item in range(5)), counts
+
+
+def test_active_ticket_index_discard_keeps_remaining_choosable():
+    index = ActiveTicketIndex()
+    index.rebuild([1, 2, 3, 4])
+    index.discard(2)
+    index.discard(4)
+    assert len(index) == 2
+    assert {index.choice() for _ in range(200)} == {1, 3}
+
+
+async def _interleaved_lottery():
+    """Пять билетов лотереи 1, между которыми лежат пачки билетов лотереи 2 разной длины."""
+    other = await db.create_lottery("other", None)
+    for i, gap in enumerate((0, 10, 300, 50, 1000)):
+        if gap:
+            await db.add_tickets(
+                other.id, 2, "filler", [(f"o{i}-{j}", f"o{i}-{j}", None) for j in range(gap)]
+            )
+        await db.add_ticket(1, 1, "player", f"p{i}", f"p{i}")
+
+
+@pytest.mark.parametrize("attempts", [0, db.SQL_DRAW_ATTEMPTS])
+def test_sql_draw_is_uniform_when_ids_interleave(run_db, monkeypatch, attempts):
+    monkeypatch.setattr(db, "DRAW_ENGINE", "sql")
+    monkeypatch.setattr(db, "SQL_DRAW_ATTEMPTS", attempts)
+
+    async def scenario():
+        await _interleaved_lottery()
+        counts = Counter()
+        for _ in range(DRAWS):
+            ticket = await db.get_random_active_ticket(1)
+            counts[ticket.ticket_number] += 1
+        return counts
+
+    counts = run_db(scenario)
+    expected = DRAWS / 5
+    assert sorted(counts) == [1, 2, 3, 4, 5]
+    assert all(abs(count - expected) < expected * 0.25 for count in counts.values()), counts
+
+
+def test_sql_draw_skips_inactive_tickets(run_db, monkeypatch):
+    monkeypatch.setattr(db, "DRAW_ENGINE", "sql")
+
+    async def scenario():
+        for i in range(3):
+            await db.add_ticket(1, 1, "player", f"p{i}", f"p{i}")
+        await db.set_ticket_status(1, 1, "deleted", None)
+        await db.set_ticket_status(1, 3, "rejected", None)
+        numbers = {(await db.get_random_active_ticket(1)).ticket_number for _ in range(50)}
+        await db.set_ticket_status(1, 2, "deleted", None)
+        return numbers, await db.get_random_active_ticket(1)
+
+    numbers, empty = run_db(scenario)
+    assert numbers == {2}
+    assert empty is None
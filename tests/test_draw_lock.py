@@ -0,0 +1,91 @@
+import asyncio
+import time
+
+import pytest
+
+import db
+import utils
+from utils import DrawLock, LeaseLostError
+
+
+TTL = 0.6
+
+
+def test_lock_keeps_lease_while_held(run_db):
+    async def scenario():
+        lock = DrawLock("draw:test", ttl=TTL)
+        assert await lock.try_acquire()
+        other = DrawLock("draw:test", ttl=TTL)
+        await asyncio.sleep(TTL * 2)
+        assert not lock.lost
+        assert not await other.try_acquire()
+        await lock.release()
+        assert await other.try_acquire()
+        await other.release()
+
+    run_db(scenario)
+
+
+def test_lease_taken_over_is_noticed(run_db):
+    async def scenario():
+        lock = DrawLock("draw:test", ttl=TTL)
+        assert await lock.try_acquire()
+        # Аренду перехватил другой воркер (например, пока этот процесс стоял)
+        async with db.pool.write() as conn:
+            await conn.execute(
+                "UPDATE locks SET owner = 'other', expires_at = ? WHERE name = 'draw:test'",
+                (time.time() + 60,),
+            )
+        await asyncio.sleep(TTL / 3 + 0.2)
+        assert lock.lost
+        with pytest.raises(LeaseLostError):
+            lock.ensure_held()
+        await lock.release()
+        assert not lock.lost
+        async with db.pool.read() as conn:
+            async with conn.execute("SELECT owner FROM locks WHERE name = 'draw:test'") as cursor:
+                assert (await cursor.fetchone())[0] == "other"
+
+    run_db(scenario)
+
+
+def test_renewal_survives_errors(run_db, monkeypatch):
+    async def scenario():
+        failures = 2
+        real_acquire = utils.acquire_lease
+
+        async def flaky_acquire(*args):
+            nonlocal failures
+            if failures:
+                failures -= 1
+                raise RuntimeError("database is locked")
+            return await real_acquire(*args)
+
+        monkeypatch.setattr(utils, "DRAW_LOCK_RETRY_INTERVAL", 0.05)
+        lock = DrawLock("draw:test", ttl=TTL)
+        assert await lock.try_acquire()
+        monkeypatch.setattr(utils, "acquire_lease", flaky_acquire)
+        await asyncio.sleep(TTL * 2)
+        assert failures == 0
+        assert not lock.lost
+        lock.ensure_held()
+        await lock.release()
+
+    run_db(scenario)
+
+
+def test_lease_expires_when_renewal_keeps_failing(run_db, monkeypatch):
+    async def scenario():
+        async def broken_acquire(*args):
+            raise RuntimeError("database is locked")
+
+        lock = DrawLock("draw:test", ttl=TTL)
+        assert await lock.try_acquire()
+        monkeypatch.setattr(utils, "acquire_lease", broken_acquire)
+        await asyncio.sleep(TTL + 0.2)
+        assert lock.lost
+        with pytest.raises(LeaseLostError):
+            lock.ensure_held()
+        await lock.release()
+
+    run_db(scenario)
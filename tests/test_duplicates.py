@@ -0,0 +1,118 @@
+import asyncio
+
+import pytest
+
+import db
+from db import DuplicatePhotoError
+
+
+@pytest.fixture
+def scope(monkeypatch):
+    def set_scope(value: str) -> None:
+        monkeypatch.setattr(db, "DUPLICATE_SCOPE", value)
+
+    set_scope("lottery")
+    return set_scope
+
+
+def test_lottery_scope_rejects_repeat_in_same_lottery_only(run_db, scope):
+    async def scenario():
+        other = await db.create_lottery("Вторая", -200)
+        first = await db.add_ticket(1, 10, "alice", "file-a", "uniq-a")
+        with pytest.raises(DuplicatePhotoError) as repeat:
+            await db.add_ticket(1, 11, "bob", "file-a2", "uniq-a")
+        # В другой лотерее то же фото — новый билет
+        elsewhere = await db.add_ticket(other.id, 11, "bob", "file-a2", "uniq-a")
+        return first, repeat.value, elsewhere, await db.get_duplicate_report()
+
+    first, repeat, elsewhere, report = run_db(scenario)
+    assert (repeat.ticket_number, repeat.user_id, repeat.match) == (first, 10, "file")
+    assert elsewhere == 1
+    assert report["total"] == 1
+    assert report["recent"][0][:5] == (11, "bob", first, 10, "file")
+
+
+def test_global_scope_checks_other_lotteries_and_archive(run_db, scope):
+    scope("global")
+
+    async def scenario():
+        other = await db.create_lottery("Вторая", -200)
+        await db.add_ticket(1, 10, "alice", "file-a", "uniq-a")
+        await db.add_ticket(other.id, 10, "alice", "file-b", "uniq-b")
+        await db.archive_lottery(1)
+        successor = next(l.id for l in await db.get_open_lotteries() if l.id != other.id)
+        errors = []
+        for lottery_id, unique in ((other.id, "uniq-a"), (successor, "uniq-b"), (successor, "uniq-a")):
+            try:
+                await db.add_ticket(lottery_id, 11, "bob", "copy", unique)
+            except DuplicatePhotoError as exc:
+                errors.append((exc.ticket_number, exc.match))
+        return errors
+
+    # uniq-a: сначала в лотерее 1, затем в архиве; uniq-b — в другой открытой лотерее
+    assert run_db(scenario) == [(1, "file"), (1, "file"), (1, "file")]
+
+
+def test_perceptual_hash_matches_resaved_photo(run_db, scope):
+    async def scenario():
+        first = await db.add_ticket(1, 10, "alice", "file-a", "uniq-a", phash=0x1234)
+        with pytest.raises(DuplicatePhotoError) as repeat:
+            await db.add_ticket(1, 11, "bob", "file-b", "uniq-b", phash=0x1234)
+        other_hash = await db.add_ticket(1, 11, "bob", "file-c", "uniq-c", phash=0x1235)
+        return first, repeat.value, other_hash
+
+    first, repeat, other_hash = run_db(scenario)
+    assert (repeat.ticket_number, repeat.match) == (first, "phash")
+    assert other_hash == 2
+
+
+def test_repeat_inside_album_reports_first_copy(run_db, scope):
+    async def scenario():
+        await db.add_ticket(1, 10, "alice", "file-old", "uniq-old")
+        return await db.add_tickets(
+            1,
+            11,
+            "bob",
+            [
+                ("f1", "uniq-1", None),
+                ("f1-copy", "uniq-1", None),
+                ("f-old", "uniq-old", None),
+                ("f2", "uniq-2", 7),
+                ("f2-resaved", "uniq-3", 7),
+            ],
+        )
+
+    numbers, duplicates = run_db(scenario)
+    assert numbers == [2, 3]
+    # Повтор в самой пачке указывает на билет, выданный первой копии
+    assert sorted((d.ticket_number, d.user_id, d.match) for d in duplicates) == [
+        (1, 10, "file"),
+        (2, 11, "file"),
+        (3, 11, "phash"),
+    ]
+
+
+def test_repeat_inside_write_batch(run_db, scope, monkeypatch):
+    monkeypatch.setattr(db, "DB_BATCH_ENABLED", True)
+    monkeypatch.setattr(db, "DB_BATCH_MAX_LATENCY_MS", 20)
+
+    async def scenario():
+        return await asyncio.gather(
+            db.add_ticket(1, 10, "alice", "f1", "uniq-1"),
+            db.add_ticket(1, 11, "bob", "f1-copy", "uniq-1"),
+            return_exceptions=True,
+        )
+
+    first, repeat = run_db(scenario)
+    assert first == 1
+    assert isinstance(repeat, DuplicatePhotoError)
+    assert (repeat.ticket_number, repeat.user_id) == (1, 10)
+
+
+def test_scope_off_accepts_repeats(run_db, scope):
+    scope("off")
+
+    async def scenario():
+        return [await db.add_ticket(1, 10, "alice", f"f{i}", "uniq-a") for i in range(2)]
+
+    assert run_db(scenario) == [1, 2]
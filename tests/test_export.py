@@ -0,0 +1,103 @@
+import asyncio
+import csv
+import gzip
+import json
+
+import pytest
+
+import db
+import export
+
+
+TICKETS = 7
+
+
+@pytest.fixture(autouse=True)
+def small_pages(monkeypatch):
+    # Несколько страниц на выгрузку, чтобы проверить стык между ними
+    monkeypatch.setattr(export, "EXPORT_PAGE_SIZE", 3)
+
+
+async def _fill() -> None:
+    for i in range(TICKETS):
+        await db.add_ticket(1, 1 + i % 2, f"user{1 + i % 2}", f"file{i}", f"uniq{i}")
+    await db.set_ticket_status(1, 2, "rejected", "размыто")
+
+
+def _read_csv(path) -> list:
+    with gzip.open(path, "rt", encoding="utf-8", newline="") as stream:
+        return list(csv.reader(stream))
+
+
+def _read_jsonl(path) -> list:
+    with gzip.open(path, "rt", encoding="utf-8") as stream:
+        return [json.loads(line) for line in stream]
+
+
+def test_csv_export_round_trip(run_db, tmp_path):
+    path = tmp_path / "tickets.csv.gz"
+
+    async def scenario():
+        await _fill()
+        return await export.export_tickets(str(path), "tickets", "csv")
+
+    assert run_db(scenario) == TICKETS
+    header, *rows = _read_csv(path)
+    assert tuple(header) == db.EXPORT_COLUMNS
+    assert [int(row[2]) for row in rows] == list(range(1, TICKETS + 1))
+    assert rows[1][3:] == ["2", "user2", "file1", "uniq1", "rejected", "размыто"]
+    assert rows[0][-1] == ""
+
+
+def test_jsonl_export_of_archive_round_trip(run_db, tmp_path):
+    path = tmp_path / "archive.jsonl.gz"
+
+    async def scenario():
+        await _fill()
+        await db.archive_lottery(1)
+        return await export.export_tickets(str(path), "archive", "jsonl", lottery_id=1)
+
+    assert run_db(scenario) == TICKETS
+    rows = _read_jsonl(path)
+    assert list(rows[0]) == list(db.EXPORT_TABLES["archive"][1])
+    assert [row["ticket_number"] for row in rows] == list(range(1, TICKETS + 1))
+    assert {row["lottery_id"] for row in rows} == {1}
+    assert all(row["archived_at"] for row in rows)
+    assert (rows[1]["status"], rows[1]["comment"], rows[1]["username"]) == ("rejected", "размыто", "user2")
+
+
+def test_export_filters(run_db, tmp_path):
+    path = tmp_path / "filtered.jsonl.gz"
+
+    async def scenario():
+        await _fill()
+        return await export.export_tickets(str(path), "tickets", "jsonl", status="active", user_id=2)
+
+    assert run_db(scenario) == 2
+    assert [(row["ticket_number"], row["user_id"]) for row in _read_jsonl(path)] == [(4, 2), (6, 2)]
+
+
+def test_empty_csv_export_has_header(run_db, tmp_path):
+    path = tmp_path / "empty.csv.gz"
+
+    async def scenario():
+        return await export.export_tickets(str(path), "tickets", "csv", lottery_id=1)
+
+    assert run_db(scenario) == 0
+    assert _read_csv(path) == [list(db.EXPORT_COLUMNS)]
+
+
+def test_cli_writes_gzip_file(run_db, tmp_path, capsys):
+    path = tmp_path / "cli.csv.gz"
+    run_db(_fill)
+    # База после run_db остаётся на диске: CLI открывает её сам
+    export.main(["--format", "csv", "--user", "1", "--output", str(path)])
+    assert f"{path}: 4 строк" in capsys.readouterr().out
+    header, *rows = _read_csv(path)
+    assert tuple(header) == db.EXPORT_COLUMNS
+    assert [int(row[2]) for row in rows] == [1, 3, 5, 7]
+
+
+def test_unknown_format_is_rejected(tmp_path):
+    with pytest.raises(ValueError):
+        asyncio.run(export.export_tickets(str(tmp_path / "x.gz"), "tickets", "xml"))
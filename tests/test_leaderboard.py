@@ -0,0 +1,46 @@
+from leaderboard import TopK
+
+
+def test_ranking_is_sorted_and_hides_empty():
+    top = TopK(3, [(1, "a", 5), (2, "b", 0), (3, "c", 7)])
+    assert top.ranking() == [(3, "c", 7), (1, "a", 5)]
+
+
+def test_outsider_replaces_lowest_leader():
+    top = TopK(2, [(1, "a", 5), (2, "b", 3), (3, "c", 2)])
+    top.update(3, "c", 4)
+    assert top.ranking() == [(1, "a", 5), (3, "c", 4)]
+    assert not top.stale
+
+
+def test_outsider_below_top_is_remembered():
+    top = TopK(2, [(1, "a", 5), (2, "b", 3)])
+    top.update(3, "c", 2)
+    assert top.ranking() == [(1, "a", 5), (2, "b", 3)]
+    # Лидер опустился ниже участника снаружи: кто займёт его место, в памяти не известно
+    top.update(2, "b", 1)
+    assert top.stale
+
+
+def test_leader_may_drop_to_outside_bound():
+    top = TopK(2, [(1, "a", 5), (2, "b", 3), (3, "c", 2)])
+    top.update(2, "b", 2)
+    assert not top.stale
+    assert top.ranking() == [(1, "a", 5), (2, "b", 2)]
+
+
+def test_incomplete_top_accepts_newcomers():
+    top = TopK(3, [(1, "a", 1)])
+    top.update(2, "b", 2)
+    top.update(1, "a", 0)
+    assert not top.stale
+    assert top.ranking() == [(2, "b", 2)]
+    assert len(top) == 2
+
+
+def test_stale_top_ignores_updates():
+    top = TopK(1, [(1, "a", 5), (2, "b", 4)])
+    top.update(1, "a", 3)
+    top.update(3, "c", 10)
+    assert top.stale
+    assert top.ranking() == [(1, "a", 5)]
@@ -0,0 +1,83 @@
+import db
+import utils
+from utils import draw_lock_for, forget_draw_lock
+
+
+async def _two_lotteries():
+    """Лотерея 1 (создаётся миграцией) и вторая со своим чатом; в каждой билеты двух участников."""
+    other = await db.create_lottery("Вторая", -200)
+    first_numbers = [
+        await db.add_ticket(1, user_id, f"u{user_id}", f"a{user_id}-{i}") for user_id in (10, 11) for i in range(2)
+    ]
+    other_numbers = [await db.add_ticket(other.id, 10, "u10", f"b{i}") for i in range(3)]
+    return other.id, first_numbers, other_numbers
+
+
+def test_tickets_numbers_and_stats_are_per_lottery(run_db):
+    async def scenario():
+        other, first_numbers, other_numbers = await _two_lotteries()
+        first_ticket = await db.get_ticket_by_number_any_status(1, 1)
+        other_ticket = await db.get_ticket_by_number_any_status(other, 1)
+        await db.set_ticket_status_if_active(other, 1, "deleted", None)
+        return (
+            first_numbers,
+            other_numbers,
+            (first_ticket.file_id, other_ticket.file_id),
+            [(await db.get_active_tickets_page(lid, 10))[0] for lid in (1, other)],
+            [await db.get_user_stats(lid, 10) for lid in (1, other)],
+            [await db.get_lottery_stats(lid) for lid in (1, other)],
+            {(await db.get_random_active_ticket(other)).file_id for _ in range(50)},
+        )
+
+    first_numbers, other_numbers, files, pages, user_stats, lottery_stats, drawn = run_db(scenario)
+    # Своя нумерация у каждой лотереи: обе начинаются с №1
+    assert first_numbers == [1, 2, 3, 4]
+    assert other_numbers == [1, 2, 3]
+    assert files == ("a10-0", "b0")
+    assert pages == [[1, 2], [2, 3]]
+    assert user_stats == [(2, 2), (3, 2)]
+    assert lottery_stats[0] == {"active": 4, "participants": 2}
+    assert lottery_stats[1] == {"active": 2, "deleted": 1, "participants": 1}
+    assert drawn == {"b1", "b2"}
+
+
+def test_archive_leaves_other_lottery_alone(run_db):
+    async def scenario():
+        other, _, _ = await _two_lotteries()
+        before = await db.get_lottery_stats(other), await db.get_user_stats(other, 10)
+        moved = await db.archive_lottery(1)
+        after = await db.get_lottery_stats(other), await db.get_user_stats(other, 10)
+        open_ids = [lottery.id for lottery in await db.get_open_lotteries()]
+        page = (await db.get_active_tickets_page(other, 10))[0]
+        drawn = await db.get_random_active_ticket(other)
+        return other, moved, before, after, open_ids, page, drawn
+
+    other, moved, before, after, open_ids, page, drawn = run_db(scenario)
+    assert moved == 4
+    assert before == after
+    # Вместо закрытой лотереи 1 открыта новая, вторая осталась открытой
+    assert other in open_ids and 1 not in open_ids and len(open_ids) == 2
+    assert page == [1, 2, 3]
+    assert drawn.file_id.startswith("b")
+
+
+def test_draw_locks_are_per_lottery(run_db):
+    async def scenario():
+        first, second = draw_lock_for(101), draw_lock_for(102)
+        assert draw_lock_for(101) is first
+        assert await first.try_acquire()
+        # Розыгрыш одной лотереи не мешает другой
+        assert await second.try_acquire()
+        assert not await draw_lock_for(101).try_acquire()
+        await second.release()
+        # Архивированную лотерею забываем, но не посреди работы под её блокировкой
+        forget_draw_lock(101)
+        forget_draw_lock(102)
+        kept = 101 in utils._draw_locks, 102 in utils._draw_locks
+        await first.release()
+        forget_draw_lock(101)
+        return kept, 101 in utils._draw_locks
+
+    kept, still_there = run_db(scenario)
+    assert kept == (True, False)
+    assert not still_there
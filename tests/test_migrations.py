@@ -0,0 +1,97 @@
+import sqlite3
+
+import db
+
+# Схема и данные, какими их оставляла первая версия бота (до миграций, user_version = 0)
+BASELINE_SCHEMA = """
+CREATE TABLE tickets (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    ticket_number INTEGER NOT NULL,
+    user_id INTEGER NOT NULL,
+    username TEXT,
+    file_id TEXT NOT NULL,
+    status TEXT DEFAULT 'active',
+    comment TEXT DEFAULT NULL
+);
+CREATE TABLE tickets_archive (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    ticket_number INTEGER NOT NULL,
+    user_id INTEGER NOT NULL,
+    username TEXT,
+    file_id TEXT NOT NULL,
+    status TEXT,
+    comment TEXT,
+    archived_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+CREATE TABLE lotteries (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    archived_at TIMESTAMP
+);
+INSERT INTO lotteries (created_at, archived_at) VALUES ('2024-01-01 10:00:00', '2024-02-01 10:00:00');
+INSERT INTO lotteries (created_at) VALUES ('2024-02-01 10:00:00');
+INSERT INTO tickets_archive (ticket_number, user_id, username, file_id, status, comment, archived_at) VALUES
+    (1, 10, 'alice', 'a1', 'active', NULL, '2024-02-01 10:00:00'),
+    (2, 11, 'bob', 'b1', 'rejected', 'выиграл', '2024-02-01 10:00:00');
+-- Старый MAX()+1 под нагрузкой выдавал один номер дважды
+INSERT INTO tickets (ticket_number, user_id, username, file_id, status, comment) VALUES
+    (3, 10, 'alice', 'a2', 'active', NULL),
+    (4, 10, 'alice', 'a3', 'rejected', 'выиграл'),
+    (4, 11, 'bob', 'b2', 'active', NULL),
+    (5, 12, 'carol', 'c1', 'deleted', 'не то фото');
+"""
+
+
+def _baseline(path: str) -> None:
+    conn = sqlite3.connect(path)
+    conn.executescript(BASELINE_SCHEMA)
+    conn.close()
+
+
+def _query(conn: sqlite3.Connection, sql: str) -> list:
+    return conn.execute(sql).fetchall()
+
+
+def test_migrations_upgrade_baseline_database(run_db):
+    async def scenario():
+        stats = await db.get_lottery_stats(2)
+        users = [await db.get_user_stats(2, user_id) for user_id in (10, 11, 12)]
+        next_number = await db.add_ticket(2, 11, "bob", "b3", "b3")
+        drawn = {(await db.get_random_active_ticket(2)).ticket_number for _ in range(100)}
+        return stats, users, next_number, drawn
+
+    stats, users, next_number, drawn = run_db(scenario, prepare=_baseline)
+
+    assert stats == {"active": 2, "rejected": 1, "deleted": 1, "participants": 3}
+    assert users == [(2, 1), (1, 1), (1, 0)]
+    # Дубликат получил новый номер, счётчик продолжается после него
+    assert next_number == 7
+    assert drawn == {3, 6, 7}
+
+    conn = sqlite3.connect(db.DB_PATH)
+    try:
+        assert _query(conn, "PRAGMA user_version") == [(db.SCHEMA_VERSION,)]
+        assert _query(conn, "SELECT ticket_number, user_id, lottery_id FROM tickets ORDER BY ticket_number") == [
+            (3, 10, 2),
+            (4, 10, 2),
+            (5, 12, 2),
+            (6, 11, 2),
+            (7, 11, 2),
+        ]
+        assert _query(conn, "SELECT ticket_number, lottery_id FROM tickets_archive ORDER BY ticket_number") == [
+            (1, 1),
+            (2, 1),
+        ]
+    finally:
+        conn.close()
+
+
+def test_migrate_again_changes_nothing(run_db):
+    async def scenario():
+        before = await db.get_lottery_stats(2)
+        version = await db.migrate()
+        return version, before, await db.get_lottery_stats(2)
+
+    version, before, after = run_db(scenario, prepare=_baseline)
+    assert version == db.SCHEMA_VERSION
+    assert before == after
@@ -0,0 +1,80 @@
+import pytest
+
+import db
+from moderation import (
+    MAX_SELECTION_PARTS,
+    MAX_SQL_INTEGER,
+    TicketSelection,
+    format_moderation_notice,
+    merge_ranges,
+    parse_selection,
+)
+
+
+def test_merge_ranges_joins_overlapping_and_adjacent():
+    assert merge_ranges([(20, 30), (1, 1), (3, 5), (4, 10), (11, 12), (31, 31)]) == [(1, 1), (3, 12), (20, 31)]
+
+
+def test_parse_numbers_and_ranges():
+    selection = parse_selection("15, 20-340, 512 ;  600 - 601 16")
+    assert selection == TicketSelection(ranges=((15, 16), (20, 340), (512, 512), (600, 601)))
+    assert not selection.by_user
+
+
+@pytest.mark.parametrize(
+    "text, expected",
+    [
+        ("user 12345", TicketSelection(user_id=12345)),
+        ("пользователь 7", TicketSelection(user_id=7)),
+        ("user @Spammer_1", TicketSelection(username="Spammer_1")),
+        ("@spammer", TicketSelection(username="spammer")),
+    ],
+)
+def test_parse_user(text, expected):
+    assert parse_selection(text) == expected
+
+
+@pytest.mark.parametrize(
+    "text",
+    [
+        "",
+        "abc",
+        "0",
+        "10-5",
+        "1-2-3",
+        f"1-{MAX_SQL_INTEGER + 1}",
+        "1-99999999999999999999",
+        f"user {MAX_SQL_INTEGER + 1}",
+        ", ".join(str(n) for n in range(1, MAX_SELECTION_PARTS * 3, 2)),
+    ],
+)
+def test_parse_rejects_invalid_input(text):
+    with pytest.raises(ValueError):
+        parse_selection(text)
+
+
+def test_parse_accepts_largest_sql_integer():
+    assert parse_selection(f"1-{MAX_SQL_INTEGER}").ranges == ((1, MAX_SQL_INTEGER),)
+
+
+def test_notice_compresses_numbers_into_ranges():
+    assert format_moderation_notice("deleted", [7], "спам") == "🗑 Билет №7 удалён. Причина: спам"
+    assert format_moderation_notice("rejected", [1, 2, 3, 5], "x") == "🚫 Отклонено билетов: 4 (№1–3, №5). Причина: x"
+
+
+def test_selection_applies_in_one_update(run_db):
+    async def scenario():
+        for i in range(1, 11):
+            await db.add_ticket(1, 100 + i % 2, f"user{100 + i % 2}", f"f{i}", f"f{i}")
+        wide = parse_selection(f"1-{MAX_SQL_INTEGER}")
+        before = await db.count_selected_tickets(1, wide)
+        changed = await db.set_selected_tickets_status(1, parse_selection("2-4, 9"), "deleted", "спам")
+        by_user = await db.set_selected_tickets_status(1, parse_selection("@USER101"), "rejected", "мульти")
+        return before, changed, by_user, await db.count_selected_tickets(1, wide), await db.get_lottery_stats(1)
+
+    before, changed, by_user, after, stats = run_db(scenario)
+    assert before == (10, 2)
+    assert changed == [2, 3, 4, 9]
+    assert by_user == [1, 5, 7]
+    assert after == (3, 1)
+    assert stats["active"] == 3 and stats["deleted"] == 4 and stats["rejected"] == 3
@@ -0,0 +1,91 @@
+import asyncio
+
+from digest import TicketDigest
+from outbox import PRIORITY_MODERATION, PRIORITY_NOTICE, PRIORITY_WINNER, Outbox
+
+CHAT = -100
+OTHER_CHAT = -200
+
+
+def _drain(box: Outbox):
+    sent = []
+    while True:
+        item, _ = box._next_ready()
+        if item is None:
+            return sent
+        sent.append((item.chat_id, item.text))
+
+
+def _outbox() -> Outbox:
+    return Outbox(max_size=100, chat_rate=1e9, chat_burst=1e9, global_rate=1e9)
+
+
+def test_priority_overtakes_notices_by_default():
+    box = _outbox()
+    box.enqueue(CHAT, "tickets 2-3", PRIORITY_NOTICE)
+    box.enqueue(CHAT, "winner", PRIORITY_WINNER)
+    assert [text for _, text in _drain(box)] == ["winner", "tickets 2-3"]
+
+
+def test_after_queued_keeps_chat_order():
+    box = _outbox()
+    box.enqueue(CHAT, "tickets 1", PRIORITY_NOTICE)
+    box.enqueue(CHAT, "tickets 2-3", PRIORITY_NOTICE)
+    box.enqueue(OTHER_CHAT, "other chat", PRIORITY_NOTICE)
+    box.enqueue(CHAT, "deleted 2-3", PRIORITY_MODERATION, after_queued=True)
+    box.enqueue(CHAT, "winner", PRIORITY_WINNER)
+    sent = [text for chat, text in _drain(box) if chat == CHAT]
+    assert sent == ["winner", "tickets 1", "tickets 2-3", "deleted 2-3"]
+
+
+def test_after_queued_does_not_touch_other_chats():
+    box = _outbox()
+    box.enqueue(OTHER_CHAT, "other chat", PRIORITY_NOTICE)
+    box.enqueue(CHAT, "archived", PRIORITY_MODERATION, after_queued=True)
+    assert [text for _, text in _drain(box)] == ["archived", "other chat"]
+
+
+def test_moderation_notice_follows_flushed_digest():
+    async def scenario():
+        box = _outbox()
+        digest = TicketDigest(box, window=30)
+        for number in (1, 2, 3):
+            digest.add(CHAT, "spammer", number)
+        digest.flush()
+        box.enqueue(CHAT, "deleted 2-3", PRIORITY_MODERATION, after_queued=True)
+        await digest.stop()
+        return [text for _, text in _drain(box)]
+
+    sent = asyncio.run(scenario())
+    assert len(sent) == 3
+    assert "№1" in sent[0] and "№2, №3" in sent[1]
+    assert sent[2] == "deleted 2-3"
+
+
+class _FlakyBot:
+    """Бот, у которого отправка в один чат падает не-Telegram исключением."""
+
+    def __init__(self) -> None:
+        self.sent = []
+
+    async def send_message(self, chat_id, text, **kwargs):
+        if chat_id == OTHER_CHAT:
+            raise ValueError("message is too long")
+        self.sent.append(text)
+
+
+def test_unexpected_error_does_not_stop_sending():
+    async def scenario():
+        box = _outbox()
+        bot = _FlakyBot()
+        box.start(bot)
+        box.enqueue(OTHER_CHAT, "broken")
+        box.enqueue(CHAT, "first")
+        box.enqueue(OTHER_CHAT, "broken again")
+        box.enqueue(CHAT, "second")
+        await box.stop(timeout=1.0)
+        return bot.sent, box.dropped, len(box)
+
+    sent, dropped, left = asyncio.run(scenario())
+    assert sent == ["first", "second"]
+    assert (dropped, left) == (2, 0)
@@ -0,0 +1,95 @@
+import asyncio
+
+import pytest
+
+import db
+
+
+WRITERS = 20
+
+
+async def _counter(conn) -> int:
+    async with conn.execute("SELECT value FROM ticket_sequence WHERE name = 'test'") as cursor:
+        row = await cursor.fetchone()
+    return row[0] if row else 0
+
+
+async def _read_counter() -> int:
+    async with db.pool.read() as conn:
+        return await _counter(conn)
+
+
+def test_readers_work_during_open_write(run_db):
+    async def scenario():
+        async with db.pool.write() as conn:
+            await conn.execute("INSERT INTO ticket_sequence (name, value) VALUES ('test', 1)")
+        async with db.pool.write() as conn:
+            await conn.execute("UPDATE ticket_sequence SET value = 2 WHERE name = 'test'")
+            # Транзакция писателя открыта: читатели не ждут её и видят последнее подтверждённое
+            seen = await asyncio.wait_for(asyncio.gather(*(_read_counter() for _ in range(10))), timeout=2)
+        return seen, await _read_counter()
+
+    seen, after = run_db(scenario)
+    assert seen == [1] * 10
+    assert after == 2
+
+
+def test_writes_are_serialized(run_db):
+    async def scenario():
+        order = []
+        release = asyncio.Event()
+
+        async def first():
+            async with db.pool.write():
+                order.append("first")
+                await release.wait()
+                order.append("first done")
+
+        async def second():
+            async with db.pool.write():
+                order.append("second")
+
+        tasks = [asyncio.create_task(first())]
+        await asyncio.sleep(0.05)
+        tasks.append(asyncio.create_task(second()))
+        await asyncio.sleep(0.1)
+        waiting = list(order)
+        release.set()
+        await asyncio.gather(*tasks)
+        return waiting, order
+
+    waiting, order = run_db(scenario)
+    assert waiting == ["first"]
+    assert order == ["first", "first done", "second"]
+
+
+def test_concurrent_read_modify_write_loses_nothing(run_db):
+    async def scenario():
+        async def increment():
+            async with db.pool.write() as conn:
+                value = await _counter(conn)
+                # Отдаём управление между чтением и записью: без одного писателя здесь терялись бы обновления
+                await asyncio.sleep(0)
+                await conn.execute(
+                    "INSERT INTO ticket_sequence (name, value) VALUES ('test', ?) "
+                    "ON CONFLICT(name) DO UPDATE SET value = excluded.value",
+                    (value + 1,),
+                )
+
+        await asyncio.gather(*(increment() for _ in range(WRITERS)))
+        return await _read_counter()
+
+    assert run_db(scenario) == WRITERS
+
+
+def test_failed_write_is_rolled_back_and_releases_writer(run_db):
+    async def scenario():
+        with pytest.raises(RuntimeError):
+            async with db.pool.write() as conn:
+                await conn.execute("INSERT INTO ticket_sequence (name, value) VALUES ('test', 5)")
+                raise RuntimeError("сбой посреди записи")
+        async with db.pool.write() as conn:
+            await conn.execute("INSERT INTO ticket_sequence (name, value) VALUES ('test', 1)")
+        return await _read_counter()
+
+    assert run_db(scenario) == 1
@@ -0,0 +1,111 @@
+from types import SimpleNamespace
+
+import pytest
+from aiogram.fsm.storage.base import StorageKey
+
+import db
+import storage
+from storage import SQLiteStorage
+
+TTL = 100.0
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(storage, "time", SimpleNamespace(time=lambda: now[0]))
+    return now
+
+
+def _key(user_id: int) -> StorageKey:
+    return StorageKey(bot_id=1, chat_id=user_id, user_id=user_id)
+
+
+def _raw_key(fsm: SQLiteStorage, user_id: int) -> str:
+    return fsm._key_builder.build(_key(user_id))
+
+
+def test_state_expires_after_ttl(run_db, clock):
+    async def scenario():
+        fsm = SQLiteStorage(ttl=TTL, flush_interval=0)
+        await fsm.set_state(_key(1), "AskReason:reject_reason")
+        await fsm.set_data(_key(1), {"ticket": 5})
+        clock[0] += TTL / 2
+        alive = await fsm.get_state(_key(1)), await fsm.get_data(_key(1))
+        clock[0] += TTL + 1
+        expired = await fsm.get_state(_key(1)), await fsm.get_data(_key(1))
+        row = await db.load_fsm_record(_raw_key(fsm, 1))
+        await fsm.close()
+        return alive, expired, row
+
+    alive, expired, row = run_db(scenario)
+    assert alive == ("AskReason:reject_reason", {"ticket": 5})
+    assert expired == (None, {})
+    assert row is None
+
+
+def test_expired_rows_are_purged_without_flush_loop(run_db, clock):
+    async def scenario():
+        fsm = SQLiteStorage(cache_size=0, ttl=TTL, flush_interval=0)
+        await fsm.set_state(_key(1), "UploadPhoto:waiting_for_photo")
+        await fsm.set_state(_key(2), "UploadPhoto:waiting_for_photo")
+        clock[0] += TTL + 1
+        # Брошенных состояний никто не читает; их удаляет запись любого другого пользователя
+        await fsm.set_state(_key(3), "UploadPhoto:waiting_for_photo")
+        rows = [await db.load_fsm_record(_raw_key(fsm, user_id)) for user_id in (1, 2, 3)]
+        await fsm.close()
+        return fsm._task, rows
+
+    task, rows = run_db(scenario)
+    assert task is None
+    assert rows[:2] == [None, None]
+    assert rows[2][0] == "UploadPhoto:waiting_for_photo"
+
+
+def test_lru_keeps_cache_bounded(run_db):
+    async def scenario():
+        fsm = SQLiteStorage(cache_size=2, ttl=0, flush_interval=0)
+        for user_id in (1, 2, 3):
+            await fsm.set_state(_key(user_id), f"state{user_id}")
+        cached = list(fsm._cache)
+        # Вытесненная запись читается из БД
+        state = await fsm.get_state(_key(1))
+        await fsm.close()
+        return cached, state, [_raw_key(fsm, user_id) for user_id in (2, 3)]
+
+    cached, state, expected = run_db(scenario)
+    assert cached == expected
+    assert state == "state1"
+
+
+def test_changes_are_flushed_in_one_batch(run_db, monkeypatch):
+    calls = []
+    save = storage.save_fsm_records
+
+    async def counting_save(upserts, deletes):
+        calls.append((len(upserts), len(deletes)))
+        await save(upserts, deletes)
+
+    monkeypatch.setattr(storage, "save_fsm_records", counting_save)
+
+    async def scenario():
+        # Фоновый цикл не успеет сработать: сбрасываем вручную, как он сам
+        fsm = SQLiteStorage(ttl=0, flush_interval=3600)
+        await fsm.set_state(_key(4), "gone")
+        await fsm.flush()
+        for user_id in (1, 2, 3):
+            await fsm.set_state(_key(user_id), f"state{user_id}")
+        await fsm.set_state(_key(4), None)
+        before = await db.load_fsm_record(_raw_key(fsm, 1))
+        await fsm.flush()
+        rows = [await db.load_fsm_record(_raw_key(fsm, user_id)) for user_id in (1, 2, 3, 4)]
+        started = fsm._task is not None
+        await fsm.close()
+        return before, rows, started
+
+    before, rows, started = run_db(scenario)
+    assert started
+    assert before is None
+    assert [row[0] for row in rows[:3]] == ["state1", "state2", "state3"]
+    assert rows[3] is None
+    assert calls == [(1, 0), (3, 1)]
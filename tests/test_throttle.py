@@ -0,0 +1,65 @@
+from throttle import CALLBACK, UPLOAD, VIEW, Limit, Throttler
+
+# 1 действие в секунду, до 2 подряд
+LIMITS = (Limit(1.0, 2.0), Limit(1.0, 2.0), Limit(0.0, 1.0))
+
+
+def test_burst_then_wait():
+    throttler = Throttler(LIMITS)
+    assert throttler.hit(1, UPLOAD, now=0.0) == 0
+    assert throttler.hit(1, UPLOAD, now=0.0) == 0
+    assert throttler.hit(1, UPLOAD, now=0.0) == 1.0
+    assert throttler.hit(1, UPLOAD, now=0.5) == 0.5
+    assert throttler.hit(1, UPLOAD, now=1.0) == 0
+    assert throttler.stats()["throttled"]["upload"] == 2
+
+
+def test_actions_and_users_are_independent():
+    throttler = Throttler(LIMITS)
+    for _ in range(2):
+        throttler.hit(1, UPLOAD, now=0.0)
+    assert throttler.hit(1, UPLOAD, now=0.0)
+    assert throttler.hit(1, VIEW, now=0.0) == 0
+    assert throttler.hit(2, UPLOAD, now=0.0) == 0
+
+
+def test_zero_rate_is_unlimited():
+    throttler = Throttler(LIMITS)
+    assert all(throttler.hit(1, CALLBACK, now=0.0) == 0 for _ in range(100))
+    assert len(throttler) == 0
+
+
+def test_album_shares_first_decision():
+    throttler = Throttler(LIMITS)
+    assert all(throttler.hit(1, UPLOAD, album="a", now=0.0) == 0 for _ in range(5))
+    throttler.hit(1, UPLOAD, now=0.0)
+    assert throttler.hit(1, UPLOAD, album="b", now=0.0)
+    # Отклонённый альбом отклоняется целиком, даже когда токен уже накопился
+    assert throttler.hit(1, UPLOAD, album="b", now=5.0)
+    assert throttler.hit(1, UPLOAD, album="c", now=5.0) == 0
+
+
+def test_warns_once_per_episode():
+    throttler = Throttler(LIMITS)
+    for _ in range(3):
+        throttler.hit(1, VIEW, now=0.0)
+    assert throttler.should_warn(1, VIEW)
+    throttler.hit(1, VIEW, now=0.0)
+    assert not throttler.should_warn(1, VIEW)
+    assert throttler.hit(1, VIEW, now=2.0) == 0
+    throttler.hit(1, VIEW, now=2.0)
+    throttler.hit(1, VIEW, now=2.0)
+    assert throttler.should_warn(1, VIEW)
+
+
+def test_lru_evicts_oldest_user():
+    throttler = Throttler(LIMITS, max_users=2)
+    throttler.hit(1, VIEW, now=0.0)
+    throttler.hit(2, VIEW, now=0.0)
+    throttler.hit(1, VIEW, now=0.0)
+    throttler.hit(3, VIEW, now=0.0)
+    assert len(throttler) == 2
+    assert throttler.evictions == 1
+    # Вытесненный пользователь начинает с полной корзиной
+    assert throttler.hit(2, VIEW, now=0.0) == 0
+    assert throttler.hit(2, VIEW, now=0.0) == 0
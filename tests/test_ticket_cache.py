@@ -0,0 +1,87 @@
+import db
+from ticket_cache import UserTicketCache, page_of
+
+KEY = (1, 100)
+
+
+def _loaded(numbers, max_bytes=1 << 20) -> UserTicketCache:
+    cache = UserTicketCache(max_bytes)
+    cache.finish_load(KEY, cache.begin_load(KEY), numbers)
+    return cache
+
+
+def test_page_of_walks_forward_and_back():
+    numbers = list(range(1, 26))
+    assert page_of(numbers, 0, None, 10) == (list(range(1, 11)), False, True, 25)
+    assert page_of(numbers, 20, None, 10) == (list(range(21, 26)), True, False, 25)
+    assert page_of(numbers, 0, 21, 10) == (list(range(11, 21)), True, True, 25)
+
+
+def test_cache_tracks_changes_after_load():
+    cache = _loaded([5, 1, 3])
+    cache.add(KEY, 7)
+    cache.discard(KEY, 3)
+    assert cache.page(KEY, 0, None, 10) == ([1, 5, 7], False, False, 3)
+    assert cache.owns(KEY, 5) is True
+    assert cache.owns(KEY, 3) is False
+    assert cache.owns((1, 999), 5) is None
+
+
+def test_load_racing_with_a_change_is_dropped():
+    cache = UserTicketCache(1 << 20)
+    token = cache.begin_load(KEY)
+    cache.add(KEY, 9)
+    cache.finish_load(KEY, token, [1, 2])
+    assert KEY not in cache
+
+
+def test_entries_are_evicted_by_lru_within_budget():
+    cache = UserTicketCache(1000)
+    for user_id in range(10):
+        key = (1, user_id)
+        cache.finish_load(key, cache.begin_load(key), range(10))
+    assert 0 < len(cache) < 10
+    assert (1, 9) in cache and (1, 0) not in cache
+
+
+def test_oversized_list_is_not_cached():
+    cache = _loaded(range(10_000), max_bytes=1000)
+    assert KEY not in cache and cache.evictions == 0
+
+
+def test_heavy_user_is_cached_after_first_page(run_db):
+    async def scenario():
+        await db.add_tickets(1, 100, "heavy", [(f"f{i}", f"f{i}", None) for i in range(30)])
+        # Счётчики кэша общие на процесс: считаем промахи только этого сценария
+        misses = db.user_tickets.misses
+        first = await db.get_active_tickets_page(1, 100, limit=20)
+        second = await db.get_active_tickets_page(1, 100, after=first[0][-1], limit=20)
+        owns = db.user_owns_active_ticket(1, 100, 25), db.user_owns_active_ticket(1, 100, 31)
+        return first, second, owns, len(db.user_tickets), db.user_tickets.misses - misses
+
+    first, second, owns, users, misses = run_db(scenario)
+    assert first == (list(range(1, 21)), False, True, 30)
+    assert second == (list(range(21, 31)), True, False, 30)
+    assert owns == (True, False)
+    assert users == 1
+    assert misses == 1
+
+
+def test_pages_without_cache_use_keyset_queries(run_db, monkeypatch):
+    monkeypatch.setattr(db.user_tickets, "enabled", False)
+
+    async def scenario():
+        await db.add_tickets(1, 100, "heavy", [(f"f{i}", f"f{i}", None) for i in range(30)])
+        await db.add_ticket(1, 200, "other", "g", "g")
+        return (
+            await db.get_active_tickets_page(1, 100, limit=20),
+            await db.get_active_tickets_page(1, 100, after=20, limit=20),
+            await db.get_active_tickets_page(1, 100, before=21, limit=20),
+            await db.get_active_tickets_page(1, 200, limit=20),
+        )
+
+    first, second, back, other = run_db(scenario)
+    assert first == (list(range(1, 21)), False, True, 30)
+    assert second == (list(range(21, 31)), True, False, 30)
+    assert back == first
+    assert other == ([31], False, False, 1)
@@ -0,0 +1,71 @@
+import asyncio
+import multiprocessing
+
+import pytest
+
+import db
+
+PROCESSES = 3
+PER_PROCESS = 30
+
+
+def test_concurrent_add_ticket_gets_distinct_numbers(run_db):
+    async def scenario():
+        return await asyncio.gather(*(db.add_ticket(1, user_id % 5, "u", f"f{user_id}") for user_id in range(50)))
+
+    numbers = run_db(scenario)
+    assert sorted(numbers) == list(range(1, 51))
+
+
+def test_sequential_numbers_grow(run_db):
+    async def scenario():
+        numbers = [await db.add_ticket(1, 1, "u", f"f{i}") for i in range(5)]
+        numbers += (await db.add_tickets(1, 1, "u", [(f"g{i}", f"g{i}", None) for i in range(3)]))[0]
+        numbers.append(await db.add_ticket(1, 1, "u", "last"))
+        return numbers
+
+    assert run_db(scenario) == list(range(1, 10))
+
+
+def _add_in_worker(worker: int) -> list:
+    async def main():
+        await db.init_db()
+        try:
+            return [await db.add_ticket(1, worker, f"w{worker}", f"w{worker}-{i}") for i in range(PER_PROCESS)]
+        finally:
+            await db.close_db()
+
+    return asyncio.run(main())
+
+
+def test_numbers_are_unique_across_processes(run_db):
+    async def scenario():
+        # Воркеры пишут в ту же базу, пока в этом процессе она открыта
+        loop = asyncio.get_running_loop()
+        with multiprocessing.get_context("spawn").Pool(PROCESSES) as workers:
+            results = await loop.run_in_executor(None, workers.map, _add_in_worker, range(PROCESSES))
+        own = await db.add_ticket(1, 99, "main", "main")
+        return results, own
+
+    results, own = run_db(scenario)
+    numbers = [n for result in results for n in result]
+    assert sorted(numbers) == list(range(1, PROCESSES * PER_PROCESS + 1))
+    # У каждого воркера номера растут в порядке его вставок
+    assert all(result == sorted(result) for result in results)
+    assert own == PROCESSES * PER_PROCESS + 1
+
+
+@pytest.mark.parametrize("mode, first_number", [("continue", 4), ("reset", 1)])
+def test_numbering_after_archive(run_db, monkeypatch, mode, first_number):
+    monkeypatch.setattr(db, "TICKET_NUMBERING", mode)
+
+    async def scenario():
+        for i in range(3):
+            await db.add_ticket(1, 1, "u", f"old{i}")
+        await db.archive_lottery(1)
+        successor = (await db.get_open_lotteries())[0].id
+        return successor, [await db.add_ticket(successor, 1, "u", f"new{i}") for i in range(2)]
+
+    successor, numbers = run_db(scenario)
+    assert successor != 1
+    assert numbers == [first_number, first_number + 1]
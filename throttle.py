@@ -0,0 +1,204 @@
+"""
+Защита от флуда: ограничение частоты действий каждого пользователя.
+
+ThrottlingMiddleware стоит внешней middleware на dp.update сразу после
+RoleMiddleware и до всего, что ходит в БД: обновление сверх лимита
+отбрасывается, не дойдя ни до фильтров состояний FSM, ни до обработчика.
+
+Действия считаются раздельно, у каждого свой token bucket (та же формула,
+что у outbox.TokenBucket):
+- upload — фото и другие файлы: каждое прошедшее превращается в запись в
+  БД, поэтому этот лимит бережёт путь записи во время волн спама; альбом
+  расходует один токен на все свои части;
+- view — текстовые сообщения: кнопки меню («Мои билеты» и др.) и команды;
+- callback — нажатия инлайн-кнопок.
+
+Состояние хранится в LRU-словаре не больше чем на THROTTLE_MAX_USERS
+пользователей, запись фиксированного размера (несколько сотен байт), так
+что потолок памяти известен заранее. Вытесненный пользователь просто
+начинает с полными корзинами. Предупреждение «слишком часто» отправляется
+один раз за эпизод: повторные превышения молча отбрасываются, пока
+действие снова не пройдёт. Админы лимитам не подчиняются.
+
+Лимиты считаются в пределах процесса: при WORKERS > 1 у каждого воркера свои корзины.
+"""
+
+import math
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, List, NamedTuple, Optional, Tuple
+
+from aiogram import BaseMiddleware
+from aiogram.exceptions import TelegramAPIError
+from aiogram.types import TelegramObject, Update
+
+
+class Limit(NamedTuple):
+    rate: float  # токенов в секунду; 0 — действие не ограничивается
+    burst: float  # ёмкость корзины: сколько действий подряд допустимо
+
+
+def _limit(name: str, rate: str, burst: str) -> Limit:
+    # Частота задаётся в действиях в минуту, как OUTBOX_CHAT_RATE
+    return Limit(
+        float(os.getenv(f"THROTTLE_{name}_RATE", rate)) / 60,
+        max(1.0, float(os.getenv(f"THROTTLE_{name}_BURST", burst))),
+    )
+
+
+UPLOAD, VIEW, CALLBACK = 0, 1, 2
+ACTIONS = ("upload", "view", "callback")
+
+THROTTLE_LIMITS = (
+    _limit("UPLOAD", "30", "10"),
+    _limit("VIEW", "60", "10"),
+    _limit("CALLBACK", "120", "20"),
+)
+THROTTLE_MAX_USERS = int(os.getenv("THROTTLE_MAX_USERS", "100000"))
+
+THROTTLED_TEXT = "⏳ Слишком часто. Подождите {seconds} сек. и попробуйте снова."
+
+
+class _UserState:
+    """Корзины одного пользователя; все три пополняются разом при обращении."""
+
+    __slots__ = ("tokens", "updated", "warned", "album", "album_allowed")
+
+    def __init__(self, limits: Tuple[Limit, ...], now: float) -> None:
+        self.tokens: List[float] = [limit.burst for limit in limits]
+        self.updated = now
+        self.warned = 0  # битовая маска действий, о превышении которых уже предупредили
+        self.album: Optional[str] = None  # последний альбом и решение по нему
+        self.album_allowed = True
+
+
+class Throttler:
+    """Token bucket на каждую пару «пользователь, действие» в LRU ограниченного размера."""
+
+    def __init__(self, limits: Tuple[Limit, ...] = THROTTLE_LIMITS, max_users: int = THROTTLE_MAX_USERS) -> None:
+        self.limits = limits
+        self.max_users = max(1, max_users)
+        self._users: "OrderedDict[int, _UserState]" = OrderedDict()
+        self.allowed = [0] * len(limits)
+        self.throttled = [0] * len(limits)
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self._users)
+
+    def _state(self, user_id: int, now: float) -> _UserState:
+        state = self._users.get(user_id)
+        if state is None:
+            state = self._users[user_id] = _UserState(self.limits, now)
+            if len(self._users) > self.max_users:
+                self._users.popitem(last=False)
+                self.evictions += 1
+            return state
+        self._users.move_to_end(user_id)
+        elapsed = now - state.updated
+        state.updated = now
+        for i, limit in enumerate(self.limits):
+            state.tokens[i] = min(limit.burst, state.tokens[i] + elapsed * limit.rate)
+        return state
+
+    def hit(self, user_id: int, action: int, album: Optional[str] = None, now: Optional[float] = None) -> float:
+        """
+        Расходует токен действия. Возвращает 0, если действие разрешено, иначе
+        через сколько секунд появится токен. Части одного альбома разделяют
+        решение, принятое по первой из них.
+        """
+        if not self.limits[action].rate:
+            return 0.0
+        if now is None:
+            now = time.monotonic()
+        state = self._state(user_id, now)
+        if album is not None and album == state.album:
+            # Отклонённый альбом отклоняется целиком, даже если токен уже накопился
+            wait = 0.0 if state.album_allowed else self._wait(state, action) or 1 / self.limits[action].rate
+        else:
+            wait = self._wait(state, action)
+            if not wait:
+                state.tokens[action] -= 1
+            if album is not None:
+                state.album = album
+                state.album_allowed = not wait
+        if wait:
+            self.throttled[action] += 1
+        else:
+            self.allowed[action] += 1
+            state.warned &= ~(1 << action)
+        return wait
+
+    def _wait(self, state: _UserState, action: int) -> float:
+        tokens = state.tokens[action]
+        if tokens >= 1:
+            return 0.0
+        return (1 - tokens) / self.limits[action].rate
+
+    def should_warn(self, user_id: int, action: int) -> bool:
+        """True только для первого отброшенного действия в серии: ответы о превышении не множатся."""
+        state = self._users.get(user_id)
+        if state is None or state.warned & (1 << action):
+            return False
+        state.warned |= 1 << action
+        return True
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "users": len(self._users),
+            "max_users": self.max_users,
+            "evictions": self.evictions,
+            "allowed": dict(zip(ACTIONS, self.allowed)),
+            "throttled": dict(zip(ACTIONS, self.throttled)),
+        }
+
+
+throttler = Throttler()
+
+
+class ThrottlingMiddleware(BaseMiddleware):
+    """Внешняя middleware на dp.update: отбрасывает обновления сверх лимита; нужен is_admin от RoleMiddleware."""
+
+    def __init__(self, throttler: Throttler = throttler) -> None:
+        self._throttler = throttler
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        user = data.get("event_from_user")
+        if user is None or data.get("is_admin") or not isinstance(event, Update):
+            return await handler(event, data)
+
+        message = event.message
+        album = None
+        if message is not None:
+            if message.text is not None:
+                action = VIEW
+            else:
+                action = UPLOAD
+                album = message.media_group_id
+        elif event.callback_query is not None:
+            action = CALLBACK
+        else:
+            return await handler(event, data)
+
+        wait = self._throttler.hit(user.id, action, album)
+        if not wait:
+            return await handler(event, data)
+
+        if self._throttler.should_warn(user.id, action):
+            text = THROTTLED_TEXT.format(seconds=math.ceil(wait))
+            try:
+                if event.callback_query is not None:
+                    await event.callback_query.answer(text)
+                elif message.chat.type == "private":
+                    # В группе не отвечаем: предупреждение там само стало бы флудом
+                    await message.answer(text)
+            except TelegramAPIError:
+                pass
+        # Повторные нажатия не получают даже answerCallbackQuery: лишний запрос к API в волне спама дороже
+        return None
@@ -0,0 +1,174 @@
+"""
+Кэш активных билетов по пользователям для кнопки «Мои билеты».
+
+Для каждого пользователя хранится отсортированный массив номеров его активных
+билетов (array("q") — 8 байт на билет); в db ключ записи — (lottery_id, user_id).
+Записи вытесняются по LRU, когда суммарный размер превышает бюджет памяти. Кэш не перечитывает БД сам: его
+точечно обновляют функции db, меняющие билеты (добавление, смена статуса,
+архивация).
+"""
+
+import sys
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+from typing import Dict, Hashable, Iterable, List, Optional, Sequence, Tuple
+
+# Примерные накладные расходы на запись: ключ, узел OrderedDict, сам объект array
+_ENTRY_OVERHEAD = 200
+
+
+def page_of(
+    numbers: Sequence[int], after: int, before: Optional[int], limit: int
+) -> Tuple[List[int], bool, bool, int]:
+    """Страница из полного отсортированного списка номеров, как у db.get_active_tickets_page."""
+    if before is not None:
+        end = bisect_left(numbers, before)
+        start = max(0, end - limit)
+    else:
+        start = bisect_right(numbers, after)
+        end = min(len(numbers), start + limit)
+    return list(numbers[start:end]), start > 0, end < len(numbers), len(numbers)
+
+
+class UserTicketCache:
+    """
+    LRU-кэш «пользователь → отсортированные номера активных билетов».
+
+    Загрузка из БД идёт в два шага: begin_load() до запроса и finish_load()
+    после. Если за время запроса билеты пользователя менялись, результат
+    запроса считается устаревшим и в кэш не попадает.
+    """
+
+    def __init__(self, max_bytes: int, enabled: bool = True) -> None:
+        self.enabled = enabled and max_bytes > 0
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[Hashable, array]" = OrderedDict()
+        self._bytes = 0
+        # ключ -> [число незавершённых загрузок, счётчик изменений]
+        self._loading: Dict[Hashable, List[int]] = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._entries
+
+    @staticmethod
+    def _size(numbers: array) -> int:
+        return _ENTRY_OVERHEAD + sys.getsizeof(numbers)
+
+    def get(self, key: Hashable) -> Optional[array]:
+        """Номера билетов пользователя или None, если его нет в кэше (промах)."""
+        if not self.enabled:
+            return None
+        numbers = self._entries.get(key)
+        if numbers is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return numbers
+
+    def owns(self, key: Hashable, ticket_number: int) -> Optional[bool]:
+        """Есть ли у пользователя такой активный билет; None — кэш не знает."""
+        numbers = self.get(key)
+        if numbers is None:
+            return None
+        position = bisect_left(numbers, ticket_number)
+        return position < len(numbers) and numbers[position] == ticket_number
+
+    def page(
+        self, key: Hashable, after: int, before: Optional[int], limit: int
+    ) -> Optional[Tuple[List[int], bool, bool, int]]:
+        """Страница номеров как у db.get_active_tickets_page; None — пользователя нет в кэше."""
+        numbers = self.get(key)
+        if numbers is None:
+            return None
+        return page_of(numbers, after, before, limit)
+
+    def begin_load(self, key: Hashable) -> int:
+        """Отмечает начало чтения из БД и возвращает метку для finish_load()."""
+        if not self.enabled:
+            return 0
+        loading = self._loading.setdefault(key, [0, 0])
+        loading[0] += 1
+        return loading[1]
+
+    def finish_load(self, key: Hashable, token: int, ticket_numbers: Optional[Iterable[int]]) -> None:
+        """Кладёт загруженный полный список в кэш; None — загрузка не дала полного списка."""
+        if not self.enabled:
+            return
+        loading = self._loading[key]
+        loading[0] -= 1
+        if not loading[0]:
+            del self._loading[key]
+        if ticket_numbers is None or loading[1] != token or key in self._entries:
+            return
+        numbers = array("q", sorted(ticket_numbers))
+        if self._size(numbers) > self.max_bytes:
+            # Один такой список вытеснил бы весь кэш — его не кэшируем
+            return
+        self._entries[key] = numbers
+        self._bytes += self._size(numbers)
+        self._evict()
+
+    def _evict(self) -> None:
+        while self._bytes > self.max_bytes and self._entries:
+            _, numbers = self._entries.popitem(last=False)
+            self._bytes -= self._size(numbers)
+            self.evictions += 1
+
+    def _changed(self, key: Hashable) -> Optional[array]:
+        loading = self._loading.get(key)
+        if loading is not None:
+            loading[1] += 1
+        return self._entries.get(key)
+
+    def add(self, key: Hashable, ticket_number: int) -> None:
+        if not self.enabled:
+            return
+        numbers = self._changed(key)
+        if numbers is None:
+            return
+        position = bisect_left(numbers, ticket_number)
+        if position < len(numbers) and numbers[position] == ticket_number:
+            return
+        self._bytes -= self._size(numbers)
+        # Новые номера почти всегда больше всех имеющихся — это дешёвый append
+        numbers.insert(position, ticket_number)
+        self._bytes += self._size(numbers)
+        self._evict()
+
+    def discard(self, key: Hashable, ticket_number: int) -> None:
+        if not self.enabled:
+            return
+        numbers = self._changed(key)
+        if numbers is None:
+            return
+        position = bisect_left(numbers, ticket_number)
+        if position < len(numbers) and numbers[position] == ticket_number:
+            self._bytes -= self._size(numbers)
+            del numbers[position]
+            self._bytes += self._size(numbers)
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self._bytes = 0
+        for loading in self._loading.values():
+            loading[1] += 1
+
+    def stats(self) -> Dict[str, float]:
+        total = self.hits + self.misses
+        return {
+            "users": len(self._entries),
+            "bytes": self._bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "evictions": self.evictions,
+        }
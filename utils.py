@@ -1,34 +1,148 @@
 """
-Вспомогательные функции: проверки ролей, парсинг чисел, защита от параллельного розыгрыша.
+Вспомогательные функции: парсинг чисел, защита от параллельного розыгрыша.
 """
 
 import asyncio
-from typing import Iterable, Optional
+import logging
+import os
+import socket
+import time
+import uuid
+from typing import Dict, Optional
+
+from db import acquire_lease, release_lease
+
+
+logger = logging.getLogger(__name__)
+
+# Через сколько секунд блокировка упавшего воркера освобождается сама
+DRAW_LOCK_TTL = float(os.getenv("DRAW_LOCK_TTL", "30"))
+DRAW_LOCK_POLL_INTERVAL = 0.2
+# Через сколько секунд повторить продление, если база не ответила
+DRAW_LOCK_RETRY_INTERVAL = 1.0
+
+
+class LeaseLostError(Exception):
+    """Аренда блокировки истекла или перехвачена другим воркером, пока работа под ней ещё шла."""
+
+    def __init__(self, name: str) -> None:
+        super().__init__(f"Блокировка {name} потеряна")
+        self.name = name
 
 
 class DrawLock:
-    """Глобальная блокировка, чтобы исключить параллельный розыгрыш."""
+    """
+    Блокировка, чтобы исключить параллельный розыгрыш (и архивацию) одной лотереи.
+
+    Внутри процесса — asyncio.Lock, между процессами над одной базой — аренда
+    в таблице locks. Пока блокировка удерживается, аренда продлевается; если
+    процесс упал, она истечёт через DRAW_LOCK_TTL секунд.
 
-    def __init__(self) -> None:
+    Если продлить аренду не удалось до её истечения или её уже занял другой
+    воркер, блокировка считается потерянной (lost): долгая работа под ней
+    проверяет это через ensure_held() и прерывается.
+    """
+
+    def __init__(self, name: str = "draw", ttl: float = DRAW_LOCK_TTL) -> None:
         self._lock = asyncio.Lock()
+        self._name = name
+        self._ttl = ttl
+        self._owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex}"
+        self._renewal: Optional[asyncio.Task] = None
+        self._expires_at = 0.0
+        self._lost = False
 
-    async def __aenter__(self):
+    async def try_acquire(self) -> bool:
+        """Захватывает блокировку без ожидания; False — розыгрыш уже идёт здесь или в другом воркере."""
+        if self._lock.locked():
+            return False
         await self._lock.acquire()
+        started = time.monotonic()
+        try:
+            acquired = await acquire_lease(self._name, self._owner, self._ttl)
+        except BaseException:
+            self._lock.release()
+            raise
+        if not acquired:
+            self._lock.release()
+            return False
+        self._expires_at = started + self._ttl
+        self._lost = False
+        self._renewal = asyncio.create_task(self._renew())
+        return True
+
+    async def acquire(self) -> None:
+        while not await self.try_acquire():
+            await asyncio.sleep(DRAW_LOCK_POLL_INTERVAL)
+
+    async def release(self) -> None:
+        if self._renewal is not None:
+            self._renewal.cancel()
+            self._renewal = None
+        try:
+            await release_lease(self._name, self._owner)
+        finally:
+            self._lock.release()
+
+    async def _renew(self) -> None:
+        delay = self._ttl / 3
+        while True:
+            await asyncio.sleep(min(delay, max(0.0, self._expires_at - time.monotonic())))
+            started = time.monotonic()
+            try:
+                renewed = await acquire_lease(self._name, self._owner, self._ttl)
+            except Exception:
+                # База занята или недоступна: пробуем чаще, пока аренда не истекла
+                logger.exception("Не удалось продлить блокировку %s", self._name)
+                renewed = None
+            if renewed:
+                self._expires_at = started + self._ttl
+                delay = self._ttl / 3
+                continue
+            if renewed is False or time.monotonic() >= self._expires_at:
+                self._lost = True
+                logger.error("Блокировка %s потеряна: аренда истекла или занята другим воркером", self._name)
+                return
+            delay = min(self._ttl / 3, DRAW_LOCK_RETRY_INTERVAL)
+
+    def ensure_held(self) -> None:
+        """LeaseLostError, если аренда потеряна: продолжать работу под блокировкой нельзя."""
+        if self.lost:
+            raise LeaseLostError(self._name)
+
+    async def __aenter__(self):
+        await self.acquire()
         return self
 
     async def __aexit__(self, exc_type, exc, tb):
-        self._lock.release()
+        await self.release()
 
     @property
     def locked(self) -> bool:
         return self._lock.locked()
 
+    @property
+    def lost(self) -> bool:
+        # Продление могло не успеть сработать (цикл событий занят), поэтому смотрим и на срок
+        return self._lock.locked() and (self._lost or time.monotonic() >= self._expires_at)
+
+
+_draw_locks: Dict[int, DrawLock] = {}
+
 
-draw_lock = DrawLock()
+def draw_lock_for(lottery_id: int) -> DrawLock:
+    """Блокировка розыгрыша лотереи: разные лотереи разыгрываются независимо."""
+    lock = _draw_locks.get(lottery_id)
+    if lock is None:
+        lock = _draw_locks[lottery_id] = DrawLock(f"draw:{lottery_id}")
+    return lock
 
 
-def is_admin(user_id: int, admin_ids: Iterable[int]) -> bool:
-    return int(user_id) in set(int(x) for x in admin_ids)
+def forget_draw_lock(lottery_id: int) -> None:
+    """Архивированная лотерея больше не разыгрывается — её блокировка не нужна, если сейчас свободна."""
+    lock = _draw_locks.get(lottery_id)
+    if lock is not None and not lock.locked:
+        del _draw_locks[lottery_id]
 
 
 def parse_int_safe(text: str) -> Optional[int]:
@@ -0,0 +1,130 @@
+"""
+Режим webhook: локальный aiohttp-сервер за reverse proxy.
+
+Каждое обновление обрабатывается в отдельной задаче, одновременно — не больше
+WEBHOOK_CONCURRENCY. Когда все слоты заняты, запрос Telegram ждёт свободного
+слота, и нагрузка естественно притормаживается на стороне Bot API.
+"""
+
+import asyncio
+import hmac
+import logging
+from typing import Any, Dict, Set
+
+from aiohttp import web
+from aiogram import Bot, Dispatcher
+from aiogram.types import Update
+
+from config import Settings
+from db import get_user_tickets_cache_stats
+from outbox import outbox
+
+
+logger = logging.getLogger(__name__)
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+class UpdateProcessor:
+    """Пул обработки обновлений с ограничением числа одновременно выполняемых задач."""
+
+    def __init__(self, dp: Dispatcher, bot: Bot, concurrency: int) -> None:
+        self._dp = dp
+        self._bot = bot
+        self._slots = asyncio.Semaphore(concurrency)
+        self._tasks: Set[asyncio.Task] = set()
+        self.processed = 0
+        self.failed = 0
+
+    @property
+    def in_flight(self) -> int:
+        return len(self._tasks)
+
+    async def submit(self, update: Update) -> None:
+        """Ждёт свободный слот и запускает обработку, не дожидаясь её окончания."""
+        await self._slots.acquire()
+        task = asyncio.create_task(self._process(update))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _process(self, update: Update) -> None:
+        try:
+            await self._dp.feed_update(self._bot, update)
+            self.processed += 1
+        except Exception:
+            self.failed += 1
+            logger.exception("Ошибка обработки обновления %s", update.update_id)
+        finally:
+            self._slots.release()
+
+    async def drain(self, timeout: float = 30.0) -> None:
+        if self._tasks:
+            await asyncio.wait(set(self._tasks), timeout=timeout)
+
+
+def build_app(dp: Dispatcher, bot: Bot, settings: Settings, processor: UpdateProcessor) -> web.Application:
+    async def handle_update(request: web.Request) -> web.Response:
+        token = request.headers.get(SECRET_HEADER, "")
+        if not hmac.compare_digest(token, settings.webhook_secret):
+            return web.Response(status=401)
+        try:
+            payload = await request.json()
+            update = Update.model_validate(payload, context={"bot": bot})
+        except Exception:
+            return web.Response(status=400)
+        await processor.submit(update)
+        return web.Response()
+
+    async def health(request: web.Request) -> web.Response:
+        data: Dict[str, Any] = {
+            "status": "ok",
+            "in_flight": processor.in_flight,
+            "processed": processor.processed,
+            "failed": processor.failed,
+            "outbox": len(outbox),
+            "user_tickets_cache": get_user_tickets_cache_stats(),
+        }
+        return web.json_response(data)
+
+    app = web.Application()
+    app.router.add_post(settings.webhook_path, handle_update)
+    app.router.add_get("/healthz", health)
+    return app
+
+
+async def run_webhook(dp: Dispatcher, bot: Bot, settings: Settings, register: bool = True) -> None:
+    """
+    Поднимает сервер, регистрирует webhook в Telegram и работает до отмены.
+
+    При нескольких воркерах все слушают один порт (SO_REUSEPORT), а webhook
+    регистрирует только один из них (register=True).
+    """
+    processor = UpdateProcessor(dp, bot, settings.webhook_concurrency)
+    runner = web.AppRunner(build_app(dp, bot, settings, processor))
+    await runner.setup()
+    site = web.TCPSite(
+        runner,
+        settings.webhook_host,
+        settings.webhook_port,
+        reuse_port=settings.workers > 1,
+    )
+
+    workflow_data = {"dispatcher": dp, "bots": [bot], **dp.workflow_data}
+    workflow_data.pop("bot", None)
+    await dp.emit_startup(bot=bot, **workflow_data)
+    try:
+        await site.start()
+        if register:
+            await bot.set_webhook(
+                url=settings.webhook_url.rstrip("/") + settings.webhook_path,
+                secret_token=settings.webhook_secret,
+                allowed_updates=dp.resolve_used_update_types(),
+                max_connections=min(100, settings.webhook_concurrency * settings.workers),
+            )
+        logger.info("Webhook слушает %s:%s%s", settings.webhook_host, settings.webhook_port, settings.webhook_path)
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
+        await processor.drain()
+        await dp.emit_shutdown(bot=bot, **workflow_data)
+        await bot.session.close()